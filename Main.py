@@ -9,6 +9,7 @@ Provides the same functionality as the web interface in a terminal format.
 import os
 
 from src.data_handling.Data_loader import DataManager
+from src.data_handling.Persistence_queue import flush_pending_writes
 
 # Global data manager instance
 data_manager = DataManager()
@@ -27,11 +28,9 @@ def upload_and_format_dataset():
     try:
         print("Formatting uploaded dataset...")
         from src.data_handling.Format_data import format_for_gliomascope
-        format_for_gliomascope(expr_path, meta_path, expr_id, meta_id)
+        cleaned_expr, cleaned_meta = format_for_gliomascope(expr_path, meta_path, expr_id, meta_id)
         print("Formatting complete. Loading cleaned data into GliomaScope...")
 
-        cleaned_expr = "cleaned_data/expression.csv"
-        cleaned_meta = "cleaned_data/metadata.csv"
         data_manager.load_expression(cleaned_expr)
         data_manager.load_file_smart(cleaned_meta)
         print("Data successfully loaded.")
@@ -76,11 +75,11 @@ def print_introduction():
 
 def print_menu():
     """Print the main menu options."""
-        print("\n=== GliomaScope CLI ===")
-        print("1. Download + load GEO dataset by ID")
-        print("2. Format dataset (upload .csv/.tsv) and select to load")
-        print("3. Upload metadata file")
-        print("4. Upload expression file")
+    print("\n=== GliomaScope CLI ===")
+    print("1. Download + load GEO dataset by ID")
+    print("2. Format dataset (upload .csv/.tsv) and select to load")
+    print("3. Upload metadata file")
+    print("4. Upload expression file")
     print("5. Data Exploration & Filtering")
     print("6. Geographic Visualisation")
     print("7. Visualise PCA")
@@ -89,50 +88,73 @@ def print_menu():
     print("10. Explore individual gene expression")
     print("11. Chromosomal gene mapping")
     print("12. Heatmap visualisation for gene sets")
-    print("13. Exit")
+    print("13. Append new samples to expression data")
+    print("14. Exit")
 
 
 def handle_geo_download():
     """Handle GEO dataset download."""
     from src.utils.Utils import fetch_and_format_geo, display_and_log_summary
 
-            geo_id = input("Enter GEO Accession ID (e.g. GSE15824): ").strip()
+    geo_id = input("Enter GEO Accession ID (e.g. GSE15824): ").strip()
     print("Loading dataset...")
 
-            # Fetch DataFrames
-            meta_df, expr_df = fetch_and_format_geo(geo_id)
+    # Fetch DataFrames
+    meta_df, expr_df = fetch_and_format_geo(geo_id)
 
-            if meta_df is None or expr_df is None:
+    if meta_df is None or expr_df is None:
         print("Failed to load GEO dataset.")
-                return
+        return
 
-    # Load into data manager
+    # Load into data manager (expr_df is an ExpressionStore when the series came from the GEO cache)
     data_manager.metadata = meta_df
-    data_manager.expression = expr_df
+    data_manager.load_expression_df(expr_df)
 
     # Display summary
-    display_and_log_summary(meta_df, expr_df, geo_id)
+    display_and_log_summary(meta_df, f"{geo_id}_metadata")
     print("Dataset loaded successfully!")
 
 
 def handle_data_upload():
     """Handle data file uploads."""
     from src.data_handling.FileUploadHandler import process_upload
+    from src.data_handling.Series_matrix import is_series_matrix
 
     print("\n=== Data Upload ===")
-    file_path = input("Enter path to file (.csv/.tsv): ").strip()
+    file_path = input("Enter path to file (.csv/.tsv or a GEO _series_matrix.txt.gz): ").strip()
 
     if not os.path.exists(file_path):
         print("File not found!")
         return
 
     try:
-        process_upload(file_path, data_manager)
+        if is_series_matrix(file_path):
+            # Sample annotations and the expression table come from the same file
+            if data_manager.load_series_matrix(file_path) is None:
+                return
+        else:
+            process_upload(file_path, data_manager)
         print("File uploaded and processed successfully!")
     except Exception as e:
         print(f"Error uploading file: {e}")
 
 
+def handle_sample_append():
+    """Append a batch of new samples to the loaded expression data."""
+    if data_manager.expression_store is None:
+        print("Please load expression data first.")
+        return
+
+    print("\n=== Append Samples ===")
+    file_path = input("Enter path to the new samples file (.csv/.tsv): ").strip()
+    method = input("Missing values - fill_zero, fill_mean, fill_median, knn or drop (default: fill_zero): ").strip() or 'fill_zero'
+
+    try:
+        data_manager.append_samples(file_path, missing_method=method)
+    except Exception as e:
+        print(f"Error appending samples: {e}")
+
+
 def handle_data_exploration():
     """Handle data exploration and filtering."""
     if data_manager.metadata is None and data_manager.expression is None:
@@ -178,9 +200,22 @@ def handle_geographic_visualization():
         print(f"Error generating map: {e}")
 
 
+def choose_expression_data():
+    """Ask whether to analyse probe columns or gene-level columns; returns the matching expression data."""
+    from src.data_handling.Gene_collapse import COLLAPSE_METHODS
+
+    print("Expression level: [Enter] probes as loaded, or a gene-level collapse:")
+    for i, method in enumerate(COLLAPSE_METHODS, 1):
+        print(f"   {i}. genes ({method.replace('_', '-')})")
+    choice = input("Choose expression level: ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(COLLAPSE_METHODS):
+        return data_manager.expression_for('gene', COLLAPSE_METHODS[int(choice) - 1])
+    return data_manager.expression_data
+
+
 def handle_pca_visualization():
     """Handle PCA visualization."""
-            if data_manager.expression is None:
+    if data_manager.expression is None:
         print("No expression data loaded. Please upload expression data first.")
         return
 
@@ -193,7 +228,8 @@ def handle_pca_visualization():
         color_by = "default"
 
     try:
-        plot_pca(data_manager.expression, data_manager.metadata, color_by)
+        plot_pca(choose_expression_data(), data_manager.metadata, color_by,
+                 alignment=data_manager.alignment)
         print("PCA plot generated successfully!")
     except Exception as e:
         print(f"Error generating PCA plot: {e}")
@@ -214,9 +250,10 @@ def handle_umap_visualization():
         color_by = "default"
 
     try:
-        plot_umap(data_manager.expression, data_manager.metadata, color_by)
+        plot_umap(choose_expression_data(), data_manager.metadata, color_by,
+                  alignment=data_manager.alignment)
         print("UMAP plot generated successfully!")
-                except Exception as e:
+    except Exception as e:
         print(f"Error generating UMAP plot: {e}")
 
 
@@ -231,7 +268,7 @@ def handle_differential_expression():
     print("\n=== Differential Expression Analysis ===")
 
     # Get available columns
-                available_cols = [col for col in data_manager.metadata.columns if col != 'Sample']
+    available_cols = [col for col in data_manager.metadata.columns if col != 'Sample']
     print(f"Available grouping columns: {', '.join(available_cols)}")
 
     group_col = input("Enter grouping column name: ").strip()
@@ -253,11 +290,11 @@ def handle_differential_expression():
 
     try:
         perform_differential_expression(
-            data_manager.expression, data_manager.metadata,
-            group_col, group1, group2
+            choose_expression_data(), data_manager.metadata,
+            group_col, group1, group2, alignment=data_manager.alignment
         )
         print("Differential expression analysis completed!")
-                except Exception as e:
+    except Exception as e:
         print(f"Error in differential expression analysis: {e}")
 
 
@@ -268,46 +305,35 @@ def handle_gene_expression():
         return
 
     from src.analysis.Gene_explorer import explore_gene_expression
-    from src.utils.Utils import get_all_available_genes, load_gene_annotations
+    from src.utils.Utils import get_all_available_genes, load_gene_annotations, named_genes, search_named_genes
 
     print("\n=== Gene Expression Analysis ===")
     print("This tool lets you explore expression patterns of individual genes.")
 
     # Get available genes
     annotations = load_gene_annotations()
-    all_genes_mapping = get_all_available_genes(data_manager.expression, annotations)
-
-    # Create a unique list of GENE NAMES only (no probe IDs)
-    unique_genes = {}  # gene_name -> probe_id
-    display_names = []  # For numbered display (gene names only)
-    probe_list = []     # Corresponding probe IDs
-
-    # Collect only genes with known names
-    for probe_id in data_manager.expression.columns:
-        if probe_id != 'Sample':
-            if annotations is not None:
-                from src.utils.Utils import map_probe_to_gene
-                mapped_name = map_probe_to_gene(probe_id, annotations)
-                if mapped_name != probe_id:
-                    if mapped_name not in unique_genes:
-                        unique_genes[mapped_name] = probe_id
-                        display_names.append(mapped_name)
-                        probe_list.append(probe_id)
-
-    # Sort gene names alphabetically
-    sorted_genes = sorted(zip(display_names, probe_list))
-    display_names = [gene for gene, probe in sorted_genes]
-    probe_list = [probe for gene, probe in sorted_genes]
+    all_genes_mapping = get_all_available_genes(data_manager.expression_data, annotations)
+
+    # Gene names only (first probe of each), sorted alphabetically, from the annotation index
+    display_names, probe_list = named_genes(data_manager.expression_data, annotations)
 
     if len(display_names) == 0:
         print("ERROR: No genes with known names found in this dataset.")
         print("This dataset may not have gene annotation information.")
         return
 
+    # Optionally narrow the list to the genes matching a search
+    query = input("\nSearch genes by symbol, name or probe ID (Enter to browse all): ").strip()
+    if query:
+        display_names, probe_list = search_named_genes(data_manager.expression_data, query, annotations)
+        if len(display_names) == 0:
+            print(f"No genes match '{query}'.")
+            return
+
     print("\nAVAILABLE GENES FOR EXPRESSION ANALYSIS")
     print("=" * 60)
-    print(f"Total genes with known names: {len(display_names):,}")
-    print("(Sorted alphabetically for easy browsing)")
+    print(f"Total genes: {len(display_names):,}")
+    print("(Best matches first)" if query else "(Sorted alphabetically for easy browsing)")
 
     # Show gene names with pagination
     for i, gene_name in enumerate(display_names, 1):
@@ -348,25 +374,25 @@ def handle_gene_expression():
             else:
                 print(f"Invalid number. Please enter 1-{len(probe_list)}.")
                 return
-            else:
+        else:
             # User entered gene name or probe ID
             gene_name = user_input
             gene_upper = user_input.upper()
 
             if user_input in data_manager.expression.columns:
-                        # Already a probe ID
+                # Already a probe ID
                 probe_id = user_input
                 print(f"SUCCESS: Using probe ID: '{user_input}'")
-                    elif gene_upper in all_genes_mapping:
-                        # Found gene name in mapping
-                        probe_id = all_genes_mapping[gene_upper]
+            elif gene_upper in all_genes_mapping:
+                # Found gene name in mapping
+                probe_id = all_genes_mapping[gene_upper]
                 print(f"SUCCESS: Mapped '{user_input}' to probe ID '{probe_id}'")
-                    else:
+            else:
                 print(f"ERROR: Gene '{user_input}' not found.")
                 return
 
         # Get grouping column
-                    available_cols = [col for col in data_manager.metadata.columns if col != 'Sample']
+        available_cols = [col for col in data_manager.metadata.columns if col != 'Sample']
         print(f"\nAvailable grouping columns: {', '.join(available_cols)}")
         group_col = input("Enter grouping column name: ").strip()
 
@@ -376,14 +402,14 @@ def handle_gene_expression():
 
         # Generate the plot
         explore_gene_expression(
-            data_manager.expression, data_manager.metadata,
-            probe_id, group_col
+            data_manager.expression_data, data_manager.metadata,
+            probe_id, group_col, alignment=data_manager.alignment
         )
         print("Gene expression plot generated successfully!")
-                    
-                except Exception as e:
-                    print(f"ERROR: Error occurred while exploring gene expression: {e}")
-                    print("TIP: Make sure your data is properly loaded and formatted")
+
+    except Exception as e:
+        print(f"ERROR: Error occurred while exploring gene expression: {e}")
+        print("TIP: Make sure your data is properly loaded and formatted")
 
 
 def handle_chromosome_mapping():
@@ -393,7 +419,7 @@ def handle_chromosome_mapping():
         return
 
     from src.analysis.Gene_explorer import map_gene_to_chromosome
-    from src.utils.Utils import get_all_available_genes, load_gene_annotations
+    from src.utils.Utils import get_all_available_genes, load_gene_annotations, named_genes, search_named_genes
 
     print("\nCHROMOSOMAL GENE MAPPING")
     print("=" * 60)
@@ -401,40 +427,29 @@ def handle_chromosome_mapping():
     print("chromosome ideograms with gene positions.")
 
     # Get available genes
-                    annotations = load_gene_annotations()
-                    all_genes_mapping = get_all_available_genes(data_manager.expression, annotations)
-                    
-    # Create a unique list of GENE NAMES only
-    unique_genes = {}  # gene_name -> probe_id
-    display_names = []  # For numbered display (gene names only)
-    probe_list = []     # Corresponding probe IDs
-
-    # Collect only genes with known names
-    for probe_id in data_manager.expression.columns:
-        if probe_id != 'Sample':
-            if annotations is not None:
-                from src.utils.Utils import map_probe_to_gene
-                mapped_name = map_probe_to_gene(probe_id, annotations)
-                if mapped_name != probe_id:
-                    if mapped_name not in unique_genes:
-                        unique_genes[mapped_name] = probe_id
-                        display_names.append(mapped_name)
-                        probe_list.append(probe_id)
-
-    # Sort gene names alphabetically
-    sorted_genes = sorted(zip(display_names, probe_list))
-    display_names = [gene for gene, probe in sorted_genes]
-    probe_list = [probe for gene, probe in sorted_genes]
+    annotations = load_gene_annotations()
+    all_genes_mapping = get_all_available_genes(data_manager.expression_data, annotations)
+
+    # Gene names only (first probe of each), sorted alphabetically, from the annotation index
+    display_names, probe_list = named_genes(data_manager.expression_data, annotations)
 
     if len(display_names) == 0:
         print("ERROR: No genes with known names found in this dataset.")
         print("This dataset may not have gene annotation information.")
         return
 
+    # Optionally narrow the list to the genes matching a search
+    query = input("\nSearch genes by symbol, name or probe ID (Enter to browse all): ").strip()
+    if query:
+        display_names, probe_list = search_named_genes(data_manager.expression_data, query, annotations)
+        if len(display_names) == 0:
+            print(f"No genes match '{query}'.")
+            return
+
     print("\nAVAILABLE GENES FOR CHROMOSOME MAPPING")
     print("=" * 60)
-    print(f"Total genes with known names: {len(display_names):,}")
-    print("(Sorted alphabetically for easy browsing)")
+    print(f"Total genes: {len(display_names):,}")
+    print("(Best matches first)" if query else "(Sorted alphabetically for easy browsing)")
 
     # Show gene names with pagination
     for i, gene_name in enumerate(display_names, 1):
@@ -481,20 +496,36 @@ def handle_chromosome_mapping():
             gene_upper = user_input.upper()
 
             if user_input in data_manager.expression.columns:
-                        # Already a probe ID
+                # Already a probe ID
                 probe_id = user_input
                 print(f"SUCCESS: Using probe ID: '{user_input}'")
-                    elif gene_upper in all_genes_mapping:
-                        # Found gene name in mapping
-                        probe_id = all_genes_mapping[gene_upper]
+            elif gene_upper in all_genes_mapping:
+                # Found gene name in mapping
+                probe_id = all_genes_mapping[gene_upper]
                 print(f"SUCCESS: Mapped '{user_input}' to probe ID '{probe_id}'")
-                    else:
+            else:
                 print(f"ERROR: Gene '{user_input}' not found.")
                 return
 
-        # Generate the chromosome map
-        map_gene_to_chromosome(data_manager.expression, probe_id)
-        print("Chromosome mapping completed successfully!")
+        # Generate the chromosome map from the gene symbol (probe IDs are mapped through the annotations)
+        symbol = annotations.symbol(probe_id, gene_name) if annotations is not None else gene_name
+        # Local reference first; the prompt below decides what to fetch from Ensembl
+        location = map_gene_to_chromosome(symbol, online=False)
+        if location is None:
+            refresh = input("Look it up on Ensembl and add it to the local reference: "
+                            "[g]ene only, [a]ll genes of this dataset (bulk), or Enter to skip: ").strip().lower()
+            if refresh not in ('g', 'a'):
+                return
+            if refresh == 'a':
+                # One bulk request per 1000 symbols; symbols looked up before come from the cache
+                from src.data_handling.Genome_reference import genome_reference
+                genome_reference().refresh_from_ensembl(set(display_names) | {symbol},
+                                                        bands=not genome_reference().has_bands)
+                location = map_gene_to_chromosome(symbol, online=False)
+            else:
+                location = map_gene_to_chromosome(symbol, refresh=True)
+        if location is not None:
+            print("Chromosome mapping completed successfully!")
 
     except Exception as e:
         print(f"ERROR: Error occurred while mapping gene to chromosome: {e}")
@@ -505,10 +536,10 @@ def handle_heatmap_visualization():
     """Handle heatmap visualization."""
     if data_manager.expression is None or data_manager.metadata is None:
         print("Both expression and metadata required. Please upload both first.")
-                        return
-                    
+        return
+
     from src.visualization.Heatmap_visualisation import plot_expression_heatmap
-    from src.utils.Utils import get_all_available_genes, load_gene_annotations
+    from src.utils.Utils import get_all_available_genes, load_gene_annotations, named_genes, search_named_genes
 
     print("\nHEATMAP VISUALIZATION")
     print("=" * 60)
@@ -517,39 +548,28 @@ def handle_heatmap_visualization():
 
     # Get available genes
     annotations = load_gene_annotations()
-    all_genes_mapping = get_all_available_genes(data_manager.expression, annotations)
-
-    # Create a unique list of GENE NAMES only
-    unique_genes = {}  # gene_name -> probe_id
-    display_names = []  # For numbered display (gene names only)
-    probe_list = []     # Corresponding probe IDs
-
-    # Collect only genes with known names
-    for probe_id in data_manager.expression.columns:
-        if probe_id != 'Sample':
-            if annotations is not None:
-                from src.utils.Utils import map_probe_to_gene
-                mapped_name = map_probe_to_gene(probe_id, annotations)
-                if mapped_name != probe_id:
-                    if mapped_name not in unique_genes:
-                        unique_genes[mapped_name] = probe_id
-                        display_names.append(mapped_name)
-                        probe_list.append(probe_id)
-
-    # Sort gene names alphabetically
-    sorted_genes = sorted(zip(display_names, probe_list))
-    display_names = [gene for gene, probe in sorted_genes]
-    probe_list = [probe for gene, probe in sorted_genes]
+    all_genes_mapping = get_all_available_genes(data_manager.expression_data, annotations)
+
+    # Gene names only (first probe of each), sorted alphabetically, from the annotation index
+    display_names, probe_list = named_genes(data_manager.expression_data, annotations)
 
     if len(display_names) == 0:
         print("ERROR: No genes with known names found in this dataset.")
         print("This dataset may not have gene annotation information.")
         return
 
+    # Optionally narrow the list to the genes matching a search
+    query = input("\nSearch genes by symbol, name or probe ID (Enter to browse all): ").strip()
+    if query:
+        display_names, probe_list = search_named_genes(data_manager.expression_data, query, annotations)
+        if len(display_names) == 0:
+            print(f"No genes match '{query}'.")
+            return
+
     print("\nAVAILABLE GENES FOR HEATMAP VISUALIZATION")
     print("=" * 60)
-    print(f"Total genes with known names: {len(display_names):,}")
-    print("(Sorted alphabetically for easy browsing)")
+    print(f"Total genes: {len(display_names):,}")
+    print("(Best matches first)" if query else "(Sorted alphabetically for easy browsing)")
 
     # Show gene names with pagination
     for i, gene_name in enumerate(display_names, 1):
@@ -614,13 +634,13 @@ def handle_heatmap_visualization():
 
     try:
         # Generate the heatmap
-                    plot_expression_heatmap(
-            data_manager.expression, data_manager.metadata,
-            gene_list, group_col
+        plot_expression_heatmap(
+            choose_expression_data(), data_manager.metadata,
+            gene_list, group_col, alignment=data_manager.alignment
         )
         print("Heatmap generated successfully!")
 
-                except Exception as e:
+    except Exception as e:
         print(f"ERROR: Error occurred while generating heatmap: {e}")
         print("TIP: Make sure your data is properly loaded and formatted")
 
@@ -633,7 +653,7 @@ def main_menu():
 
     while True:
         print_menu()
-        choice = input("Enter your choice (1-13): ").strip()
+        choice = input("Enter your choice (1-14): ").strip()
 
         if choice == '1':
             handle_geo_download()
@@ -660,14 +680,18 @@ def main_menu():
         elif choice == '12':
             handle_heatmap_visualization()
         elif choice == '13':
+            handle_sample_append()
+        elif choice == '14':
+            # Datasets are saved in the background; make sure they are on disk before leaving
+            flush_pending_writes()
             print("\nThank you for using GliomaScope!")
             print("Empowering you to explore and understand at the genomic level.")
             break
         else:
-            print("Invalid choice. Please enter a number between 1 and 13.")
+            print("Invalid choice. Please enter a number between 1 and 14.")
 
         input("\nPress Enter to continue...")
 
 
 if __name__ == "__main__":
-        main_menu()
+    main_menu()
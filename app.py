@@ -1,6 +1,7 @@
 from flask import Flask, render_template, request, jsonify, send_file, session, send_from_directory
 from werkzeug.utils import secure_filename
 import os
+import shutil
 import pandas as pd
 import json
 import tempfile
@@ -14,7 +15,20 @@ import time
 
 # Import all the existing modules
 from src.data_handling.Data_loader import DataManager
-from src.utils.Utils import process_upload, list_available_genes, filter_metadata
+from src.data_handling.Workspace_cache import (save_workspace, load_workspace, workspace_exists, export_csv,
+                                               workspace_path, store_path, save_expression_store,
+                                               load_expression_store)
+from src.data_handling.Dataset_registry import DatasetRegistry, save_and_hash, dataset_key
+from src.data_handling.Workspace_manager import WorkspaceManager, DEFAULT_DATASET
+from src.data_handling.Persistence_queue import persistence_queue
+from src.data_handling.Geo_cache import geo_cache
+from src.data_handling.Series_matrix import is_series_matrix
+from src.data_handling.Gene_annotation import expression_probes
+from src.data_handling.Gene_search import gene_search_index, SEARCH_PAGE_SIZE
+from src.data_handling.Gene_collapse import DEFAULT_COLLAPSE_METHOD
+from src.utils.Ingest import data_extension
+from src.utils.Utils import (process_upload, list_available_genes, filter_metadata,
+                             category_value_counts, isin_mask, contains_mask)
 from src.data_handling.Explore_data import preview_dataframe, display_summary, warn_if_missing_columns
 from src.visualization.Dimensionality_Reduction import plot_pca
 from src.visualization.Patient_geomap import plot_patient_geomap, plot_study_summary
@@ -33,11 +47,25 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+# The limit applies to the bytes sent: .gz/.bz2/.xz/.zst uploads are stored compressed and decoded
+# block by block while parsing, so a compressed upload can hold several times more data
+MAX_UPLOAD_MB = int(os.environ.get('GLIOMASCOPE_MAX_UPLOAD_MB', 100))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024  # max upload size (compressed bytes)
 
-# Global data manager
+# Global data manager: the active dataset of the workspace
 data_manager = DataManager()
 
+# Several named datasets (uploads + GEO series) under a memory budget; the least recently
+# used ones spill to cleaned_data/workspaces/ and are memory-mapped back when switched to
+WORKSPACE_MEMORY_MB = int(os.environ.get('GLIOMASCOPE_WORKSPACE_MB', 1024))
+workspace = WorkspaceManager(memory_budget=WORKSPACE_MEMORY_MB * 1024 ** 2)
+workspace.add(DEFAULT_DATASET, data_manager)
+
+# Cleaned uploads keyed by content hash, so re-uploading the same file skips parsing
+dataset_registry = DatasetRegistry()
+# Missing-value handling for uploads (fill_zero, fill_mean, fill_median, knn or drop)
+UPLOAD_MISSING_METHOD = os.environ.get('GLIOMASCOPE_MISSING_METHOD', 'fill_zero')
+
 # Performance caching system
 _data_cache = {
     'metadata_stats': None,
@@ -48,23 +76,133 @@ _data_cache = {
     'cache_ttl': 300  # 5 minutes cache TTL
 }
 
+def _load_saved_dataset(kind):
+    """Load the saved workspace for a dataset kind, falling back to a legacy CSV"""
+    df = load_workspace(f'{kind}_cleaned')
+    if df is not None:
+        return df
+
+    legacy_csv = f'cleaned_data/{kind}_cleaned.csv'
+    if os.path.exists(legacy_csv):
+        print(f"Migrating {legacy_csv} to the binary workspace format...")
+        return pd.read_csv(legacy_csv)
+    return None
+
+def _missing_values(kind):
+    """Missing-value count; for expression these are the originally missing (since imputed) cells in the store's bitmap"""
+    if kind == 'expression' and data_manager.expression_store is not None:
+        return data_manager.expression_store.missing_count()
+    df = data_manager.metadata if kind == 'metadata' else data_manager.expression
+    return int(df.isnull().sum().sum())
+
+def _upload_summary(kind):
+    """Shape/columns/missing/preview summary returned by /upload for one loaded dataset"""
+    df = data_manager.metadata if kind == 'metadata' else data_manager.expression
+    return {
+        'shape': [int(x) for x in df.shape],
+        'columns': list(df.columns),
+        'missing_values': _missing_values(kind),
+        'preview': df.head().to_html()
+    }
+
+def _save_and_register(kind, manager, snapshot, registry_key, source_name, stats, params):
+    """Background job: write the cleaned upload to the workspace, then add it to the registry"""
+    if kind == 'metadata':
+        saved_path = save_workspace(snapshot, 'metadata_cleaned', kind='metadata')
+    else:
+        saved_path = save_expression_store(snapshot, 'expression_cleaned')
+        # Switch to the memory-mapped copy (under the manager's lock), unless another upload
+        # replaced the data meanwhile
+        manager.adopt_saved_store(snapshot, load_expression_store('expression_cleaned'))
+    try:
+        dataset_registry.put(registry_key, kind, saved_path, source_name=source_name, stats=stats, params=params)
+    except Exception as e:
+        # The upload itself succeeded; only the cache entry is missing
+        print(f"[!] Could not register dataset: {e}")
+
+def _persist_upload(kind, registry_key, source_name, stats, params):
+    """Queue the write of the dataset just parsed (the upload response does not wait for it)"""
+    snapshot = data_manager.metadata if kind == 'metadata' else data_manager.expression_store
+    if snapshot is None:
+        return
+    if kind == 'metadata':
+        # The writer gets its own frame: later column changes on the live table do not reach it
+        snapshot = snapshot.copy(deep=False)
+    persistence_queue.submit(f'{kind}_cleaned', _save_and_register, kind, data_manager, snapshot,
+                             registry_key, source_name, stats, params, version=registry_key)
+
+def _restore_registered_dataset(registry_key, filepath):
+    """Load an already-cleaned upload from the dataset registry; returns the entry or None"""
+    # A queued write of the same workspace file has to land before it is replaced
+    persistence_queue.wait('metadata_cleaned')
+    persistence_queue.wait('expression_cleaned')
+    entry = dataset_registry.get(registry_key)
+    if entry is None:
+        return None
+
+    if entry['kind'] == 'metadata':
+        entry, metadata = dataset_registry.restore(registry_key, workspace_path('metadata_cleaned'))
+        data_manager.metadata = metadata
+        data_manager.metadata_path = filepath
+    else:
+        entry, store = dataset_registry.restore(registry_key, store_path('expression_cleaned'))
+        data_manager.set_expression_store(store)
+        data_manager.expression_path = filepath
+    print(f"[✓] Restored cleaned {entry['kind']} from the dataset registry (hit {entry['hits']})")
+    data_manager._try_align()
+    return entry
+
+def _clear_data_cache():
+    for key in ('metadata_stats', 'expression_stats', 'metadata_preview', 'expression_preview'):
+        _data_cache[key] = None
+    _data_cache['cache_time'] = 0
+
+def _pending_write_keys(name):
+    """Background write keys (persistence_queue) that hold data of a workspace dataset"""
+    if name == DEFAULT_DATASET:
+        return ['metadata_cleaned', 'expression_cleaned']
+    return [f'workspace/{name}', f'geo_cache/{name.upper()}']
+
+def _activate_dataset(name):
+    """Make a workspace dataset the one every route works on (reloaded from disk if spilled)"""
+    global data_manager
+    data_manager = workspace.activate(name)
+    _clear_data_cache()
+    print(f"[✓] Active dataset: {name}")
+    return data_manager
+
 def reload_data_if_needed():
-    """Reload data from saved files if data manager is empty (optimized)"""
+    """Reload data from the saved workspace if data manager is empty (optimized)"""
     global _data_cache
     
+    # The *_cleaned workspace files belong to the uploads dataset; GEO datasets live in the workspace
+    if workspace.active_name != DEFAULT_DATASET:
+        return
+    
     # Only reload if data is actually missing
-    if data_manager.metadata is None and os.path.exists('cleaned_data/metadata_cleaned.csv'):
-        print("Reloading metadata from saved file...")
-        data_manager.metadata = pd.read_csv('cleaned_data/metadata_cleaned.csv')
-        session['metadata_loaded'] = True
-        # Clear cache when new data is loaded
-        _data_cache['metadata_stats'] = None
-        _data_cache['metadata_preview'] = None
-        _data_cache['cache_time'] = 0
+    if data_manager.metadata is None:
+        metadata = _load_saved_dataset('metadata')
+        if metadata is not None:
+            print("Reloading metadata from saved workspace...")
+            data_manager.metadata = metadata
+            if not workspace_exists('metadata_cleaned'):
+                save_workspace(metadata, 'metadata_cleaned', kind='metadata')
+            session['metadata_loaded'] = True
+            # Clear cache when new data is loaded
+            _data_cache['metadata_stats'] = None
+            _data_cache['metadata_preview'] = None
+            _data_cache['cache_time'] = 0
     
-    if data_manager.expression is None and os.path.exists('cleaned_data/expression_cleaned.csv'):
-        print("Reloading expression from saved file...")
-        data_manager.expression = pd.read_csv('cleaned_data/expression_cleaned.csv')
+    if data_manager.expression is None:
+        if data_manager.load_expression_workspace():
+            print("Reloading expression from saved store...")
+        else:
+            expression = _load_saved_dataset('expression')
+            if expression is None:
+                return
+            print("Migrating saved expression data to the memory-mapped store...")
+            data_manager.expression = expression
+            data_manager.save_expression_workspace()
         session['expression_loaded'] = True
         # Clear cache when new data is loaded
         _data_cache['expression_stats'] = None
@@ -391,7 +529,8 @@ def create_world_map(metadata_df=None, map_type='individual', zoom_enabled=False
     return fig
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'csv', 'tsv', 'txt'}
+    # Plain or compressed text (data.csv, GSE4290_series_matrix.txt.gz, export.csv.zst, ...)
+    return '.' in filename and data_extension(filename) in {'.csv', '.tsv', '.txt'}
 
 def create_plot_html(plot_func, *args, **kwargs):
     """Helper function to capture plotly plots and return HTML"""
@@ -430,55 +569,72 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
+        # Uploads always go into the uploads dataset (GEO datasets stay as they are)
+        if workspace.active_name != DEFAULT_DATASET:
+            _activate_dataset(DEFAULT_DATASET)
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Hash the upload while writing it, then look for an identical upload parsed earlier
+        content_hash = save_and_hash(file.stream, filepath)
+        if is_series_matrix(filepath):
+            # A series matrix holds both tables; each is registered under its own key
+            registry_keys = {kind: dataset_key(content_hash, file_type='series_matrix',
+                                               missing_method=UPLOAD_MISSING_METHOD, part=kind)
+                             for kind in ('metadata', 'expression')}
+        else:
+            registry_keys = {file_type: dataset_key(content_hash, file_type=file_type,
+                                                    missing_method=UPLOAD_MISSING_METHOD)}
         
         try:
-            detected_type = None
-            
-            if file_type == 'metadata' or file_type == 'auto':
-                data_manager.load_file_smart(filepath)
+            entries = {}
+            for registry_key in registry_keys.values():
+                entry = _restore_registered_dataset(registry_key, filepath)
+                if entry is None:
+                    break
+                entries[entry['kind']] = entry
+            if entries and len(entries) == len(registry_keys):
+                detected_type = 'series_matrix' if len(entries) == 2 else next(iter(entries))
+            else:
+                entries = {}
+                # The file is classified from its header and parsed exactly once
+                detected_type = data_manager.load_file_smart(filepath, missing_method=UPLOAD_MISSING_METHOD,
+                                                             file_type=file_type)
+                if detected_type is None:
+                    return jsonify({'error': 'Could not determine the file type. Please check its structure.'}), 400
+            loaded_kinds = ('metadata', 'expression') if detected_type == 'series_matrix' else (detected_type,)
+
+            if 'metadata' in loaded_kinds:
                 session['metadata_loaded'] = True
                 session['metadata_path'] = filepath
-                detected_type = 'metadata'
-                
-                # Save metadata to cleaned_data folder for persistence
-                if data_manager.metadata is not None:
-                    data_manager.metadata.to_csv('cleaned_data/metadata_cleaned.csv', index=False)
-            
-            if file_type == 'expression' or file_type == 'auto':
-                data_manager.load_file_smart(filepath)
+            if 'expression' in loaded_kinds:
                 session['expression_loaded'] = True
                 session['expression_path'] = filepath
-                detected_type = 'expression'
-                
-                # Save expression to cleaned_data folder for persistence
-                if data_manager.expression is not None:
-                    data_manager.expression.to_csv('cleaned_data/expression_cleaned.csv', index=False)
-            
-            # Get data summary
+
+            # Get data summary (the registry keeps the stats of the uploaded dataset)
             summary = {}
-            if data_manager.metadata is not None:
-                summary['metadata'] = {
-                    'shape': [int(x) for x in data_manager.metadata.shape],
-                    'columns': list(data_manager.metadata.columns),
-                    'missing_values': int(data_manager.metadata.isnull().sum().sum()),
-                    'preview': data_manager.metadata.head().to_html()
-                }
-            
-            if data_manager.expression is not None:
-                summary['expression'] = {
-                    'shape': [int(x) for x in data_manager.expression.shape],
-                    'columns': list(data_manager.expression.columns),
-                    'missing_values': int(data_manager.expression.isnull().sum().sum()),
-                    'preview': data_manager.expression.head().to_html()
-                }
+            for kind in ('metadata', 'expression'):
+                loaded = data_manager.metadata if kind == 'metadata' else data_manager.expression
+                if loaded is None:
+                    continue
+                if kind in entries and entries[kind].get('stats'):
+                    summary[kind] = entries[kind]['stats']
+                else:
+                    summary[kind] = _upload_summary(kind)
+
+            if not entries:
+                if detected_type != 'series_matrix':
+                    # One key, registered under the kind that was detected
+                    registry_keys = {detected_type: next(iter(registry_keys.values()))}
+                # The cleaned copies are saved and registered off the request thread
+                for kind in loaded_kinds:
+                    _persist_upload(kind, registry_keys[kind], filename, summary[kind],
+                                    {'file_type': file_type, 'missing_method': UPLOAD_MISSING_METHOD})
             
             return jsonify({
                 'success': True,
                 'message': f'File {filename} uploaded successfully',
                 'file_type': detected_type,
+                'cached': bool(entries),
                 'summary': summary
             })
             
@@ -511,7 +667,7 @@ def data_summary():
             metadata_stats = {
                 'shape': [int(x) for x in data_manager.metadata.shape],
                 'columns': list(data_manager.metadata.columns),
-                'missing_values': int(data_manager.metadata.isnull().sum().sum()),
+                'missing_values': _missing_values('metadata'),
                 'duplicates': int(data_manager.metadata.duplicated().sum()),
                 'preview': preview_data.to_html(index=False, classes='table table-striped', table_id='metadata-preview')
             }
@@ -533,7 +689,7 @@ def data_summary():
             expression_stats = {
                 'shape': [int(x) for x in data_manager.expression.shape],
                 'columns': list(data_manager.expression.columns),
-                'missing_values': int(data_manager.expression.isnull().sum().sum()),
+                'missing_values': _missing_values('expression'),
                 'duplicates': int(data_manager.expression.duplicated().sum()),
                 'preview': preview_data.to_html(index=False, classes='table table-striped', table_id='expression-preview')
             }
@@ -707,10 +863,44 @@ def dynamic_filter_metadata(df, filters):
                 continue
         else:
             # Handle categorical filtering (case insensitive partial match)
-            filtered_df = filtered_df[filtered_df[column].astype(str).str.contains(value, case=False, na=False)]
+            filtered_df = filtered_df[contains_mask(filtered_df[column], value, case=False)]
     
     return filtered_df
 
+@app.route('/append_samples', methods=['POST'])
+def append_samples():
+    """Append a batch of new samples to the loaded expression data (no re-upload of the full file)"""
+    if data_manager.expression_store is None:
+        return jsonify({'error': 'No expression data loaded'}), 400
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'error': 'No file part'}), 400
+
+    file = request.files['file']
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
+    file.save(filepath)
+
+    # Queued writes of the active dataset (upload saves, or a GEO dataset's workspace copy and
+    # cache snapshot) must finish before its store grows
+    for key in _pending_write_keys(workspace.active_name):
+        persistence_queue.wait(key)
+    try:
+        appended = data_manager.append_samples(filepath, missing_method=request.form.get('missing_method', UPLOAD_MISSING_METHOD))
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error appending samples: {str(e)}'}), 500
+
+    _clear_data_cache()
+    alignment = data_manager.alignment
+    return jsonify({
+        'success': True,
+        'appended': appended,
+        'samples': int(data_manager.expression_store.n_samples),
+        'matched_samples': int(alignment.n_matched) if alignment is not None else 0
+    })
+
 @app.route('/column_values', methods=['POST'])
 def get_column_values():
     if data_manager.metadata is None:
@@ -726,7 +916,7 @@ def get_column_values():
     
     try:
         # Get unique values and their counts
-        value_counts = data_manager.metadata[column].value_counts().sort_index()
+        value_counts = category_value_counts(data_manager.metadata[column]).sort_index()
         values = value_counts.index.astype(str).tolist()
         counts = value_counts.values.tolist()
         
@@ -760,12 +950,11 @@ def filter_metadata_route():
         
         try:
             # Apply filter
-            filtered_df = data_manager.metadata[data_manager.metadata[column].astype(str).isin(values)]
+            filtered_df = data_manager.metadata[isin_mask(data_manager.metadata[column], values)]
             
-            # Save filtered data
+            # Save filtered data (written in the background; /download waits for it)
             filtered_path = os.path.join('cleaned_data', 'metadata_filtered.csv')
-            os.makedirs('cleaned_data', exist_ok=True)
-            filtered_df.to_csv(filtered_path, index=False)
+            persistence_queue.submit(filtered_path, export_csv, filtered_df, filtered_path)
             
             return jsonify({
                 'success': True,
@@ -807,10 +996,9 @@ def filter_metadata_route():
             else:
                 filtered_df = data_manager.metadata.copy()
             
-            # Save filtered data
+            # Save filtered data (written in the background; /download waits for it)
             filtered_path = os.path.join('cleaned_data', 'metadata_filtered.csv')
-            os.makedirs('cleaned_data', exist_ok=True)
-            filtered_df.to_csv(filtered_path, index=False)
+            persistence_queue.submit(filtered_path, export_csv, filtered_df, filtered_path)
             
             return jsonify({
                 'success': True,
@@ -827,20 +1015,122 @@ def filter_metadata_route():
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download endpoint for filtered data files"""
+    # The file may still be queued for writing
+    persistence_queue.wait(os.path.join('cleaned_data', filename))
     try:
         return send_from_directory('cleaned_data', filename, as_attachment=True)
     except Exception as e:
         return jsonify({'error': f'File not found: {str(e)}'}), 404
 
+@app.route('/export/<kind>')
+def export_dataset(kind):
+    """Export the loaded metadata or expression data as CSV (CSV is an export-only format)"""
+    reload_data_if_needed()
+
+    datasets = {'metadata': data_manager.metadata, 'expression': data_manager.expression}
+    if kind not in datasets:
+        return jsonify({'error': f'Unknown dataset {kind}'}), 400
+    if datasets[kind] is None:
+        return jsonify({'error': f'No {kind} data loaded'}), 400
+
+    try:
+        csv_path = export_csv(datasets[kind], os.path.join('cleaned_data', f'{kind}_export.csv'))
+        return send_file(csv_path, as_attachment=True, download_name=f'{kind}_cleaned.csv')
+    except Exception as e:
+        return jsonify({'error': f'Error exporting {kind}: {str(e)}'}), 500
+
+@app.route('/datasets')
+def list_datasets():
+    """List cleaned uploads kept in the dataset registry"""
+    return jsonify({
+        'datasets': dataset_registry.list(),
+        'total_bytes': dataset_registry.total_bytes(),
+        'max_bytes': dataset_registry.max_bytes,
+        'max_entries': dataset_registry.max_entries
+    })
+
+@app.route('/datasets/<key>', methods=['DELETE'])
+def evict_dataset(key):
+    """Remove one cached dataset from the registry"""
+    if not dataset_registry.evict(key):
+        return jsonify({'error': f'Dataset {key} not found'}), 404
+    return jsonify({'success': True, 'total_bytes': dataset_registry.total_bytes()})
+
+@app.route('/datasets/prune', methods=['POST'])
+def prune_datasets():
+    """Evict least recently used datasets until the registry fits the given (or default) budget"""
+    data = request.get_json(silent=True) or {}
+    evicted = dataset_registry.enforce_limit(max_bytes=data.get('max_bytes'),
+                                             max_entries=data.get('max_entries'))
+    return jsonify({'success': True, 'evicted': evicted, 'total_bytes': dataset_registry.total_bytes()})
+
+@app.route('/geo_cache')
+def list_geo_cache():
+    """List parsed GEO series kept in the local GEO cache"""
+    return jsonify({'snapshots': geo_cache.list()})
+
+@app.route('/geo_cache/<geo_id>', methods=['DELETE'])
+def remove_geo_cache(geo_id):
+    """Drop the cached snapshots of one accession (the next download parses it again)"""
+    persistence_queue.wait(f'geo_cache/{geo_id.upper()}')
+    try:
+        removed = geo_cache.remove(geo_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not removed:
+        return jsonify({'error': f'{geo_id} is not in the GEO cache'}), 404
+    return jsonify({'success': True})
+
+@app.route('/workspaces')
+def list_workspaces():
+    """List the datasets in the workspace (resident in memory or spilled to disk)"""
+    return jsonify({
+        'active': workspace.active_name,
+        'datasets': workspace.list(),
+        'resident_bytes': workspace.resident_bytes(),
+        'memory_budget': workspace.memory_budget
+    })
+
+@app.route('/workspaces/<name>/activate', methods=['POST'])
+def activate_workspace(name):
+    """Switch every route to another dataset of the workspace"""
+    if name not in workspace:
+        return jsonify({'error': f'Dataset {name} not found'}), 404
+    try:
+        _activate_dataset(name)
+    except Exception as e:
+        return jsonify({'error': f'Error loading dataset {name}: {str(e)}'}), 500
+    return jsonify({
+        'success': True,
+        'active': name,
+        'metadata_shape': list(data_manager.metadata.shape) if data_manager.metadata is not None else None,
+        'expression_shape': list(data_manager.expression.shape) if data_manager.expression is not None else None
+    })
+
+@app.route('/workspaces/<name>', methods=['DELETE'])
+def remove_workspace_dataset(name):
+    """Remove a dataset from the workspace (memory and disk)"""
+    try:
+        removed = workspace.remove(name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not removed:
+        return jsonify({'error': f'Dataset {name} not found'}), 404
+    return jsonify({'success': True, 'datasets': workspace.names()})
+
 @app.route('/reset_data', methods=['POST'])
 def reset_data():
     """Reset all data and cache for fresh analysis"""
     global data_manager, _data_cache
     
     try:
-        # Clear data manager
-        data_manager.metadata = None
-        data_manager.expression = None
+        # Queued writes would recreate files after they are removed
+        persistence_queue.cancel()
+        persistence_queue.flush()
+        
+        # Drop every workspace dataset and start again with an empty uploads dataset
+        workspace.clear()
+        data_manager = workspace.add(DEFAULT_DATASET, DataManager())
         
         # Clear cache
         _data_cache['metadata_stats'] = None
@@ -856,11 +1146,14 @@ def reset_data():
         import glob
         import os
         
-        # Remove all saved data files
-        for file_path in glob.glob('cleaned_data/*.csv'):
+        # Remove all saved data files (workspaces and exported CSVs)
+        for file_path in glob.glob('cleaned_data/*.csv') + glob.glob('cleaned_data/*.arrow'):
             if os.path.isfile(file_path):
                 os.remove(file_path)
                 print(f"Removed file: {file_path}")
+        for store_dir in glob.glob('cleaned_data/*.store'):
+            shutil.rmtree(store_dir, ignore_errors=True)
+            print(f"Removed expression store: {store_dir}")
         
         return jsonify({
             'success': True,
@@ -882,11 +1175,15 @@ def plot_pca_route():
     color_by = data.get('color_by')
     
     try:
+        # Probe columns as loaded, or one column per gene symbol (collapsed once per dataset)
+        expression = data_manager.expression_for(data.get('level', 'probe'),
+                                                 data.get('collapse_method', DEFAULT_COLLAPSE_METHOD))
         html_content, _ = create_plot_html(
             plot_pca,
-            data_manager.expression,
+            expression,
             data_manager.metadata if data_manager.metadata is not None else None,
-            color_by=color_by if color_by else None
+            color_by=color_by if color_by else None,
+            alignment=data_manager.alignment
         )
         
         return jsonify({
@@ -906,11 +1203,15 @@ def plot_umap_route():
     color_by = data.get('color_by')
     
     try:
+        # Probe columns as loaded, or one column per gene symbol (collapsed once per dataset)
+        expression = data_manager.expression_for(data.get('level', 'probe'),
+                                                 data.get('collapse_method', DEFAULT_COLLAPSE_METHOD))
         html_content, _ = create_plot_html(
             plot_umap,
-            data_manager.expression,
+            expression,
             data_manager.metadata if data_manager.metadata is not None else None,
-            color_by=color_by if color_by else None
+            color_by=color_by if color_by else None,
+            alignment=data_manager.alignment
         )
         
         return jsonify({
@@ -932,13 +1233,16 @@ def differential_expression_route():
     group_2 = data.get('group_2', 'Grade 3')
     
     try:
+        expression = data_manager.expression_for(data.get('level', 'probe'),
+                                                 data.get('collapse_method', DEFAULT_COLLAPSE_METHOD))
         # Call the perform_differential_expression function which now saves to file and opens in browser
         perform_differential_expression(
-            data_manager.expression,
+            expression,
             data_manager.metadata,
             group_col=group_col,
             group_1=group_1,
-            group_2=group_2
+            group_2=group_2,
+            alignment=data_manager.alignment
         )
         
         return jsonify({
@@ -961,10 +1265,11 @@ def gene_expression_route():
     try:
         # Call the explore_gene_expression function which now saves to file and opens in browser
         explore_gene_expression(
-            data_manager.expression,
+            data_manager.expression_data,
             data_manager.metadata,
             gene_name,
-            group_col
+            group_col,
+            alignment=data_manager.alignment
         )
         
         return jsonify({
@@ -990,12 +1295,15 @@ def heatmap_route():
     try:
         from src.visualization.Heatmap_visualisation import plot_expression_heatmap
         
+        expression = data_manager.expression_for(data.get('level', 'probe'),
+                                                 data.get('collapse_method', DEFAULT_COLLAPSE_METHOD))
         # Call the plot_expression_heatmap function which saves to file and opens in browser
         plot_expression_heatmap(
-            data_manager.expression,
+            expression,
             data_manager.metadata if data_manager.metadata is not None else None,
             genes=genes,
-            group_col=group_col if group_col else None
+            group_col=group_col if group_col else None,
+            alignment=data_manager.alignment
         )
         
         return jsonify({
@@ -1109,19 +1417,33 @@ def geo_download():
     try:
         from src.utils.Utils import fetch_and_format_geo
         
-        print(f"Downloading GEO dataset {geo_id}...")
-        meta_df, expr_df = fetch_and_format_geo(geo_id)
-        
-        if meta_df is None or expr_df is None:
-            return jsonify({'error': f'Failed to download GEO dataset {geo_id}'}), 500
-        
-        # Load into memory
-        data_manager.load_metadata_df(meta_df)
-        data_manager.load_expression_df(expr_df)
+        cached = geo_id in workspace
+        if cached:
+            # Already in the workspace (in memory or spilled): switch to it without re-downloading
+            print(f"Switching to GEO dataset {geo_id} from the workspace...")
+        else:
+            print(f"Downloading GEO dataset {geo_id}...")
+            # The workspace persists the dataset, so it is not also saved under cleaned_data/; a
+            # series' store is parsed (or checked out of the GEO cache) straight into the workspace
+            meta_df, expr_df = fetch_and_format_geo(
+                geo_id, save=False,
+                expression_dir=store_path('expression', workspace_dir=workspace.dataset_dir(geo_id)))
+            
+            if meta_df is None:
+                return jsonify({'error': f'Failed to download GEO dataset {geo_id}'}), 500
+            if expr_df is None:
+                return jsonify({'error': f'GEO dataset {geo_id} has no expression table (e.g. only '
+                                         f'supplementary files); nothing was loaded'}), 422
+            
+            # Load into its own DataManager; the previous dataset stays in the workspace
+            geo_manager = DataManager()
+            geo_manager.load_metadata_df(meta_df)
+            geo_manager.load_expression_df(expr_df)
+            workspace.add(geo_id, geo_manager)
+            # Saved in the workspace (in the background) so a restart or a later switch reloads it from disk
+            persistence_queue.submit(f'workspace/{geo_id}', workspace.persist, geo_id)
         
-        # Save to CSVs
-        meta_df.to_csv(f"cleaned_data/{geo_id}_metadata.csv", index=False)
-        expr_df.to_csv(f"cleaned_data/{geo_id}_expression.csv", index=False)
+        _activate_dataset(geo_id)
         
         # Get summary
         summary = {}
@@ -1129,7 +1451,7 @@ def geo_download():
             summary['metadata'] = {
                 'shape': [int(x) for x in data_manager.metadata.shape],
                 'columns': list(data_manager.metadata.columns),
-                'missing_values': int(data_manager.metadata.isnull().sum().sum()),
+                'missing_values': _missing_values('metadata'),
                 'preview': data_manager.metadata.head().to_html()
             }
         
@@ -1137,15 +1459,16 @@ def geo_download():
             summary['expression'] = {
                 'shape': [int(x) for x in data_manager.expression.shape],
                 'columns': list(data_manager.expression.columns),
-                'missing_values': int(data_manager.expression.isnull().sum().sum()),
+                'missing_values': _missing_values('expression'),
                 'preview': data_manager.expression.head().to_html()
             }
         
         return jsonify({
             'success': True,
-            'message': f'GEO dataset {geo_id} downloaded successfully',
-            'samples': int(meta_df.shape[0]),
-            'genes': int(expr_df.shape[1] - 1),  # Exclude Sample column
+            'message': f'GEO dataset {geo_id} ' + ('loaded from the workspace' if cached else 'downloaded successfully'),
+            'cached': cached,
+            'samples': int(data_manager.metadata.shape[0]) if data_manager.metadata is not None else 0,
+            'genes': int(data_manager.expression.shape[1] - 1) if data_manager.expression is not None else 0,  # Exclude Sample column
             'summary': summary
         })
         
@@ -1165,6 +1488,9 @@ def format_dataset():
         if not expression_file or not metadata_file:
             return jsonify({'error': 'Both expression and metadata files are required'}), 400
         
+        if workspace.active_name != DEFAULT_DATASET:
+            _activate_dataset(DEFAULT_DATASET)
+        
         # Save uploaded files
         expr_filename = secure_filename(expression_file.filename)
         meta_filename = secure_filename(metadata_file.filename)
@@ -1176,16 +1502,13 @@ def format_dataset():
         
         # Format the dataset
         from src.data_handling.Format_data import format_for_gliomascope
-        format_for_gliomascope(expr_path, meta_path, expr_sample_col, meta_sample_col)
+        cleaned_expr, cleaned_meta = format_for_gliomascope(expr_path, meta_path, expr_sample_col, meta_sample_col)
         
         # Load formatted data
-        cleaned_expr = "cleaned_data/expression_cleaned.csv"
-        cleaned_meta = "cleaned_data/metadata_cleaned.csv"
-        
         if os.path.exists(cleaned_expr):
             data_manager.load_expression(cleaned_expr)
         if os.path.exists(cleaned_meta):
-            data_manager.load_file_smart(cleaned_meta)
+            data_manager.load_file_smart(cleaned_meta, file_type='metadata')
         
         # Get summary
         summary = {}
@@ -1198,7 +1521,7 @@ def format_dataset():
             summary['metadata'] = {
                 'shape': [int(x) for x in data_manager.metadata.shape],
                 'columns': list(data_manager.metadata.columns),
-                'missing_values': int(data_manager.metadata.isnull().sum().sum()),
+                'missing_values': _missing_values('metadata'),
                 'preview': data_manager.metadata.head().to_html()
             }
         
@@ -1207,12 +1530,12 @@ def format_dataset():
             summary['expression'] = {
                 'shape': [int(x) for x in data_manager.expression.shape],
                 'columns': list(data_manager.expression.columns),
-                'missing_values': int(data_manager.expression.isnull().sum().sum()),
+                'missing_values': _missing_values('expression'),
                 'preview': data_manager.expression.head().to_html()
             }
         
-        if data_manager.merged is not None:
-            matched_samples = int(data_manager.merged.shape[0])
+        if data_manager.alignment is not None:
+            matched_samples = int(data_manager.alignment.n_matched)
         
         return jsonify({
             'success': True,
@@ -1241,12 +1564,18 @@ def chromosome_mapping():
     try:
         from src.analysis.Gene_explorer import map_gene_to_chromosome
         
-        # Call the map_gene_to_chromosome function which saves to file and opens in browser
-        map_gene_to_chromosome(gene_name)
+        # Drawn from the local genome reference; genes missing there are looked up on Ensembl
+        # (and added to it) only when the client asks for it with online=true
+        online = bool(data.get('online', False))
+        location = map_gene_to_chromosome(gene_name, refresh=bool(data.get('refresh')), online=online)
+        if location is None:
+            where = 'the local genome reference or on Ensembl' if online else 'the local genome reference'
+            return jsonify({'error': f"Gene '{gene_name}' was not found in {where}"}), 404
         
         return jsonify({
             'success': True,
-            'message': f'Chromosome mapping for {gene_name} generated successfully'
+            'message': f'Chromosome mapping for {gene_name} generated successfully',
+            'location': location
         })
         
     except Exception as e:
@@ -1255,46 +1584,55 @@ def chromosome_mapping():
 @app.route('/available_genes')
 def available_genes():
     """Get available genes with their actual gene names (not probe IDs)"""
-    if data_manager.expression is None:
+    if data_manager.expression_data is None:
         return jsonify({'error': 'No expression data loaded'}), 400
     
     try:
-        from src.utils.Utils import get_all_available_genes, load_gene_annotations
+        from src.utils.Utils import load_gene_annotations
         
-        # Get gene annotations
+        # Process-wide annotation index; the gene list of the loaded store is built once
         annotations = load_gene_annotations()
-        
-        # Get all available genes with mappings
-        gene_mapping = get_all_available_genes(data_manager.expression, annotations)
-        
-        # Create a list of gene names with their probe IDs
-        gene_list = []
-        for gene_name, probe_id in gene_mapping.items():
-            # Skip if it's a probe ID mapping to itself (not a real gene name)
-            if gene_name != probe_id:
-                gene_list.append({
-                    'gene_name': gene_name,
-                    'probe_id': probe_id,
-                    'display_name': f"{gene_name} ({probe_id})"
-                })
-        
-        # Sort by gene name for better organization
-        gene_list.sort(key=lambda x: x['gene_name'])
+        probes = expression_probes(data_manager.expression_data)
+        if annotations is None:
+            raise ValueError('no gene annotations available')
         
         return jsonify({
             'success': True,
-            'genes': gene_list
+            'genes': annotations.available_genes(probes)
         })
         
     except Exception as e:
         print(f"Error getting gene names: {e}")
         # Fallback to probe IDs if gene mapping fails
-        available_genes = [col for col in data_manager.expression.columns if col != 'Sample']
+        available_genes = expression_probes(data_manager.expression_data)
         return jsonify({
             'success': True,
             'genes': [{'gene_name': gene, 'probe_id': gene, 'display_name': gene} for gene in available_genes]
         })
 
+@app.route('/genes/search')
+def search_genes():
+    """One page of genes matching a symbol, probe ID, alias or gene name prefix (typos tolerated)"""
+    if data_manager.expression_data is None:
+        return jsonify({'error': 'No expression data loaded'}), 400
+
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', SEARCH_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+
+    try:
+        from src.utils.Utils import load_gene_annotations
+
+        # Built once per dataset; pages of a recent query are served from the index's cache
+        index = gene_search_index(data_manager.expression_data, load_gene_annotations())
+        result = index.search(request.args.get('q', ''), page=page, per_page=per_page)
+        return jsonify({'success': True, **result})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/available_columns')
 def available_columns():
     """Get available metadata columns for dropdown menus"""
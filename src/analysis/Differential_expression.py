@@ -5,40 +5,37 @@ import numpy as np
 from scipy.stats import ttest_ind
 import plotly.express as px
 from statsmodels.stats.multitest import multipletests
+from src.data_handling.Expression_store import expression_matrix
+from src.data_handling.Sample_alignment import align_samples
 
-def perform_differential_expression(expression_df, metadata_df, group_col='grade', group_1='2', group_2='3', show_plot=True, save_path=None):
+def perform_differential_expression(expression_df, metadata_df, group_col='grade', group_1='2', group_2='3', show_plot=True, save_path=None, alignment=None):
 
     #performs differential expression between two groups (grade 2 and grade 3)
     #return. dataframe with log2 fold change. p-values and volcano plot
 
-    #step1. merge metadata and expression data
-    expr = expression_df.copy()
-    merged = pd.merge(expr, metadata_df[['Sample', group_col]], on='Sample', how='inner')
+    #step1. line up the group labels with the expression rows (no merged copy of the matrix)
+    samples, probes, values = expression_matrix(expression_df)
+    alignment = align_samples(metadata_df, samples, alignment)
+    group_labels = pd.Series(alignment.metadata_column(metadata_df, group_col, how='left'))
 
     #step2 filter for the two groups of intrest 
-    filtered = merged[merged[group_col].isin([group_1, group_2])]
-    filtered = filtered.set_index('Sample')
+    #step 3 to fit into groups (only the selected rows are copied, as float64 for the stats)
+    group1_values = values[(group_labels == group_1).to_numpy()].astype(np.float64)
+    group2_values = values[(group_labels == group_2).to_numpy()].astype(np.float64)
 
-    #step 3 to fit into groups
-    group1_df = filtered[filtered[group_col] == group_1].drop(columns=[group_col])
-    group2_df = filtered[filtered[group_col] == group_2].drop(columns=[group_col])
-
-    if group1_df.shape[0] < 2 or group2_df.shape[0] < 2:
+    if group1_values.shape[0] < 2 or group2_values.shape[0] < 2:
         raise ValueError("Not enough samples for each group to compute difference.")
 
     #step 4 to calculate log2FC
-    log2fc = np.log2((group2_df.mean() + 1e-6) / (group1_df.mean() + 1e-6))
+    log2fc = np.log2((group2_values.mean(axis=0) + 1e-6) / (group1_values.mean(axis=0) + 1e-6))
 
-    # step 5 calculate the p-values using t-test
-    p_values = []
-    for gene in group1_df.columns:
-        stat, p = ttest_ind(group1_df[gene], group2_df[gene], equal_var=False)
-        p_values.append(p)
+    # step 5 calculate the p-values using t-test (vectorised across all genes)
+    _, p_values = ttest_ind(group1_values, group2_values, axis=0, equal_var=False)
 
     # step 6 prepare the result dataframe
     result_df = pd.DataFrame({
-        'Gene': group1_df.columns,
-        'log2FC': log2fc.values,
+        'Gene': probes,
+        'log2FC': log2fc,
         'p_value': p_values
     })
     result_df['-log10(p_value)'] = -np.log10(result_df['p_value'])
@@ -0,0 +1,208 @@
+'''Pooled HTTP client for external annotation lookups (Ensembl REST): bulk requests, disk cache with TTL, retries'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ENSEMBL_SERVER = 'https://rest.ensembl.org'
+# Responses are cached next to the workspace files, one JSON file per request (or per looked-up symbol)
+ANNOTATION_CACHE_DIR = os.path.join('cleaned_data', 'annotation_cache')
+CACHE_TTL = 7 * 24 * 3600
+
+REQUEST_TIMEOUT = 15
+MAX_RETRIES = 3
+# Seconds before the first retry; doubled for each further one (a Retry-After header wins)
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Seconds a server that could not be reached (after all retries) is not asked again, so offline
+# lookups fail at once instead of waiting out every retry on each call
+UNREACHABLE_COOLDOWN = 5 * 60
+# Requests in flight at once (Ensembl allows 15 requests per second) and pooled connections
+MAX_CONCURRENT = 4
+POOL_SIZE = 8
+# Symbols per bulk lookup (the Ensembl limit for POST /lookup/symbol)
+SYMBOL_BATCH = 1000
+
+
+class AnnotationClient:
+    """
+    One requests.Session (keep-alive connection pool) shared by every lookup.
+
+    Responses are kept in a disk cache for `ttl` seconds. Symbol lookups are cached per symbol,
+    misses included, so a later batch only asks for symbols it has not seen; the rest go out as
+    bulk POSTs of up to SYMBOL_BATCH symbols, at most `max_concurrent` at a time. Timeouts,
+    connection errors and 429/5xx answers are retried `max_retries` times with exponential backoff;
+    a server that stays unreachable is not asked again for `unreachable_cooldown` seconds.
+
+    `server` can point at any host speaking the same API, e.g. a local stub replaying recorded
+    responses in tests.
+    """
+
+    def __init__(self, server=ENSEMBL_SERVER, cache_dir=ANNOTATION_CACHE_DIR, ttl=CACHE_TTL,
+                 timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, backoff=RETRY_BACKOFF,
+                 max_concurrent=MAX_CONCURRENT, unreachable_cooldown=UNREACHABLE_COOLDOWN, session=None):
+        self.server = server.rstrip('/')
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrent = max_concurrent
+        self.unreachable_cooldown = unreachable_cooldown
+        self._unreachable_until = 0.0
+        self._session = session
+        self._session_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @property
+    def session(self):
+        """Created on first use, so importing this module never needs `requests`"""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Content-Type': 'application/json', 'Accept': 'application/json'})
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    # ----------------------------
+    # Disk cache
+    # ----------------------------
+
+    def _cache_path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def cached(self, key):
+        """(True, value) for a fresh cache entry, else (False, None)"""
+        if not self.cache_dir or self.ttl <= 0:
+            return False, None
+        try:
+            with open(self._cache_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+        if time.time() - entry.get('fetched', 0) > self.ttl:
+            return False, None
+        return True, entry.get('value')
+
+    def store(self, key, value):
+        if not self.cache_dir or self.ttl <= 0:
+            return
+        path = self._cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'fetched': time.time(), 'value': value}, f)
+        os.replace(tmp_path, path)
+
+    # ----------------------------
+    # Requests
+    # ----------------------------
+
+    def _send(self, method, path, params=None, body=None):
+        """JSON answer of one request, retried on timeouts, connection errors and 429/5xx"""
+        import requests
+
+        url = f"{self.server}/{path.lstrip('/')}"
+        if time.monotonic() < self._unreachable_until:
+            raise requests.ConnectionError(f"{self.server} could not be reached recently; not retried for "
+                                           f"{self._unreachable_until - time.monotonic():.0f}s")
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                with self._slots:
+                    response = self.session.request(method, url, params=params, json=body, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                retry_after = response.headers.get('Retry-After')
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    self._unreachable_until = time.monotonic() + self.unreachable_cooldown
+                    raise
+            time.sleep(delay)
+
+    def get(self, path, params=None):
+        """Cached GET of an API path"""
+        key = json.dumps(['GET', self.server, path, params or {}], sort_keys=True)
+        hit, value = self.cached(key)
+        if hit:
+            return value
+        value = self._send('GET', path, params=params)
+        self.store(key, value)
+        return value
+
+    def lookup_symbols(self, symbols, species='homo_sapiens'):
+        """
+        {symbol: Ensembl gene record, or None if unknown} for many gene symbols. Cached symbols
+        cost no request; the others are fetched in concurrent bulk POSTs.
+        """
+        symbols = list(dict.fromkeys(str(symbol).strip() for symbol in symbols if str(symbol).strip()))
+        results, pending = {}, []
+        for symbol in symbols:
+            hit, value = self.cached(self._symbol_key(species, symbol))
+            if hit:
+                results[symbol] = value
+            else:
+                pending.append(symbol)
+
+        batches = [pending[start:start + SYMBOL_BATCH] for start in range(0, len(pending), SYMBOL_BATCH)]
+
+        def fetch(batch):
+            found = self._send('POST', f"lookup/symbol/{species}", body={'symbols': batch}) or {}
+            for symbol in batch:
+                # Unknown symbols are cached too, so they are not asked for again until the TTL runs out
+                gene = found.get(symbol)
+                self.store(self._symbol_key(species, symbol), gene)
+                results[symbol] = gene
+
+        if len(batches) == 1:
+            fetch(batches[0])
+        elif batches:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent) as pool:
+                list(pool.map(fetch, batches))
+        if pending:
+            print(f"[✓] Looked up {len(pending)} gene symbols in {len(batches)} requests "
+                  f"({len(symbols) - len(pending)} cached)")
+        return {symbol: results.get(symbol) for symbol in symbols}
+
+    def _symbol_key(self, species, symbol):
+        return json.dumps(['symbol', self.server, species, symbol.upper()])
+
+    def assembly_bands(self, species='homo_sapiens'):
+        """Karyotype bands of the current assembly: the top-level regions with their 'bands' lists"""
+        return self.get(f"info/assembly/{species}", params={'bands': 1}).get('top_level_region', [])
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def annotation_client(server=ENSEMBL_SERVER):
+    """The shared AnnotationClient of a server (one connection pool per process)"""
+    with _clients_lock:
+        if server not in _clients:
+            _clients[server] = AnnotationClient(server)
+        return _clients[server]
@@ -0,0 +1,209 @@
+'''Typed clinical columns (age, grade, IDH, MGMT, survival ...) from GEO "key: value" characteristics fields'''
+
+import re
+import numpy as np
+import pandas as pd
+
+# characteristics_ch1, characteristics_ch1.1 ... and their renamed forms (tissue_characteristics, _2 ...)
+CHARACTERISTICS_COLUMN = re.compile(r'^(characteristics_ch\d+|tissue_characteristics(_\d+)?)(\.\d+)?$', re.IGNORECASE)
+
+# Normalized characteristics key -> typed column (unit suffixes such as _months are removed first)
+KEY_ALIASES = {
+    'age': 'age', 'patient_age': 'age', 'age_at_diagnosis': 'age', 'age_at_dx': 'age',
+    'age_at_surgery': 'age', 'diagnosis_age': 'age',
+    'sex': 'sex', 'gender': 'sex',
+    'grade': 'grade', 'who_grade': 'grade', 'tumor_grade': 'grade', 'tumour_grade': 'grade',
+    'histologic_grade': 'grade', 'histological_grade': 'grade', 'who_grading': 'grade',
+    'idh': 'idh', 'idh_status': 'idh', 'idh1': 'idh', 'idh1_status': 'idh', 'idh_mutation': 'idh',
+    'idh1_mutation': 'idh', 'idh_mutation_status': 'idh', 'idh1_mutation_status': 'idh',
+    'idh1_2_status': 'idh', 'idh1_idh2_status': 'idh',
+    'mgmt': 'mgmt', 'mgmt_status': 'mgmt', 'mgmt_promoter': 'mgmt', 'mgmt_methylation': 'mgmt',
+    'mgmt_promoter_status': 'mgmt', 'mgmt_promoter_methylation': 'mgmt', 'mgmt_methylation_status': 'mgmt',
+    'overall_survival': 'overall_survival', 'os': 'overall_survival', 'os_time': 'overall_survival',
+    'survival': 'overall_survival', 'survival_time': 'overall_survival', 'overall_survival_time': 'overall_survival',
+    'progression_free_survival': 'progression_free_survival', 'pfs': 'progression_free_survival',
+    'pfs_time': 'progression_free_survival',
+    'vital_status': 'vital_status', 'os_status': 'vital_status', 'os_event': 'vital_status',
+    'survival_status': 'vital_status', 'death': 'vital_status', 'dead': 'vital_status',
+    'deceased': 'vital_status',
+}
+
+# Typed column -> (unit numbers are converted to, unit assumed when neither key nor value names one)
+NUMERIC_COLUMNS = {
+    'age': ('year', 'year'),
+    'overall_survival': ('month', 'month'),
+    'progression_free_survival': ('month', 'month'),
+}
+CATEGORICAL_COLUMNS = ('sex', 'grade', 'idh', 'mgmt', 'vital_status')
+
+_UNIT_PATTERN = r'(day|week|wk|month|mo|year|yr)s?'
+_UNIT_SUFFIX = re.compile(rf'_(in_)?{_UNIT_PATTERN}$')
+_IN_DAYS = {'day': 1.0, 'week': 7.0, 'wk': 7.0, 'month': 30.4375, 'mo': 30.4375, 'year': 365.25, 'yr': 365.25}
+_NUMBER = r'(-?\d+(?:\.\d+)?)'
+_GRADE = re.compile(r'(?<![a-z0-9])g?(iv|iii|ii|i|[1-4])(?![a-z0-9])')
+_ROMAN = {'1': 'I', '2': 'II', '3': 'III', '4': 'IV'}
+_GRADE_ORDER = ['I', 'II', 'III', 'IV']
+# "non-methylated", "not mutated", "no mutation", "unmethylated" ... negate the word they precede
+_NEGATION = r'(?<![a-z])(?:non|not|no|un|without)[\s_-]*'
+_NEGATIVE_RESULT = re.compile(r'(?<![a-z])(?:negative|neg|absent|not detected)(?![a-z])')
+
+# Values that mean "not recorded"
+NULL_VALUES = {'', 'na', 'n/a', 'nan', 'null', 'none', 'unknown', 'not available', 'not applicable',
+               'not reported', 'not determined', 'nd', '-', '--', '?'}
+
+
+def characteristics_columns(df):
+    return [col for col in df.columns if CHARACTERISTICS_COLUMN.match(str(col))]
+
+
+def canonical_key(raw_key):
+    """'Overall survival (months)' -> ('overall_survival', 'month'); unknown keys keep their snake_case name"""
+    key = raw_key.strip().lower()
+    unit = re.search(rf'\(\s*{_UNIT_PATTERN}\s*\)', key)
+    key = re.sub(r'\(.*?\)', ' ', key)
+    key = re.sub(r'[^a-z0-9]+', '_', key).strip('_')
+    suffix = _UNIT_SUFFIX.search(key)
+    if suffix and KEY_ALIASES.get(key[:suffix.start()]):
+        key = key[:suffix.start()]
+        unit = unit or suffix
+    unit = unit.group(unit.lastindex) if unit else None
+    return KEY_ALIASES.get(key, key), unit
+
+
+def _split_pairs(series):
+    """(row positions, keys, values) of the 'key: value' entries of one column, parsed once per distinct string"""
+    codes, uniques = pd.factorize(series)
+    parts = pd.Series(pd.Index(uniques).astype(str)).str.partition(':')
+    keys = parts[0].str.strip()
+    values = parts[2].str.strip()
+    is_pair = ((parts[1] == ':') & (keys != '') & ~values.str.lower().isin(NULL_VALUES)).to_numpy()
+    rows = np.flatnonzero((codes >= 0) & is_pair[np.maximum(codes, 0)])
+    return rows, keys.to_numpy()[codes[rows]], values.to_numpy()[codes[rows]]
+
+
+def _map_distinct(values, normalize):
+    """Apply `normalize` once per distinct value"""
+    return values.map({value: normalize(value) for value in values.unique()})
+
+
+def _to_number(values, units, column):
+    """Numbers in the column's unit (e.g. survival in days -> months; age in months -> years)"""
+    target, default = NUMERIC_COLUMNS[column]
+    lower = values.str.lower()
+    numbers = lower.str.extract(_NUMBER, expand=False).astype(float)
+    value_units = lower.str.extract(rf'\d\s*{_UNIT_PATTERN}\b', expand=False)
+    units = units.fillna(value_units).fillna(default)
+    return numbers * units.map(_IN_DAYS).to_numpy() / _IN_DAYS[target]
+
+
+def _sex(value):
+    value = value.lower()
+    if value in ('m', 'male', 'man'):
+        return 'male'
+    if value in ('f', 'female', 'woman'):
+        return 'female'
+    return value
+
+
+def _grade(value):
+    """'WHO grade IV' -> 'IV'; mixed grades keep their range ('Grade I/II', 'II-III' -> 'I-II', 'II-III')"""
+    found = {_ROMAN.get(grade, grade.upper()) for grade in _GRADE.findall(re.sub(r'who|grade', ' ', value.lower()))}
+    if not found:
+        return value
+    grades = sorted(found, key=_GRADE_ORDER.index)
+    return grades[0] if len(grades) == 1 else f"{grades[0]}-{grades[-1]}"
+
+
+def _is_negative(lower, stems):
+    """True for a negated finding: a negation right before one of `stems`, or a negative result"""
+    return any(re.search(_NEGATION + stem, lower) for stem in stems) or bool(_NEGATIVE_RESULT.search(lower))
+
+
+def _idh(value):
+    lower = value.lower()
+    if 'wild' in lower or lower in ('wt', 'no') or _is_negative(lower, ('mut', 'r132', 'r172')):
+        return 'wildtype'
+    if 'mut' in lower or 'r132' in lower or 'r172' in lower or lower in ('mt', 'positive', 'pos', 'yes'):
+        return 'mutant'
+    return value
+
+
+def _mgmt(value):
+    lower = value.lower()
+    if lower in ('u', 'um', 'no') or _is_negative(lower, ('meth',)):
+        return 'unmethylated'
+    if 'meth' in lower or lower in ('m', 'positive', 'pos', 'yes'):
+        return 'methylated'
+    return value
+
+
+def _vital_status(value):
+    lower = value.lower()
+    if 'alive' in lower or 'living' in lower or lower in ('0', 'no', 'false', 'censored'):
+        return 'alive'
+    if 'dead' in lower or 'deceased' in lower or 'died' in lower or lower in ('1', 'yes', 'true'):
+        return 'dead'
+    return value
+
+
+_NORMALIZERS = {'sex': _sex, 'grade': _grade, 'idh': _idh, 'mgmt': _mgmt, 'vital_status': _vital_status}
+
+
+def expand_characteristics(df):
+    """
+    Add one typed column per key found in the characteristics fields ("grade: IV", "age: 54"):
+    numeric age (years) and survival times (months), categorical sex/grade/IDH/MGMT/vital status
+    with normalized labels (e.g. 'IV', 'mutant', 'methylated'), and every other key as text, or
+    as numbers when all its values are numeric.
+
+    Each distinct string is parsed once, so the cost follows the number of distinct values, not
+    samples. When a key occurs in several fields of a sample the first one wins. Columns that
+    already exist (case-insensitively) are left alone, which also makes a second call a no-op.
+    """
+    if df is None or df.empty:
+        return df
+    source = characteristics_columns(df)
+    if not source:
+        return df
+
+    parts = [_split_pairs(df[col]) for col in source]
+    rows = np.concatenate([part[0] for part in parts])
+    if len(rows) == 0:
+        return df
+    pairs = pd.DataFrame({'row': rows,
+                          'key': np.concatenate([part[1] for part in parts]),
+                          'value': np.concatenate([part[2] for part in parts])})
+    keys = {key: canonical_key(key) for key in pairs['key'].unique()}
+    pairs['column'] = pairs['key'].map({key: column for key, (column, _) in keys.items()})
+    pairs['unit'] = pairs['key'].map({key: unit for key, (_, unit) in keys.items()})
+    pairs = pairs[pairs['column'] != ''].drop_duplicates(['row', 'column'], keep='first')
+
+    existing = {str(col).lower() for col in df.columns}
+    n_rows = len(df)
+    added = {}
+    for column, group in pairs.groupby('column', sort=False):
+        if column.lower() in existing:
+            continue
+        positions = group['row'].to_numpy()
+        values = group['value'].reset_index(drop=True)
+        if column in NUMERIC_COLUMNS:
+            typed = np.full(n_rows, np.nan)
+            typed[positions] = _to_number(values, group['unit'].reset_index(drop=True), column)
+        else:
+            if column in _NORMALIZERS:
+                values = _map_distinct(values, _NORMALIZERS[column])
+            numbers = pd.to_numeric(values, errors='coerce')
+            if column not in CATEGORICAL_COLUMNS and numbers.notna().all():
+                typed = np.full(n_rows, np.nan)
+                typed[positions] = numbers
+            else:
+                typed = np.full(n_rows, None, dtype=object)
+                typed[positions] = values.to_numpy()
+                if column in CATEGORICAL_COLUMNS:
+                    typed = pd.Categorical(typed)
+        added[column] = typed
+
+    if not added:
+        return df
+    print(f"[✓] Parsed {len(added)} typed columns from the characteristics fields: {', '.join(added)}")
+    return pd.concat([df, pd.DataFrame(added, index=df.index)], axis=1)
@@ -1,74 +1,351 @@
 import pandas as pd
+import numpy as np
 import os
-from src.utils.Utils import load_data, handle_missing_data, validate_file_type, auto_rename_metadata_columns
+import threading
+from src.utils.Utils import (load_data, handle_missing_data, validate_file_type, auto_rename_metadata_columns,
+                             classify_file, find_sample_column, FileProfile, categorize_metadata)
+from src.data_handling.Workspace_cache import save_workspace, save_expression_store, load_expression_store, store_path
+from src.data_handling.Streaming_transpose import transpose_to_store
+from src.data_handling.Series_matrix import is_series_matrix, parse_series_matrix
+from src.data_handling.Characteristics import expand_characteristics
+from src.data_handling.Expression_store import ExpressionStore
+from src.data_handling.Gene_collapse import gene_level_store, check_expression_level, DEFAULT_COLLAPSE_METHOD
+from src.data_handling.Missing_data import check_missing_method, fill_block
+from src.data_handling.Sample_alignment import SampleAlignment, normalize_sample_ids
 
 
 class DataManager:
-    def __init__(self):
-        self.metadata = None
-        self.expression = None
-        self.merged = None
+    def __init__(self, expression_dtype=np.float32):
+        self._metadata = None
+        self.expression_store = None
+        self._expression = None
+        # Sample join between metadata and expression, built lazily (see `alignment`)
+        self._alignment = None
         self.metadata_path = None
         self.expression_path = None
-
-
-    def load_file_smart(self, file_path, missing_method='fill_zero'):
+        # float32 halves resident memory; pass np.float64 for full precision
+        self.expression_dtype = expression_dtype
+        # Guards swapping the expression store between request threads and background writers
+        self._lock = threading.RLock()
+
+    # ----------------------------
+    # Metadata / sample alignment
+    # ----------------------------
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, df):
+        if df is not None and 'Sample' in df.columns:
+            # Sample IDs are put in canonical form once, when the table is loaded; into a new frame,
+            # since the caller's may still be in use (e.g. queued for a background write)
+            df = df.assign(Sample=normalize_sample_ids(df['Sample']))
+        # Repetitive text columns are dictionary-encoded once; filters and groupbys use the codes
+        self._metadata = categorize_metadata(df)
+        self._alignment = None
+
+    @property
+    def alignment(self):
+        """SampleAlignment between metadata and expression rows, or None if either side is missing"""
+        if self._alignment is None:
+            if self._metadata is None or 'Sample' not in self._metadata.columns:
+                return None
+            if self.expression_store is not None:
+                expression_samples = self.expression_store.samples
+            elif self._expression is not None and 'Sample' in self._expression.columns:
+                expression_samples = self._expression['Sample']
+            else:
+                return None
+            self._alignment = SampleAlignment(self._metadata['Sample'], expression_samples,
+                                              canonical=self.expression_store is not None)
+        return self._alignment
+
+    # ----------------------------
+    # Expression store
+    # ----------------------------
+
+    @property
+    def expression(self):
+        """Samples-as-rows expression DataFrame (a zero-copy view over expression_store when present)"""
+        if self._expression is None and self.expression_store is not None:
+            # Built on first use (and again after samples are appended)
+            self._expression = self.expression_store.to_frame()
+        return self._expression
+
+    @expression.setter
+    def expression(self, df):
+        self._alignment = None
+        if df is None:
+            self.expression_store = None
+            self._expression = None
+            return
+        if 'Sample' not in df.columns:
+            # Can't index it yet; keep the raw frame until a Sample column is found
+            self.expression_store = None
+            self._expression = df
+            return
+        self.set_expression_store(ExpressionStore.from_dataframe(df, dtype=self.expression_dtype))
+
+    @property
+    def expression_data(self):
+        """What analyses should consume: the ExpressionStore if available, else the DataFrame"""
+        if self.expression_store is not None:
+            return self.expression_store
+        return self._expression
+
+    def expression_for(self, level='probe', method=DEFAULT_COLLAPSE_METHOD):
+        """
+        Analysis input at probe level (expression_data) or gene level: one column per gene
+        symbol, collapsed with `method` once per dataset and cached (see Gene_collapse)
+        """
+        if check_expression_level(level) == 'probe' or self.expression_data is None:
+            return self.expression_data
+        if self.expression_store is None:
+            raise ValueError("Gene-level data needs the expression store; reload the expression file")
+        from src.utils.Utils import load_gene_annotations
+        return gene_level_store(self.expression_store, load_gene_annotations(), method)
+
+    def set_expression_store(self, store):
+        if store is not None:
+            # Sample IDs are put in canonical form once, when the store is loaded
+            store.samples = normalize_sample_ids(store.samples)
+        with self._lock:
+            self.expression_store = store
+            self._expression = None
+            self._alignment = None
+
+    def adopt_saved_store(self, snapshot, saved):
+        """
+        Switch to `saved`, the memory-mapped copy of `snapshot` written in the background, if
+        `snapshot` is still the loaded store (another upload may have replaced it meanwhile) and
+        no samples were appended to it since. The samples are the same, so the metadata
+        alignment is kept. Returns True if switched.
+        """
+        with self._lock:
+            if self.expression_store is not snapshot or snapshot.shape != saved.shape:
+                return False
+            saved.samples = snapshot.samples
+            self.expression_store = saved
+            self._expression = None
+            return True
+
+    def set_expression_frame(self, df, missing_method='fill_zero'):
+        """
+        Build the expression store from a samples-as-rows DataFrame that still has its NaNs and
+        impute it in place; the originally missing cells are kept as the store's bitmap.
+        """
+        store = ExpressionStore.from_dataframe(df, dtype=self.expression_dtype)
+        dropped = store.impute(missing_method)
+        if dropped:
+            print(f"[!] Dropped {dropped} samples with missing values")
+        elif store.missing is not None:
+            print(f"[✓] Imputed {store.missing_count()} missing values ({missing_method})")
+        self.set_expression_store(store)
+        return store
+
+    def save_expression_workspace(self, name='expression_cleaned'):
+        """Persist the expression store and switch to the memory-mapped copy on disk"""
+        if self.expression_store is None:
+            return None
+        path = save_expression_store(self.expression_store, name)
+        self.set_expression_store(load_expression_store(name))
+        return path
+
+    def load_expression_workspace(self, name='expression_cleaned'):
+        """Memory-map a saved expression store; returns False if none exists"""
+        store = load_expression_store(name)
+        if store is None:
+            return False
+        self.set_expression_store(store)
+        return True
+
+
+    def append_samples(self, source, missing_method='fill_zero'):
+        """
+        Append a batch of new samples (a file path or a samples-as-rows DataFrame) to the loaded
+        expression store in place. The batch must contain every probe of the store; its values
+        are put in store order, and the sample index, per-gene stats and metadata alignment are
+        extended with the new rows only. Returns the number of samples appended.
+        """
+        batch = self._read_sample_batch(source) if isinstance(source, str) else source
+        # Held until the store has grown: a background writer never swaps it for a saved copy meanwhile
+        with self._lock:
+            return self._append_batch(batch, missing_method)
+
+    def _append_batch(self, batch, missing_method):
+        store = self.expression_store
+        if store is None:
+            raise ValueError("No expression store loaded to append samples to")
+
+        sample_col = find_sample_column(batch.columns)
+        if sample_col is None:
+            raise ValueError("'Sample' column missing in the new batch")
+
+        samples = normalize_sample_ids(batch[sample_col])
+        duplicated = pd.Index(samples).duplicated()
+        if duplicated.any():
+            raise ValueError(f"Duplicate samples in the new batch: {', '.join(samples[duplicated][:5])}")
+        existing = pd.Index(store.samples).get_indexer(samples) >= 0
+        if existing.any():
+            raise ValueError(f"{int(existing.sum())} samples are already in the expression store "
+                             f"(e.g. {', '.join(samples[existing][:5])})")
+
+        # Batch column for every store probe, in store order
+        probe_cols = pd.Index([str(col) for col in batch.columns])
+        positions = probe_cols.get_indexer(store.probes)
+        if (positions < 0).any():
+            missing = store.probes[positions < 0]
+            raise ValueError(f"The new batch is missing {len(missing)} of the store's {store.n_probes} probes "
+                             f"(e.g. {', '.join(map(str, missing[:5]))})")
+        extra = len(batch.columns) - 1 - store.n_probes
+        if extra > 0:
+            print(f"[!] Ignoring {extra} columns that are not probes of the expression store")
+        values = batch.iloc[:, positions].to_numpy(dtype=store.dtype)
+
+        # Missing values: same methods as at load time, but fills use cohort statistics. Medians and
+        # neighbours are not tracked incrementally, so fill_median and knn use the cohort means (gene_stats)
+        check_missing_method(missing_method)
+        nan_mask = np.isnan(values)
+        bitmap = None
+        if nan_mask.any():
+            if missing_method == 'drop':
+                keep = ~nan_mask.any(axis=1)
+                samples, values = samples[keep], values[keep]
+            else:
+                bitmap = np.packbits(nan_mask, axis=1)
+                if missing_method == 'fill_zero':
+                    fill_block(values, nan_mask, missing_method)
+                else:
+                    np.copyto(values, store.gene_means().astype(store.dtype)[None, :], where=nan_mask)
+
+        store.append(samples, values, missing=bitmap)
+
+        # Derived caches grow with the batch instead of being rebuilt
+        self._expression = None
+        if self._alignment is not None:
+            self._alignment.extend(samples, canonical=True)
+        print(f"[✓] Appended {len(samples)} samples; expression store now has {store.n_samples} samples")
+        return len(samples)
+
+    def _read_sample_batch(self, file_path):
+        """Parse a batch file into a samples-as-rows DataFrame (genes-as-rows batches are transposed)"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        profile = classify_file(file_path)
+        df = load_data(file_path, float32=True, delimiter=profile.delimiter)
+        if profile.kind == 'expression' and profile.genes_as_rows:
+            # A batch is a few samples wide, so the in-memory transpose is small
+            df = df.set_index(df.columns[0]).T
+            df.index.name = 'Sample'
+            df = df.reset_index()
+        return df
+
+    def load_file_smart(self, file_path, missing_method='fill_zero', file_type='auto'):
+        """
+        Classify a file from its header and first rows, then parse it once into the right store.
+        Returns the detected type ('metadata' / 'expression') or None. A GEO series matrix
+        loads both tables and returns 'series_matrix'.
+        """
         if not os.path.exists(file_path):
             print(f"[Error] File not found: {file_path}")
-            return
+            return None
+
+        if is_series_matrix(file_path):
+            return self.load_series_matrix(file_path, missing_method)
 
         try:
-            df = load_data(file_path)
+            profile = classify_file(file_path)
+        except Exception as e:
+            print(f"[Error] Failed to read file header: {e}")
+            return None
+
+        if file_type in ('metadata', 'expression') and file_type != profile.kind:
+            # Explicit choice from the user wins over the sniffed type
+            orientation = profile.orientation if file_type == 'expression' else None
+            profile = FileProfile(file_type, orientation or 'samples-as-rows', profile.delimiter,
+                                  profile.columns, profile.sample_col)
+
+        if profile.kind not in ('metadata', 'expression'):
+            print("[!] Could not determine file type. Please check structure.")
+            return None
+        label = profile.kind.capitalize()
+        if profile.kind == 'expression':
+            label += f" ({profile.orientation.replace('-', ' ')})"
+        print(f"Detected file type: {label}")
+
+        if profile.kind == 'expression' and profile.genes_as_rows:
+            return self._load_genes_as_rows(file_path, profile, missing_method)
+
+        # Single full parse (expression gene columns go straight to float32)
+        try:
+            df = load_data(file_path, float32=(profile.kind == 'expression') or 'auto',
+                           delimiter=profile.delimiter)
         except Exception as e:
             print(f"[Error] Failed to load file: {e}")
-            return
+            return None
 
-        df = auto_rename_metadata_columns(df)
+        if profile.kind == 'metadata':
+            df = auto_rename_metadata_columns(df)
 
         # Standardize Sample
-        if 'Sample' not in df.columns:
-            for col in df.columns:
-                if 'sample' in col.lower() and 'id' in col.lower():
-                    df.rename(columns={col: 'Sample'}, inplace=True)
-                    break
-
-        if 'Sample' not in df.columns:
+        sample_col = find_sample_column(df.columns)
+        if sample_col is None:
             print("[Error] 'Sample' column missing.")
-            return
+            return None
+        if sample_col != 'Sample':
+            df = df.rename(columns={sample_col: 'Sample'})
 
-        # Identify type
-        file_type = validate_file_type(df).lower().capitalize()
-        print(f"Detected file type: {file_type}")
+        if profile.kind == 'metadata':
+            # Typed clinical columns are parsed after filling, so their gaps stay NaN
+            self.metadata = expand_characteristics(handle_missing_data(df, method=missing_method))
+            self.metadata_path = file_path
+            print(f"[✓] Metadata loaded with shape {self.metadata.shape}")
+        else:
+            # Expression NaNs are imputed inside the float32 store (no fillna copy of the frame)
+            store = self.set_expression_frame(df, missing_method)
+            self.expression_path = file_path
+            print(f"[✓] Expression loaded with shape ({store.n_samples}, {store.n_probes + 1})")
 
-        # Handle missing values
-        df = handle_missing_data(df, method=missing_method)
+        self._try_align()
+        return profile.kind
 
-        # Save to appropriate attribute
-        if file_type == 'Metadata':
-            self.metadata = df
-            self.metadata_path = file_path
-            print(f"[✓] Metadata loaded with shape {df.shape}")
-
-        elif file_type == 'Expression':
-            # Check and orient the expression matrix
-            if df.columns.astype(str).str.startswith("Sample").any():  # samples in columns
-                print("Detected: Genes as rows — transposing expression data")
-                df = df.transpose()
-                df.index.name = 'Sample'
-                df.reset_index(inplace=True)
-            elif df.index.astype(str).str.startswith("Sample").any():
-                df.index.name = 'Sample'
-                df.reset_index(inplace=True)
-            else:
-                print("Assuming samples are rows.")
+    def _load_genes_as_rows(self, file_path, profile, missing_method='fill_zero', name='expression_cleaned'):
+        """Stream a genes-as-rows file into the on-disk expression store (no in-memory transpose)"""
+        print("Detected: Genes as rows — streaming transpose into the expression store")
+        try:
+            store = transpose_to_store(file_path, store_path(name), delimiter=profile.delimiter,
+                                       sample_columns=profile.value_columns or None,
+                                       missing_method=missing_method, dtype=self.expression_dtype)
+        except Exception as e:
+            print(f"[Error] Failed to load file: {e}")
+            return None
 
-            self.expression = df
-            self.expression_path = file_path
-            print(f"[✓] Expression loaded with shape {df.shape}")
-        else:
-            print("[!] Could not determine file type. Please check structure.")
+        self.set_expression_store(store)
+        self.expression_path = file_path
+        print(f"[✓] Expression loaded with shape {self.expression.shape}")
+        self._try_align()
+        return 'expression'
 
-        self._try_merge()
+    def load_series_matrix(self, file_path, missing_method='fill_zero', name='expression_cleaned'):
+        """GEO series matrix: the !Sample_ header block becomes the metadata, the ID_REF table the expression store"""
+        print("Detected file type: GEO series matrix (metadata + expression)")
+        try:
+            metadata, store = parse_series_matrix(file_path, store_path(name), missing_method=missing_method,
+                                                  dtype=self.expression_dtype)
+        except Exception as e:
+            print(f"[Error] Failed to load series matrix: {e}")
+            return None
+
+        self.metadata = expand_characteristics(auto_rename_metadata_columns(metadata))
+        self.metadata_path = file_path
+        self.set_expression_store(store)
+        self.expression_path = file_path
+        print(f"[✓] Metadata loaded with shape {self.metadata.shape}")
+        print(f"[✓] Expression loaded with shape ({store.n_samples}, {store.n_probes + 1})")
+        self._try_align()
+        return 'series_matrix'
 
     def load_metadata(self, file_path, missing_method='fill_zero', save_cleaned=True):
         import os
@@ -98,8 +375,8 @@ class DataManager:
             return
         df.rename(columns={sample_col: 'Sample'}, inplace=True)
 
-        # 4. Handle missing data
-        df = handle_missing_data(df, method=missing_method)
+        # 4. Handle missing data, then parse the characteristics fields into typed columns
+        df = expand_characteristics(handle_missing_data(df, method=missing_method))
 
         # 5. Warn if expected columns are missing
         expected = ['sample_id', 'age', 'sex', 'grade', 'idh']
@@ -110,9 +387,8 @@ class DataManager:
 
         # 6. Save cleaned version
         if save_cleaned:
-            os.makedirs("cleaned_data", exist_ok=True)
-            df.to_csv("cleaned_data/metadata_cleaned.csv", index=False)
-            print("[+] Cleaned metadata saved to cleaned_data/metadata_cleaned.csv")
+            path = save_workspace(df, "metadata_cleaned", kind="metadata")
+            print(f"[+] Cleaned metadata saved to {path}")
 
         # 7. Store in DataManager
         self.metadata = df
@@ -125,7 +401,7 @@ class DataManager:
 
     
     def load_expression(self, file_path, missing_method='fill_zero', save_cleaned=True):
-        from src.utils.Utils import load_data, handle_missing_data, summarise_dataframe, log_summary
+        from src.utils.Utils import load_data, summarise_dataframe, log_summary
         import os
 
         if not os.path.exists(file_path):
@@ -153,29 +429,25 @@ class DataManager:
         cols = ['Sample'] + [c for c in df.columns if c != 'Sample']
         df = df[cols]
 
-        # 5. Handle missing data
-        df = handle_missing_data(df, method=missing_method)
-
-        # 6. Warn if not many numeric columns (sanity check)
+        # 5. Warn if not many numeric columns (sanity check)
         num_cols = df.select_dtypes(include='number')
         if num_cols.shape[1] < 10:
             print("WARNING: Warning: Expression file has very few numeric columns. Are you sure this is gene expression data?")
 
-        # 7. Save cleaned file (optional)
-        if save_cleaned:
-            os.makedirs("cleaned_data", exist_ok=True)
-            df.to_csv("cleaned_data/expression_cleaned.csv", index=False)
-            print("SUCCESS: Cleaned expression data saved to cleaned_data/expression_cleaned.csv")
+        # 6-7. Store in object: builds the float32 expression store and handles missing data in it
+        self.set_expression_frame(df, missing_method)
 
-        # 8. Store in object
-        self.expression = df
+        # 8. Save cleaned store (optional) and memory-map it back
+        if save_cleaned:
+            path = self.save_expression_workspace()
+            print(f"SUCCESS: Cleaned expression data saved to {path}")
 
         # 9. Log summary
         summary = summarise_dataframe(df, name='Expression')
         log_summary(summary, filename="expression_summary.json")
 
         # 10. Try merge if metadata is already present
-        self._try_merge()
+        self._try_align()
 
 
     def load_metadata_df(self, df):
@@ -193,11 +465,16 @@ class DataManager:
                     df.rename(columns={col: 'Sample'}, inplace=True)
                     break
         
-        self.metadata = df
-        self._try_merge()
+        self.metadata = expand_characteristics(df)
+        self._try_align()
         #load metadata directly from a pandas DataFrame
 
     def load_expression_df(self, df):
+        if isinstance(df, ExpressionStore):
+            # e.g. a series from the GEO cache: already typed and memory-mapped
+            self.set_expression_store(df)
+            self._try_align()
+            return
         # Ensure Sample column exists
         if 'Sample' not in df.columns:
             # Try to find any column that looks like a sample ID
@@ -210,62 +487,53 @@ class DataManager:
                     break
         
         self.expression = df
-        self._try_merge()
+        self._try_align()
 
         # load expression directly from a pandas DataFrame
 
-    def _try_merge(self):
-        if self.metadata is not None and self.expression is not None:
-            # Check for Sample column in both dataframes
-            meta_sample_col = None
-            expr_sample_col = None
-            
-            # Look for Sample column in metadata
-            if 'Sample' in self.metadata.columns:
-                meta_sample_col = 'Sample'
-            else:
-                # Try to find any column that looks like a sample ID
-                for col in self.metadata.columns:
-                    if 'sample' in col.lower() and 'id' in col.lower():
-                        meta_sample_col = col
-                        self.metadata.rename(columns={col: 'Sample'}, inplace=True)
-                        break
-                    elif col.startswith('GSM'):  # Handle GSM sample IDs
-                        meta_sample_col = col
-                        self.metadata.rename(columns={col: 'Sample'}, inplace=True)
-                        break
-            
-            # Look for Sample column in expression
-            if 'Sample' in self.expression.columns:
-                expr_sample_col = 'Sample'
-            else:
-                # Try to find any column that looks like a sample ID
-                for col in self.expression.columns:
-                    if 'sample' in col.lower() and 'id' in col.lower():
-                        expr_sample_col = col
-                        self.expression.rename(columns={col: 'Sample'}, inplace=True)
-                        break
-                    elif col.startswith('GSM'):  # Handle GSM sample IDs
-                        expr_sample_col = col
-                        self.expression.rename(columns={col: 'Sample'}, inplace=True)
-                        break
-            
-            if not meta_sample_col or not expr_sample_col:
-                print('ERROR: Warning: No Sample column found in metadata or expression data.')
-                print(f'Metadata columns: {list(self.metadata.columns)}')
-                print(f'Expression columns: {list(self.expression.columns)}')
-                return
-        
-            # Standardize Sample format
-            self.metadata['Sample'] = self.metadata['Sample'].astype(str).str.strip().str.upper()
-            self.expression['Sample'] = self.expression['Sample'].astype(str).str.strip().str.upper()
-
-            common_ids = set(self.metadata['Sample']).intersection(set(self.expression['Sample']))
-            if len(common_ids) == 0:
-                print('ERROR: No common samples found between metadata and expression data.')
-                return
-        
-            self.merged = pd.merge(self.metadata, self.expression, on='Sample', how='inner')
+    def _try_align(self):
+        """
+        Once both datasets are loaded, make sure each has a Sample column and report how many
+        samples line up. The join itself is the lazy `alignment` (no merged frame is built).
+        """
+        if self.metadata is None or self.expression is None:
+            return None
+
+        # Look for Sample column in metadata
+        meta_sample_col = self._find_sample_column(self.metadata)
+        if meta_sample_col and meta_sample_col != 'Sample':
+            self.metadata = self.metadata.rename(columns={meta_sample_col: 'Sample'})
+
+        # Look for Sample column in expression
+        expr_sample_col = self._find_sample_column(self.expression)
+        if expr_sample_col and self.expression_store is None:
+            # Sample column found late: build the expression store now
+            self.expression = self._expression.rename(columns={expr_sample_col: 'Sample'})
+
+        if not meta_sample_col or not expr_sample_col:
+            print('ERROR: Warning: No Sample column found in metadata or expression data.')
+            print(f'Metadata columns: {list(self.metadata.columns)}')
+            print(f'Expression columns: {list(self.expression.columns)}')
+            return None
+
+        alignment = self.alignment
+        if alignment is None or alignment.n_matched == 0:
+            print('ERROR: No common samples found between metadata and expression data.')
+            return None
+        print(f"[✓] {alignment.n_matched} samples matched between metadata and expression")
+        return alignment
+
+    @staticmethod
+    def _find_sample_column(df):
+        if 'Sample' in df.columns:
+            return 'Sample'
+        # Try to find any column that looks like a sample ID
+        for col in df.columns:
+            if 'sample' in col.lower() and 'id' in col.lower():
+                return col
+            elif col.startswith('GSM'):  # Handle GSM sample IDs
+                return col
+        return None
 
     def preview_metadata(self, n=5):
         if self.metadata is not None:
@@ -0,0 +1,270 @@
+'''Content-addressed registry of cleaned datasets so identical uploads are never parsed twice'''
+
+import os
+import json
+import time
+import shutil
+import threading
+import hashlib
+from src.data_handling.Workspace_cache import WORKSPACE_DIR, load_workspace_file
+from src.data_handling.Expression_store import ExpressionStore, _link_or_copy
+
+REGISTRY_DIR = os.path.join(WORKSPACE_DIR, 'registry')
+REGISTRY_INDEX = 'registry.json'
+
+# Keep the registry under this many bytes on disk (least recently used entries go first)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_ENTRIES = 50
+
+# Uploads are copied and hashed in chunks of this size
+HASH_CHUNK = 1024 * 1024
+
+
+def save_and_hash(stream, dest_path, chunk_size=HASH_CHUNK):
+    """Copy an upload stream to disk and hash it in the same pass; returns the sha256 hex digest"""
+    digest = hashlib.sha256()
+    with open(dest_path, 'wb') as out:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(file_path, chunk_size=HASH_CHUNK):
+    """Streaming sha256 of a file already on disk"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_key(content_hash, **params):
+    """Registry key: the content hash combined with every parse parameter that changes the result"""
+    payload = json.dumps({'content': content_hash, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _copy_path(src, dst):
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(src, dst)
+
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _same_files(registered, workspace):
+    """True if the workspace already holds (hard links to) the registered files"""
+    if not os.path.exists(workspace):
+        return False
+    if os.path.isfile(registered):
+        return os.path.isfile(workspace) and os.path.samefile(registered, workspace)
+    for name in os.listdir(registered):
+        target = os.path.join(workspace, name)
+        if not os.path.isfile(target) or not os.path.samefile(os.path.join(registered, name), target):
+            return False
+    return True
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+class DatasetRegistry:
+    """
+    Cleaned datasets keyed by a hash of the uploaded bytes plus the parse parameters.
+
+    Each entry is a directory holding the cleaned metadata workspace (`data.arrow`) or the
+    expression store (`data.store`), plus the summary stats computed when it was first parsed.
+    """
+
+    def __init__(self, registry_dir=REGISTRY_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.registry_dir = registry_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._index = None
+        # Uploads are registered by the background writer while requests read the index
+        self._lock = threading.RLock()
+
+    # ----------------------------
+    # Index
+    # ----------------------------
+
+    @property
+    def index_path(self):
+        return os.path.join(self.registry_dir, REGISTRY_INDEX)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path) as f:
+                        self._index = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"[!] Dataset registry index unreadable, starting empty: {e}")
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.registry_dir, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.registry_dir, key)
+
+    def _data_path(self, key, kind):
+        name = 'data.store' if kind == 'expression' else 'data.arrow'
+        return os.path.join(self._entry_dir(key), name)
+
+    # ----------------------------
+    # Lookup / restore
+    # ----------------------------
+
+    def get(self, key):
+        """Registry entry for a key, or None (entries whose files disappeared are dropped)"""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        if not os.path.exists(self._data_path(key, entry['kind'])):
+            self.evict(key)
+            return None
+        return entry
+
+    def restore(self, key, workspace_path):
+        """
+        Restore a registered dataset into the working workspace path (metadata `.arrow` file or
+        expression `.store` directory). Returns (entry, loaded data) or (None, None) on a miss.
+        """
+        with self._lock:
+            return self._restore(key, workspace_path)
+
+    def _restore(self, key, workspace_path):
+        entry = self.get(key)
+        if entry is None:
+            return None, None
+
+        data_path = self._data_path(key, entry['kind'])
+        if not _same_files(data_path, workspace_path):
+            tmp_path = workspace_path.rstrip(os.sep) + '.tmp'
+            _remove_path(tmp_path)
+            os.makedirs(os.path.dirname(workspace_path) or '.', exist_ok=True)
+            _copy_path(data_path, tmp_path)
+            # rename() is a no-op between two hard links of one file, so clear the target first
+            _remove_path(workspace_path)
+            os.replace(tmp_path, workspace_path)
+
+        if entry['kind'] == 'expression':
+            data = ExpressionStore.open(workspace_path)
+        else:
+            data = load_workspace_file(workspace_path)
+
+        entry['last_used'] = time.time()
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._save_index()
+        return entry, data
+
+    # ----------------------------
+    # Register
+    # ----------------------------
+
+    def put(self, key, kind, workspace_path, source_name=None, stats=None, params=None):
+        """Register the cleaned output at `workspace_path` (a saved workspace file or store)"""
+        with self._lock:
+            return self._put(key, kind, workspace_path, source_name, stats, params)
+
+    def _put(self, key, kind, workspace_path, source_name=None, stats=None, params=None):
+        if kind not in ('metadata', 'expression'):
+            raise ValueError(f"Unknown dataset kind '{kind}'")
+        if not os.path.exists(workspace_path):
+            raise FileNotFoundError(f"Nothing to register at '{workspace_path}'")
+
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.makedirs(entry_dir)
+        data_path = self._data_path(key, kind)
+        _copy_path(workspace_path, data_path)
+
+        now = time.time()
+        self.index[key] = {
+            'key': key,
+            'kind': kind,
+            'source_name': source_name,
+            'params': params or {},
+            'stats': stats or {},
+            'size_bytes': _path_size(data_path),
+            'created': now,
+            'last_used': now,
+            'hits': 0,
+        }
+        self._save_index()
+        self.enforce_limit()
+        return self.index.get(key)
+
+    # ----------------------------
+    # Listing / eviction
+    # ----------------------------
+
+    def list(self):
+        """Entries without their stats payload, most recently used first"""
+        with self._lock:
+            entries = [{k: v for k, v in entry.items() if k != 'stats'} for entry in self.index.values()]
+        return sorted(entries, key=lambda e: e['last_used'], reverse=True)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry.get('size_bytes', 0) for entry in self.index.values())
+
+    def evict(self, key):
+        with self._lock:
+            entry = self.index.pop(key, None)
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            if entry is not None:
+                self._save_index()
+            return entry is not None
+
+    def clear(self):
+        for key in list(self.index):
+            self.evict(key)
+
+    def enforce_limit(self, max_bytes=None, max_entries=None):
+        """Evict least recently used entries until the registry fits its byte and entry budget"""
+        with self._lock:
+            return self._enforce_limit(max_bytes, max_entries)
+
+    def _enforce_limit(self, max_bytes, max_entries):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_entries = self.max_entries if max_entries is None else max_entries
+        evicted = []
+        by_age = sorted(self.index.values(), key=lambda e: e['last_used'])
+        total = self.total_bytes()
+        count = len(by_age)
+        for entry in by_age:
+            if total <= max_bytes and count <= max_entries:
+                break
+            self.evict(entry['key'])
+            total -= entry.get('size_bytes', 0)
+            count -= 1
+            evicted.append(entry['key'])
+        if evicted:
+            print(f"[✓] Evicted {len(evicted)} cached dataset(s) from the registry")
+        return evicted
@@ -0,0 +1,580 @@
+'''Memory-mapped float32 expression matrix backend (sample-major + gene-major copies) with sample/probe index arrays'''
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from src.data_handling.Missing_data import (impute_columns, packed_width, rows_with_missing,
+                                            count_bits, bits_per_column)
+
+STORE_FORMAT = 'gliomascope-expression-store'
+STORE_VERSION = 1
+
+# Columns are copied into the store in blocks so the float64 -> float32 cast
+# never needs a second full-size temporary matrix
+_COPY_BLOCK = 2048
+
+SAMPLE_MAJOR_FILE = 'values.bin'
+GENE_MAJOR_FILE = 'genes.bin'
+GENE_STATS_FILE = 'gene_stats.npy'
+MISSING_FILE = 'missing.bin'
+
+# Appended samples are read from values.bin until they exceed this many rows and this
+# fraction of the store; then the gene-major copy is rebuilt once to include them
+GENE_TAIL_MIN = 256
+GENE_TAIL_FRACTION = 0.1
+
+# Rows of gene_stats.npy (one column per probe)
+_STAT_COUNT, _STAT_SUM, _STAT_SUMSQ, _STAT_MISSING = range(4)
+
+
+class ExpressionStore:
+    """
+    Contiguous (n_samples x n_probes) expression matrix plus separate sample and probe arrays.
+
+    `values` is either an in-memory ndarray or a read-only np.memmap of `values.bin`
+    inside the store directory. Analyses should slice `values` directly (zero-copy)
+    instead of calling select_dtypes on a wide DataFrame.
+
+    Saved stores also keep a gene-major copy (`gene_values`, n_probes x n_samples in
+    `genes.bin`), so one gene's vector is a single contiguous read of n_samples values.
+    Samples appended later (`append`) are added to `values.bin` only; until the gene-major
+    copy is rebuilt they are read from there (`gene_major_samples` < `n_samples`).
+
+    Cells that were missing before imputation are kept as a packed bitmap (`missing`,
+    n_samples x ceil(n_probes / 8) bytes in `missing.bin`, None when nothing was missing),
+    so analyses can still tell imputed values from measured ones.
+    """
+
+    def __init__(self, values, samples, probes, path=None, gene_values=None, missing=None):
+        values = np.asarray(values) if not isinstance(values, np.memmap) else values
+        if values.ndim != 2:
+            raise ValueError("Expression values must be a 2D (samples x probes) matrix")
+        if values.shape != (len(samples), len(probes)):
+            raise ValueError(
+                f"Expression values have shape {values.shape} but there are "
+                f"{len(samples)} samples and {len(probes)} probes"
+            )
+        self.values = values
+        self.samples = np.asarray(samples, dtype=object)
+        self.probes = np.asarray(probes, dtype=object)
+        if gene_values is not None and (gene_values.shape[0] != values.shape[1] or
+                                        gene_values.shape[1] > values.shape[0]):
+            raise ValueError(f"Gene-major copy has shape {gene_values.shape}, expected {values.shape[::-1]}")
+        self.gene_values = gene_values
+        if missing is not None and missing.shape != (values.shape[0], packed_width(values.shape[1])):
+            raise ValueError(f"Missing-value bitmap has shape {missing.shape}, expected "
+                             f"{(values.shape[0], packed_width(values.shape[1]))}")
+        self.missing = missing
+        self.path = path
+        self._probe_index = None
+        self._probe_offsets = None
+        self._gene_stats = None
+
+    # ----------------------------
+    # Construction
+    # ----------------------------
+
+    @classmethod
+    def from_dataframe(cls, df, sample_col='Sample', dtype=np.float32):
+        """Build a store from a samples-as-rows DataFrame (numeric columns become probes)"""
+        if sample_col not in df.columns:
+            raise ValueError(f"'{sample_col}' column not found in expression data")
+
+        probe_cols = [col for col, dtype in df.dtypes.items()
+                      if col != sample_col and pd.api.types.is_numeric_dtype(dtype)]
+
+        values = np.empty((len(df), len(probe_cols)), dtype=dtype)
+        col_positions = df.columns.get_indexer(probe_cols)
+        for start in range(0, len(probe_cols), _COPY_BLOCK):
+            stop = start + _COPY_BLOCK
+            values[:, start:stop] = df.iloc[:, col_positions[start:stop]].to_numpy(dtype=dtype)
+
+        samples = df[sample_col].astype(str).to_numpy(dtype=object)
+        return cls(values, samples, [str(col) for col in probe_cols])
+
+    def impute(self, method='fill_zero'):
+        """
+        Fill missing values in place (one pass per block of probe columns) and record where they
+        were in `missing`. method='drop' removes samples with any missing value instead, by
+        moving the kept rows up in place. Returns the number of dropped samples.
+        """
+        if self.path is not None:
+            # genes.bin and gene_stats.npy on disk would no longer match values.bin
+            raise ValueError("Impute an expression store before it is saved")
+        bitmap = impute_columns(self.values, method)
+        self._gene_stats = None
+        self.gene_values = None
+        if bitmap is None:
+            return 0
+        if method != 'drop':
+            self.missing = bitmap if self.missing is None else self.missing | bitmap
+            return 0
+
+        keep = np.flatnonzero(~rows_with_missing(bitmap))
+        for row, source in enumerate(keep):
+            if row != source:
+                self.values[row] = self.values[source]
+        self.values = self.values[:len(keep)]
+        self.samples = self.samples[keep]
+        if self.missing is not None:
+            self.missing = self.missing[keep]
+        return len(bitmap) - len(keep)
+
+    # ----------------------------
+    # Properties
+    # ----------------------------
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def n_samples(self):
+        return self.values.shape[0]
+
+    @property
+    def n_probes(self):
+        return self.values.shape[1]
+
+    @property
+    def is_memory_mapped(self):
+        return isinstance(self.values, np.memmap)
+
+    @property
+    def has_gene_major(self):
+        return self.gene_values is not None
+
+    @property
+    def gene_major_samples(self):
+        """Number of leading samples covered by the gene-major copy"""
+        return self.gene_values.shape[1] if self.gene_values is not None else 0
+
+    @property
+    def gene_stats(self):
+        """
+        Per-probe running statistics (rows: non-missing count, sum, sum of squares, missing count).
+        Computed once and saved next to the store; `append` updates them from the new rows only.
+        """
+        if self._gene_stats is None:
+            stats_path = os.path.join(self.path, GENE_STATS_FILE) if self.path else None
+            if stats_path and os.path.exists(stats_path):
+                stats = np.load(stats_path)
+                if stats.shape == (4, self.n_probes):
+                    self._gene_stats = stats
+            if self._gene_stats is None:
+                self._gene_stats = compute_gene_stats(self.values)
+                if stats_path:
+                    _write_npy(stats_path, self._gene_stats)
+        return self._gene_stats
+
+    def gene_means(self):
+        stats = self.gene_stats
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return stats[_STAT_SUM] / stats[_STAT_COUNT]
+
+    def gene_variances(self, ddof=1):
+        stats = self.gene_stats
+        count = stats[_STAT_COUNT]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = stats[_STAT_SUM] / count
+            return np.maximum(stats[_STAT_SUMSQ] - count * mean ** 2, 0) / (count - ddof)
+
+    def missing_count(self):
+        """Number of originally missing values (imputed ones included) in the store"""
+        if self.missing is not None:
+            return count_bits(self.missing)
+        return int(self.gene_stats[_STAT_MISSING].sum())
+
+    def missing_per_probe(self):
+        """Originally missing values per probe"""
+        if self.missing is not None:
+            return bits_per_column(self.missing, self.n_probes)
+        return self.gene_stats[_STAT_MISSING].astype(np.int64)
+
+    def gene_missing(self, probe):
+        """Boolean vector over samples: True where this probe's value was imputed"""
+        offset = self.probe_offsets.get(probe)
+        if offset is None:
+            raise KeyError(f"Probe not found in expression store: {probe}")
+        if self.missing is None:
+            return np.zeros(self.n_samples, dtype=bool)
+        return (np.asarray(self.missing[:, offset >> 3]) & (128 >> (offset & 7))) != 0
+
+    @property
+    def probe_offsets(self):
+        """Hash index probe ID -> row offset in the gene-major copy (column in `values`)"""
+        if self._probe_offsets is None:
+            self._probe_offsets = {probe: i for i, probe in enumerate(self.probes)}
+        return self._probe_offsets
+
+    @property
+    def probe_index(self):
+        """pandas Index over probe IDs, built lazily for position lookups"""
+        if self._probe_index is None:
+            self._probe_index = pd.Index(self.probes)
+        return self._probe_index
+
+    # ----------------------------
+    # Access
+    # ----------------------------
+
+    def probe_positions(self, probes):
+        """Column positions for the given probe IDs (-1 where a probe is unknown)"""
+        return self.probe_index.get_indexer(list(probes))
+
+    def has_probe(self, probe):
+        return probe in self.probe_offsets
+
+    def gene_vector(self, probe):
+        """Expression of one probe across all samples (contiguous read from the gene-major copy)"""
+        offset = self.probe_offsets.get(probe)
+        if offset is None:
+            raise KeyError(f"Probe not found in expression store: {probe}")
+        if self.gene_values is not None:
+            if self.gene_major_samples < self.n_samples:
+                # Appended samples are not in the gene-major copy yet
+                return np.concatenate([self.gene_values[offset],
+                                       self.values[self.gene_major_samples:, offset]])
+            return self.gene_values[offset]
+        return self.values[:, offset]
+
+    def gene_matrix(self, probes):
+        """(len(probes) x n_samples) values for a few probes, read row by row from the gene-major copy"""
+        offsets = [self.probe_offsets.get(probe) for probe in probes]
+        missing = [p for p, offset in zip(probes, offsets) if offset is None]
+        if missing:
+            raise KeyError(f"Probes not found in expression store: {', '.join(map(str, missing))}")
+        if self.gene_values is not None:
+            if self.gene_major_samples < self.n_samples:
+                return np.hstack([self.gene_values[offsets],
+                                  self.values[self.gene_major_samples:, offsets].T])
+            return self.gene_values[offsets]
+        return self.values[:, offsets].T
+
+    def matrix(self, probes=None):
+        """Values for all probes (zero-copy view) or for a subset of probes (small copy)"""
+        if probes is None:
+            return self.values
+        if self.gene_values is not None:
+            return self.gene_matrix(list(probes)).T
+        positions = self.probe_positions(probes)
+        if (positions < 0).any():
+            missing = [p for p, pos in zip(probes, positions) if pos < 0]
+            raise KeyError(f"Probes not found in expression store: {', '.join(map(str, missing))}")
+        return self.values[:, positions]
+
+    def to_frame(self):
+        """
+        DataFrame view over the store: a 'Sample' column followed by one float column per probe.
+        The numeric block shares memory with `values`, so no matrix copy is made.
+        """
+        frame = pd.DataFrame(self.values, columns=pd.Index(self.probes), copy=False)
+        frame.insert(0, 'Sample', self.samples)
+        return frame
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+
+    def snapshot(self):
+        """
+        The store as it is now, for a background writer: shares the arrays (append concatenates
+        in-memory stores and only grows saved files past the current shape), so samples appended
+        to this store later never reach it.
+        """
+        view = ExpressionStore(self.values, self.samples.copy(), self.probes, path=self.path,
+                               gene_values=self.gene_values, missing=self.missing)
+        view._gene_stats = self._gene_stats
+        return view
+
+    def save(self, directory):
+        """Write the store to `directory` (values.bin + index arrays + store.json manifest)"""
+        if self.path and os.path.abspath(self.path) == os.path.abspath(directory):
+            if self.is_memory_mapped and self.values.mode != 'r':
+                self.values.flush()
+            return directory
+
+        tmp_dir = directory.rstrip(os.sep) + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        if self._matches_saved():
+            # Mapped from another saved store with the same contents (e.g. a GEO cache snapshot):
+            # hard-link its files instead of writing the matrix again; appends detach shared files
+            shutil.copytree(self.path, tmp_dir, copy_function=_link_or_copy)
+            return replace_store_dir(tmp_dir, directory)
+        os.makedirs(tmp_dir)
+
+        np.ascontiguousarray(self.values).tofile(os.path.join(tmp_dir, SAMPLE_MAJOR_FILE))
+        if self.gene_values is not None and self.gene_major_samples == self.n_samples:
+            np.ascontiguousarray(self.gene_values).tofile(os.path.join(tmp_dir, GENE_MAJOR_FILE))
+        else:
+            write_gene_major(self.values, os.path.join(tmp_dir, GENE_MAJOR_FILE))
+        if self._gene_stats is not None:
+            _write_npy(os.path.join(tmp_dir, GENE_STATS_FILE), self._gene_stats)
+        if self.missing is not None:
+            np.ascontiguousarray(self.missing).tofile(os.path.join(tmp_dir, MISSING_FILE))
+        write_store_index(tmp_dir, self.samples, self.probes, self.dtype,
+                          missing_mask=self.missing is not None)
+        return replace_store_dir(tmp_dir, directory)
+
+    def _matches_saved(self):
+        """True if the files at `path` still hold exactly this store (nothing swapped in memory)"""
+        if not self.path or not self.is_memory_mapped or self.values.mode != 'r':
+            return False
+        manifest = read_store_manifest(self.path)
+        if manifest is None or tuple(manifest['shape']) != self.shape or manifest['dtype'] != self.dtype.name:
+            return False
+        if bool(manifest.get('missing_mask')) != (self.missing is not None):
+            return False
+        saved_samples = np.load(os.path.join(self.path, 'samples.npy'))
+        return np.array_equal(saved_samples, np.asarray(self.samples, dtype=object).astype(str))
+
+    def append(self, samples, values, missing=None):
+        """
+        Append new sample rows (values: len(samples) x n_probes, in this store's probe order).
+        `missing` is the packed bitmap of the batch's imputed cells (impute_columns), if any.
+
+        A saved store grows in place: the rows are written to the end of values.bin and only
+        the sample index, the per-gene stats and the manifest are rewritten, so the cost is
+        proportional to the batch. The gene-major copy is rebuilt only once the appended
+        rows outgrow GENE_TAIL_MIN / GENE_TAIL_FRACTION. In-memory stores are concatenated.
+        """
+        samples = np.asarray(samples, dtype=object)
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        if values.shape != (len(samples), self.n_probes):
+            raise ValueError(f"Appended values have shape {values.shape}, expected "
+                             f"({len(samples)}, {self.n_probes})")
+        if len(samples) == 0:
+            return self
+
+        # Existing stats first (computed from the current rows only if they were never saved)
+        stats = self.gene_stats + compute_gene_stats(values)
+        all_samples = np.concatenate([self.samples, samples])
+        if missing is None and self.missing is not None:
+            missing = np.zeros((len(samples), self.missing.shape[1]), dtype=np.uint8)
+
+        if self.path is None:
+            self.values = np.concatenate([self.values, values])
+            self.samples = all_samples
+            self._gene_stats = stats
+            if missing is not None:
+                existing = self.missing if self.missing is not None else \
+                    np.zeros((len(all_samples) - len(samples), missing.shape[1]), dtype=np.uint8)
+                self.missing = np.concatenate([existing, missing])
+            return self
+
+        n_old = self.n_samples
+        values_path = os.path.join(self.path, SAMPLE_MAJOR_FILE)
+        # Registry entries hard-link store files; never grow a file another entry shares
+        _detach_hard_link(values_path)
+        with open(values_path, 'r+b' if os.path.exists(values_path) else 'wb') as f:
+            # Bytes past the manifest shape are left over from an interrupted append
+            f.truncate(n_old * self.n_probes * self.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            values.tofile(f)
+
+        n_total = len(all_samples)
+        self.values = np.memmap(values_path, dtype=self.dtype, mode='r', shape=(n_total, self.n_probes))
+        self.samples = all_samples
+        self._gene_stats = stats
+        if missing is not None:
+            self.missing = _append_bitmap(os.path.join(self.path, MISSING_FILE), self.missing, n_old, missing)
+
+        gene_major_samples = self.gene_major_samples
+        tail = n_total - gene_major_samples
+        # Stores saved before the gene-major copy existed get one now
+        if self.gene_values is None or (tail > GENE_TAIL_MIN and tail > GENE_TAIL_FRACTION * n_total):
+            genes_path = os.path.join(self.path, GENE_MAJOR_FILE)
+            write_gene_major(self.values, genes_path + '.tmp')
+            os.replace(genes_path + '.tmp', genes_path)
+            self.gene_values = np.memmap(genes_path, dtype=self.dtype, mode='r',
+                                         shape=(self.n_probes, n_total))
+            gene_major_samples = n_total
+
+        _write_npy(os.path.join(self.path, GENE_STATS_FILE), stats)
+        # The manifest goes last: until it is replaced the store still reads as before the append
+        write_store_index(self.path, self.samples, self.probes, self.dtype,
+                          gene_major_samples=gene_major_samples, write_probes=False,
+                          missing_mask=self.missing is not None)
+        return self
+
+    @classmethod
+    def open(cls, directory, mmap_mode='r'):
+        """Memory-map a saved store. Use mmap_mode='r+' to modify values in place."""
+        manifest = read_store_manifest(directory)
+        if manifest is None:
+            raise ValueError(f"'{directory}' is not a GliomaScope expression store")
+        if manifest.get('version', 0) > STORE_VERSION:
+            raise ValueError(
+                f"Expression store '{directory}' was written by a newer version "
+                f"(v{manifest['version']}, this build reads up to v{STORE_VERSION})"
+            )
+
+        samples = np.load(os.path.join(directory, 'samples.npy')).astype(object)
+        probes = np.load(os.path.join(directory, 'probes.npy')).astype(object)
+        shape = tuple(manifest['shape'])
+
+        gene_values = None
+        if shape[0] * shape[1] == 0:
+            # np.memmap cannot map an empty file
+            values = np.empty(shape, dtype=manifest['dtype'])
+        else:
+            values = np.memmap(os.path.join(directory, SAMPLE_MAJOR_FILE),
+                               dtype=manifest['dtype'], mode=mmap_mode, shape=shape)
+            # Stores written before the gene-major copy existed only have values.bin
+            if 'gene-major' in manifest.get('layouts', []):
+                # Samples appended since the copy was built are not in genes.bin
+                gene_samples = manifest.get('gene_major_samples', shape[0])
+                genes_path = os.path.join(directory, GENE_MAJOR_FILE)
+                expected = shape[1] * gene_samples * np.dtype(manifest['dtype']).itemsize
+                if os.path.exists(genes_path) and os.path.getsize(genes_path) == expected:
+                    gene_values = np.memmap(genes_path, dtype=manifest['dtype'], mode=mmap_mode,
+                                            shape=(shape[1], gene_samples))
+                else:
+                    # e.g. an append was interrupted after rebuilding genes.bin; values.bin still works
+                    print(f"[!] Gene-major copy of '{directory}' does not match its manifest; ignoring it")
+
+        missing = None
+        if manifest.get('missing_mask') and shape[0]:
+            missing_path = os.path.join(directory, MISSING_FILE)
+            missing_shape = (shape[0], packed_width(shape[1]))
+            if os.path.exists(missing_path) and os.path.getsize(missing_path) == missing_shape[0] * missing_shape[1]:
+                missing = np.memmap(missing_path, dtype=np.uint8, mode='r', shape=missing_shape)
+            else:
+                print(f"[!] Missing-value bitmap of '{directory}' does not match its manifest; ignoring it")
+        return cls(values, samples, probes, path=directory, gene_values=gene_values, missing=missing)
+
+
+def write_gene_major(values, path, tile=_COPY_BLOCK):
+    """Write the gene-major copy of a (samples x probes) matrix, one block of probes at a time"""
+    with open(path, 'wb') as f:
+        for start in range(0, values.shape[1], tile):
+            np.ascontiguousarray(values[:, start:start + tile].T).tofile(f)
+    return path
+
+
+def compute_gene_stats(values, block=_COPY_BLOCK):
+    """Per-probe count / sum / sum of squares / missing count over all rows, a block of rows at a time"""
+    stats = np.zeros((4, values.shape[1]), dtype=np.float64)
+    for start in range(0, values.shape[0], block):
+        chunk = np.asarray(values[start:start + block], dtype=np.float64)
+        missing = np.isnan(chunk)
+        chunk = np.where(missing, 0.0, chunk)
+        stats[_STAT_MISSING] += missing.sum(axis=0)
+        stats[_STAT_COUNT] += chunk.shape[0] - missing.sum(axis=0)
+        stats[_STAT_SUM] += chunk.sum(axis=0)
+        stats[_STAT_SUMSQ] += np.square(chunk).sum(axis=0)
+    return stats
+
+
+def _write_npy(path, array):
+    """np.save through a temporary file, so a reader (or a hard-linked copy) never sees a partial file"""
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def _append_bitmap(path, bitmap, n_old, rows):
+    """Grow missing.bin by the batch rows (a store without one gets zero rows for its old samples)"""
+    width = rows.shape[1]
+    _detach_hard_link(path)
+    with open(path, 'r+b' if bitmap is not None and os.path.exists(path) else 'wb') as f:
+        if bitmap is None:
+            np.zeros((n_old, width), dtype=np.uint8).tofile(f)
+        else:
+            f.truncate(n_old * width)
+            f.seek(0, os.SEEK_END)
+        np.ascontiguousarray(rows, dtype=np.uint8).tofile(f)
+    return np.memmap(path, dtype=np.uint8, mode='r', shape=(n_old + len(rows), width))
+
+
+def _link_or_copy(src, dst):
+    """Hard-link when possible, else copy (ExpressionStore.append detaches shared files before growing them)"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _detach_hard_link(path):
+    """Give `path` its own inode if other directory entries (e.g. the dataset registry) share it"""
+    if os.path.exists(path) and os.stat(path).st_nlink > 1:
+        shutil.copy2(path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def write_store_index(directory, samples, probes, dtype, gene_major_samples=None, write_probes=True,
+                      missing_mask=False):
+    """Write the sample/probe arrays and the store.json manifest next to values.bin and genes.bin"""
+    _write_npy(os.path.join(directory, 'samples.npy'), np.asarray(samples, dtype=object).astype(str))
+    if write_probes:
+        _write_npy(os.path.join(directory, 'probes.npy'), np.asarray(probes, dtype=object).astype(str))
+
+    manifest = {
+        'format': STORE_FORMAT,
+        'version': STORE_VERSION,
+        'layout': 'sample-major',
+        'layouts': ['sample-major', 'gene-major'],
+        'dtype': np.dtype(dtype).name,
+        'shape': [len(samples), len(probes)],
+    }
+    if gene_major_samples is not None and gene_major_samples != len(samples):
+        manifest['gene_major_samples'] = int(gene_major_samples)
+    if missing_mask:
+        manifest['missing_mask'] = True
+    manifest_path = os.path.join(directory, 'store.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def replace_store_dir(tmp_dir, directory):
+    """Move a fully written store into place (a crash never leaves a half-written store)"""
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp_dir, directory)
+    return directory
+
+
+def read_store_manifest(directory):
+    manifest_path = os.path.join(directory, 'store.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != STORE_FORMAT:
+        return None
+    return manifest
+
+
+def expression_matrix(expression):
+    """
+    Return (samples, probes, values) for either an ExpressionStore or an expression DataFrame.
+
+    With a store this is zero-copy. A plain DataFrame falls back to extracting its numeric
+    columns once (the pre-store behaviour).
+    """
+    if isinstance(expression, ExpressionStore):
+        return expression.samples, expression.probes, expression.values
+
+    if 'Sample' not in expression.columns:
+        raise ValueError("'Sample' column not found in expression data")
+    probe_cols = [col for col, dtype in expression.dtypes.items()
+                  if col != 'Sample' and pd.api.types.is_numeric_dtype(dtype)]
+    return (expression['Sample'].to_numpy(dtype=object),
+            np.asarray(probe_cols, dtype=object),
+            expression[probe_cols].to_numpy())
+
+
+def expression_frame(expression):
+    """DataFrame view of an ExpressionStore (or the DataFrame itself)"""
+    if isinstance(expression, ExpressionStore):
+        return expression.to_frame()
+    return expression
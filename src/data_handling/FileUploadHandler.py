@@ -1,6 +1,6 @@
-import os
 from src.utils.Utils import load_data, handle_missing_data, validate_file_type, summarise_dataframe, display_and_log_summary
 from src.data_handling.Data_loader import DataManager
+from src.data_handling.Workspace_cache import save_workspace
 
 def process_upload(file_path, data_manager, missing_method='fill_zero', save_cleaned=True):
     df = load_data(file_path)
@@ -27,8 +27,7 @@ def process_upload(file_path, data_manager, missing_method='fill_zero', save_cle
             print(f" - {key}: {value}")
 
         if save_cleaned:
-            os.makedirs('cleaned_data', exist_ok=True)
-            df_cleaned.to_csv("cleaned_data/metadata_cleaned.csv", index=False)
+            save_workspace(df_cleaned, "metadata_cleaned", kind="metadata")
             print("Saved cleaned metadata.")
 
     elif file_type == 'Expression':
@@ -45,8 +44,7 @@ def process_upload(file_path, data_manager, missing_method='fill_zero', save_cle
             print(f" - {key}: {value}")
 
         if save_cleaned:
-            os.makedirs('cleaned_data', exist_ok=True)
-            df_cleaned.to_csv("cleaned_data/expression_cleaned.csv", index=False)
+            data_manager.save_expression_workspace()
             print("Saved cleaned expression data.")
     
     else:
@@ -1,5 +1,6 @@
-import pandas as pd
 import os
+from src.data_handling.Workspace_cache import save_workspace
+from src.utils.Utils import load_data
 
 def format_for_gliomascope(expression_path, metadata_path,
                             expr_id_col='Sample_ID', meta_id_col='Sample_ID',
@@ -8,9 +9,9 @@ def format_for_gliomascope(expression_path, metadata_path,
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
 
-    # Load files
-    expr = pd.read_csv(expression_path, sep=None, engine='python')
-    meta = pd.read_csv(metadata_path, sep=None, engine='python')
+    # Load files (delimiter is sniffed from the header by the Arrow ingest engine)
+    expr = load_data(expression_path)
+    meta = load_data(metadata_path)
 
     # === METADATA FIX ===
     if meta_id_col not in meta.columns:
@@ -39,21 +40,15 @@ def format_for_gliomascope(expression_path, metadata_path,
     }
     meta = meta.rename(columns={k: v for k, v in rename_map.items() if k in meta.columns})
 
-    # Save to cleaned_data/
-    expr_output = os.path.join(output_dir, 'expression.csv')
-    meta_output = os.path.join(output_dir, 'metadata.csv')
-    merged_output = os.path.join(output_dir, 'merged.csv')
+    # Save to cleaned_data/ as binary workspaces (CSV is only used for exports)
+    expr_output = save_workspace(expr, 'expression', kind='expression', workspace_dir=output_dir)
+    meta_output = save_workspace(meta, 'metadata', kind='metadata', workspace_dir=output_dir)
 
-    expr.to_csv(expr_output, index=False)
-    meta.to_csv(meta_output, index=False)
-
-    # Optionally merge and preview
-    merged = pd.merge(expr, meta, on='Sample_ID', how='inner')
-    merged.to_csv(merged_output, index=False)
+    # Preview how many samples match (the merged table itself is not persisted)
+    matched = len(set(expr['Sample_ID']).intersection(meta['Sample_ID']))
 
     print(f"Expression saved to: {expr_output}")
     print(f"Metadata saved to: {meta_output}")
-    print(f"Merged saved to: {merged_output}")
-    print(f"Found {len(merged)} matched samples.")
+    print(f"Found {matched} matched samples.")
 
     return expr_output, meta_output
@@ -0,0 +1,203 @@
+'''Process-wide probe <-> gene symbol index, read once from gene_annotation.csv'''
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+from src.data_handling.Expression_store import ExpressionStore
+
+ANNOTATION_FILE = 'gene_annotation.csv'
+PROBE_COLUMN, SYMBOL_COLUMN, NAME_COLUMN = 'Probe_ID', 'Gene_Symbol', 'Gene_Name'
+# Optional column of other symbols for the gene, separated by '|', ',' or ';'
+ALIAS_COLUMN = 'Aliases'
+
+
+class AnnotationIndex:
+    """
+    Hash maps in both directions over one read of the annotation table: probe -> symbol (and
+    full gene name), and upper-case symbol -> probes (one-to-many, in file order), so symbols
+    match case-insensitively.
+
+    column_symbols() maps a whole probe axis at once (one hash lookup per column). Results for
+    the last probe array are kept, so repeated requests against the loaded store cost nothing.
+    """
+
+    def __init__(self, probes, symbols, names=None, source=None, aliases=None):
+        probes = pd.Series(probes, dtype=object).astype(str).str.strip()
+        symbols = pd.Series(symbols, dtype=object).str.strip()
+        names = pd.Series(names, dtype=object) if names is not None else pd.Series([None] * len(probes))
+        aliases = pd.Series(aliases, dtype=object) if aliases is not None else pd.Series([None] * len(probes))
+        # Unannotated rows are dropped; a probe listed twice keeps its first symbol
+        keep = (symbols.notna() & (symbols != '') & ~probes.duplicated(keep='first')).to_numpy()
+        self.probe_ids = probes.to_numpy()[keep]
+        self.symbols = symbols.to_numpy()[keep]
+        self.names = names.to_numpy()[keep]
+        self.aliases = aliases.to_numpy()[keep]
+        self.source = source
+        self._probe_lookup = pd.Index(self.probe_ids)
+        self.probe_to_symbol = dict(zip(self.probe_ids, self.symbols))
+
+        # Symbol -> probes: one stable sort, then split at each new symbol
+        upper = np.asarray([symbol.upper() for symbol in self.symbols], dtype=object)
+        order = np.argsort(upper, kind='stable')
+        keys, starts = np.unique(upper[order], return_index=True)
+        self.symbol_to_probes = dict(zip(keys, np.split(self.probe_ids[order], starts[1:])))
+        # Upper-case symbol -> spelling used in the file (first occurrence)
+        self.display_symbols = dict(zip(keys, self.symbols[order][starts]))
+        self._aligned = (None, None)
+        # Re-entrant: cached results are built from other cached results
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_frame(cls, df, source=None):
+        names = df[NAME_COLUMN] if NAME_COLUMN in df.columns else None
+        aliases = df[ALIAS_COLUMN] if ALIAS_COLUMN in df.columns else None
+        return cls(df[PROBE_COLUMN], df[SYMBOL_COLUMN], names, source=source, aliases=aliases)
+
+    @classmethod
+    def from_file(cls, annotation_file=ANNOTATION_FILE):
+        columns = (PROBE_COLUMN, SYMBOL_COLUMN, NAME_COLUMN, ALIAS_COLUMN)
+        df = pd.read_csv(annotation_file, dtype=str, usecols=lambda col: col in columns)
+        return cls.from_frame(df, source=annotation_file)
+
+    def __len__(self):
+        return len(self.probe_ids)
+
+    def __repr__(self):
+        return f"AnnotationIndex({len(self)} probes, {len(self.symbol_to_probes)} symbols)"
+
+    # ----------------------------
+    # Single lookups
+    # ----------------------------
+
+    def symbol(self, probe, default=None):
+        return self.probe_to_symbol.get(probe, default)
+
+    def gene_name(self, probe, default=None):
+        position = self._probe_lookup.get_indexer([probe])[0]
+        return self.names[position] if position >= 0 else default
+
+    def probes_for(self, symbol):
+        """Every annotated probe of a gene symbol (any case), in file order"""
+        return list(self.symbol_to_probes.get(str(symbol).strip().upper(), ()))
+
+    def resolve(self, gene, available=None):
+        """
+        Probe ID for a probe ID or gene symbol: the gene's first probe that is in `available`
+        (a store, or a collection of probe IDs), or its first annotated probe. None if unknown.
+        """
+        if available is None:
+            if gene in self.probe_to_symbol:
+                return gene
+            probes = self.probes_for(gene)
+            return probes[0] if probes else None
+        contains = available.has_probe if isinstance(available, ExpressionStore) else available.__contains__
+        if contains(gene):
+            return gene
+        return next((probe for probe in self.probes_for(gene) if contains(probe)), None)
+
+    # ----------------------------
+    # Whole probe axis
+    # ----------------------------
+
+    def _cached(self, probes, name, build):
+        """Result of `build()` for this probe array, kept until a different array is passed"""
+        with self._lock:
+            cached_probes, results = self._aligned
+            if cached_probes is not probes:
+                results = {}
+                self._aligned = (probes, results)
+            if name not in results:
+                results[name] = build()
+            return results[name]
+
+    def column_positions(self, probes):
+        """Row of every probe column in the index (-1 where a probe is not annotated)"""
+        return self._cached(probes, 'positions',
+                            lambda: self._probe_lookup.get_indexer(pd.Index(probes, dtype=object)))
+
+    def column_values(self, probes, field):
+        """`field` ('symbols', 'names' or 'aliases') per probe column, None where not annotated"""
+        def build():
+            positions = self.column_positions(probes)
+            return np.where(positions >= 0, getattr(self, field)[np.maximum(positions, 0)], None)
+        return self._cached(probes, field, build)
+
+    def column_symbols(self, probes):
+        """Symbol per probe column (None where a probe is not annotated), aligned to `probes`"""
+        return self.column_values(probes, 'symbols')
+
+    def _first_probes(self, probes):
+        """Positions of the first column of every annotated symbol, sorted by upper-case symbol"""
+        def build():
+            upper = pd.Series(self.column_symbols(probes), dtype=object).str.upper()
+            named = np.flatnonzero(upper.notna().to_numpy())
+            first = named[~upper.iloc[named].duplicated(keep='first').to_numpy()]
+            return first[np.argsort(upper.to_numpy()[first].astype(str), kind='stable')]
+        return self._cached(probes, 'first', build)
+
+    def named_genes(self, probes):
+        """(symbol, probe) for every symbol in the data (its first probe), sorted by symbol"""
+        probes = np.asarray(probes, dtype=object)
+        first = self._first_probes(probes)
+        return list(zip(self.column_symbols(probes)[first], probes[first]))
+
+    def gene_mapping(self, probes):
+        """Upper-case symbol -> first probe for the data's annotated genes, plus those probes -> themselves"""
+        probes = np.asarray(probes, dtype=object)
+        symbols = self.column_symbols(probes)
+        first = self._first_probes(probes)
+        mapping = dict(zip((symbol.upper() for symbol in symbols[first]), probes[first]))
+        mapping.update((probe, probe) for probe in probes[pd.notna(symbols)])
+        return mapping
+
+    def available_genes(self, probes):
+        """[{'gene_name', 'probe_id', 'display_name'}] for the data's annotated genes, sorted by name"""
+        probes = np.asarray(probes, dtype=object)
+
+        def build():
+            return [{'gene_name': symbol.upper(), 'probe_id': probe,
+                     'display_name': f"{symbol.upper()} ({probe})"}
+                    for symbol, probe in self.named_genes(probes)]
+        return self._cached(probes, 'available', build)
+
+
+def expression_probes(expression):
+    """Probe IDs of an ExpressionStore (its own array, so lookups on it are cached) or DataFrame"""
+    if isinstance(expression, ExpressionStore):
+        return expression.probes
+    return np.asarray([col for col in expression.columns if col != 'Sample'], dtype=object)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def annotation_index(annotation_file=ANNOTATION_FILE):
+    """
+    The shared AnnotationIndex of an annotation file, or None if it is missing or unreadable.
+    The file is read once per process and again only when its size or mtime changes.
+    """
+    key = os.path.abspath(annotation_file)
+    try:
+        stat = os.stat(annotation_file)
+        version = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        version = None
+
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if version is None:
+            print(f"Gene annotation file '{annotation_file}' not found. Using probe IDs only.")
+            index = None
+        else:
+            try:
+                index = AnnotationIndex.from_file(annotation_file)
+            except Exception as e:
+                print(f"Error loading gene annotation file '{annotation_file}': {e}")
+                print("Using probe IDs only.")
+                index = None
+        _indexes[key] = (version, index)
+        return index
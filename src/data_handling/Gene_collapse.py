@@ -0,0 +1,171 @@
+'''Probe -> gene collapse: one column per gene symbol (max-mean probe, max-variance probe or median of probes)'''
+
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from src.data_handling.Expression_store import ExpressionStore, read_store_manifest, _COPY_BLOCK
+from src.data_handling.Missing_data import unpack_bitmap
+
+# max_mean / max_variance keep the gene's probe with the highest mean / variance; median takes
+# the per-sample median over all of the gene's probes
+COLLAPSE_METHODS = ('max_mean', 'max_variance', 'median')
+DEFAULT_COLLAPSE_METHOD = 'max_mean'
+
+# Analyses run on the probe columns as loaded, or on the collapsed gene columns
+EXPRESSION_LEVELS = ('probe', 'gene')
+
+# Gene-level stores are saved inside the probe-level store directory, one per method
+COLLAPSED_DIR = 'collapsed'
+COLLAPSE_FILE = 'collapse.json'
+
+
+def check_collapse_method(method):
+    if method not in COLLAPSE_METHODS:
+        raise ValueError(f"Unknown collapse method '{method}'. Use one of: {', '.join(COLLAPSE_METHODS)}")
+    return method
+
+
+def check_expression_level(level):
+    if level not in EXPRESSION_LEVELS:
+        raise ValueError(f"Unknown expression level '{level}'. Use one of: {', '.join(EXPRESSION_LEVELS)}")
+    return level
+
+
+class GeneGroups:
+    """
+    Annotated probe columns sorted by upper-case gene symbol: the probes of gene i are the
+    columns order[starts[i]:starts[i + 1]], in store order. `genes` holds the symbols as
+    spelled in the annotation file.
+    """
+
+    def __init__(self, probes, annotations):
+        symbols = pd.Series(annotations.column_symbols(probes), dtype=object).str.upper()
+        named = np.flatnonzero(symbols.notna().to_numpy())
+        upper = symbols.to_numpy()[named].astype(str)
+        self.order = named[np.argsort(upper, kind='stable')]
+        keys, starts = np.unique(upper[np.argsort(upper, kind='stable')], return_index=True)
+        self.starts = starts
+        self.sizes = np.diff(np.append(starts, len(self.order)))
+        self.genes = np.asarray([annotations.display_symbols.get(key, key) for key in keys], dtype=object)
+        self.n_probes = len(probes)
+
+    def __len__(self):
+        return len(self.genes)
+
+    def best_probes(self, scores):
+        """Column of the highest-scoring probe of every gene (ties and NaN scores keep store order)"""
+        scores = np.nan_to_num(np.asarray(scores, dtype=np.float64)[self.order], nan=-np.inf)
+        segment = np.repeat(np.arange(len(self)), self.sizes)
+        ranked = np.lexsort((-scores, segment))
+        return self.order[ranked[self.starts]]
+
+    def median(self, block):
+        """Per-row median over each gene's probes for a (rows x n_probes) block"""
+        block = block[:, self.order]
+        out = np.empty((block.shape[0], len(self)), dtype=np.float64)
+        # Genes with the same number of probes are reduced together as one (rows x genes x size) array
+        for size in np.unique(self.sizes):
+            genes = np.flatnonzero(self.sizes == size)
+            columns = self.starts[genes][:, None] + np.arange(size)
+            out[:, genes] = np.median(block[:, columns], axis=2)
+        return out
+
+    def all_missing(self, mask):
+        """Per-row flag for genes whose probes were all missing, for a (rows x n_probes) mask block"""
+        return np.logical_and.reduceat(mask[:, self.order], self.starts, axis=1)
+
+
+def collapse_store(store, annotations, method=DEFAULT_COLLAPSE_METHOD, block=_COPY_BLOCK):
+    """
+    Gene-level ExpressionStore (samples x gene symbols, same dtype) of a probe-level store.
+    Probes without a symbol are left out. The matrix is read once, a block of samples at a time;
+    probe means and variances come from the store's saved per-probe stats.
+    """
+    check_collapse_method(method)
+    groups = GeneGroups(store.probes, annotations)
+    if len(groups) == 0:
+        raise ValueError("No probe of the expression data has a gene symbol; nothing to collapse")
+
+    chosen = None
+    if method == 'max_mean':
+        chosen = groups.best_probes(store.gene_means())
+    elif method == 'max_variance':
+        chosen = groups.best_probes(store.gene_variances())
+
+    values = np.empty((store.n_samples, len(groups)), dtype=store.dtype)
+    missing = None
+    if store.missing is not None:
+        missing = np.empty((store.n_samples, (len(groups) + 7) // 8), dtype=np.uint8)
+    for start in range(0, store.n_samples, block):
+        rows = np.asarray(store.values[start:start + block])
+        values[start:start + block] = rows[:, chosen] if chosen is not None else groups.median(rows)
+        if missing is not None:
+            mask = unpack_bitmap(store.missing[start:start + block], store.n_probes)
+            # A selected probe keeps its flags; a median is flagged only if every probe was missing
+            gene_mask = mask[:, chosen] if chosen is not None else groups.all_missing(mask)
+            missing[start:start + block] = np.packbits(gene_mask, axis=1)
+
+    if missing is not None and not missing.any():
+        missing = None
+    print(f"[✓] Collapsed {store.n_probes:,} probes to {len(groups):,} genes ({method})")
+    return ExpressionStore(values, store.samples.copy(), groups.genes, missing=missing)
+
+
+def _annotation_version(annotations):
+    """What a saved gene-level store was built from on the annotation side"""
+    source = getattr(annotations, 'source', None)
+    if source and os.path.exists(source):
+        stat = os.stat(source)
+        return [os.path.abspath(source), stat.st_size, stat.st_mtime_ns]
+    return [None, len(annotations)]
+
+
+def collapsed_path(store, method):
+    return os.path.join(store.path, COLLAPSED_DIR, method)
+
+
+def _load_collapsed(directory, expected):
+    """The saved gene-level store at `directory` if it was built from the same store and annotations"""
+    try:
+        with open(os.path.join(directory, COLLAPSE_FILE)) as f:
+            built_from = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if built_from != expected or read_store_manifest(directory) is None:
+        return None
+    return ExpressionStore.open(directory)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def gene_level_store(store, annotations, method=DEFAULT_COLLAPSE_METHOD):
+    """
+    Cached gene-level matrix of a probe-level store. Collapsed once per dataset and method:
+    kept in memory, and for saved stores also on disk inside the store directory, so later
+    sessions memory-map it. Rebuilt when samples are appended or the annotation file changes.
+    """
+    check_collapse_method(method)
+    if annotations is None:
+        raise ValueError("Gene-level data needs gene annotations (gene_annotation.csv)")
+
+    with _cache_lock:
+        cached = _cache.get(method)
+        if cached is not None and cached[0] is store and cached[1] == store.shape and cached[2] is annotations:
+            return cached[3]
+
+        expected = {'method': method, 'shape': list(store.shape), 'annotations': _annotation_version(annotations)}
+        collapsed = _load_collapsed(collapsed_path(store, method), expected) if store.path else None
+        if collapsed is None:
+            collapsed = collapse_store(store, annotations, method)
+            if store.path:
+                directory = collapsed.save(collapsed_path(store, method))
+                # Written last: a directory without it is never trusted
+                with open(os.path.join(directory, COLLAPSE_FILE), 'w') as f:
+                    json.dump(expected, f)
+                collapsed = ExpressionStore.open(directory)
+        _cache[method] = (store, store.shape, annotations, collapsed)
+        return collapsed
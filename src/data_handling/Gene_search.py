@@ -0,0 +1,233 @@
+'''Prefix and fuzzy search over the probe IDs, gene symbols, gene names and aliases of the loaded data'''
+
+import re
+import functools
+import threading
+import numpy as np
+import pandas as pd
+from src.data_handling.Expression_store import ExpressionStore
+from src.data_handling.Gene_annotation import expression_probes
+
+# Results per page: default and upper bound
+SEARCH_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Fuzzy matching: shortest query it is tried for, and terms (most shared trigrams) given an edit distance
+FUZZY_MIN_QUERY = 3
+FUZZY_CANDIDATES = 100
+# Queries whose matches are kept, so paging through them does not search again
+RECENT_QUERIES = 128
+
+# Match kinds, best first; an empty query lists every column ('all')
+MATCH_EXACT, MATCH_PREFIX, MATCH_NAME, MATCH_FUZZY, MATCH_ALL = 'exact', 'prefix', 'name', 'fuzzy', 'all'
+
+
+def _trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (a swap of neighbours is one edit); limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
+
+
+class _SortedTerms:
+    """Search terms sorted once: a prefix query is two binary searches returning a contiguous range"""
+
+    def __init__(self, terms, columns):
+        terms = np.asarray(terms, dtype=object)
+        order = np.argsort(terms, kind='stable')
+        self.terms = terms[order]
+        self.columns = np.asarray(columns, dtype=np.int64)[order]
+
+    def prefix(self, query):
+        start = np.searchsorted(self.terms, query, side='left')
+        stop = np.searchsorted(self.terms, query + '\uffff', side='left')
+        return start, stop
+
+
+class GeneSearchIndex:
+    """
+    Search over the probe columns of one dataset. Every column is found by its probe ID, gene
+    symbol and aliases (the "key" terms) and by its full gene name and each word of it.
+
+    Prefix lookups are binary searches in sorted term arrays. Queries that are not the prefix of
+    any key term get fuzzy matches instead: an inverted trigram index (counted with one bincount) picks
+    the candidate terms, and those within a few edits of the query are kept, which catches
+    typos such as 'EGRF'.
+    """
+
+    def __init__(self, probes, annotations=None):
+        self.probes = np.asarray(probes, dtype=object)
+        n = len(self.probes)
+        if annotations is not None:
+            self.symbols = annotations.column_symbols(probes)
+            self.names = annotations.column_values(probes, 'names')
+            aliases = annotations.column_values(probes, 'aliases')
+        else:
+            self.symbols = np.full(n, None, dtype=object)
+            self.names = np.full(n, None, dtype=object)
+            aliases = np.full(n, None, dtype=object)
+
+        columns = np.arange(n)
+        key_terms, key_columns = [self.probes], [columns]
+        named = np.flatnonzero(pd.notna(self.symbols))
+        key_terms.append(self.symbols[named])
+        key_columns.append(named)
+        for column in np.flatnonzero(pd.notna(aliases)):
+            for alias in re.split(r'[|,;]', str(aliases[column])):
+                if alias.strip():
+                    key_terms.append([alias.strip()])
+                    key_columns.append([column])
+        keys = pd.Series(np.concatenate(key_terms), dtype=object).astype(str).str.upper()
+        self.keys = _SortedTerms(keys.to_numpy(), np.concatenate(key_columns))
+
+        # Gene names: the whole name and every word of it
+        name_terms, name_columns = [], []
+        for column in np.flatnonzero(pd.notna(self.names)):
+            name = str(self.names[column]).upper()
+            for term in {name, *re.findall(r'[A-Z0-9]+', name)}:
+                name_terms.append(term)
+                name_columns.append(column)
+        self.name_terms = _SortedTerms(name_terms, name_columns)
+
+        # Distinct key terms: the columns of term i are key_columns[key_offsets[i]:key_offsets[i + 1]]
+        self.distinct_keys, starts = np.unique(self.keys.terms, return_index=True)
+        self._key_offsets = np.append(starts, len(self.keys.terms))
+
+        # Inverted trigram index over the distinct key terms, in the same offsets layout
+        gram_lists = [_trigrams(term) for term in self.distinct_keys]
+        self._n_trigrams = np.fromiter(map(len, gram_lists), dtype=np.int64, count=len(gram_lists))
+        grams = np.fromiter((gram for group in gram_lists for gram in group), dtype=object,
+                            count=int(self._n_trigrams.sum()))
+        term_ids = np.repeat(np.arange(len(gram_lists)), self._n_trigrams)
+        codes, gram_names = pd.factorize(grams)
+        order = np.argsort(codes, kind='stable')
+        self._gram_terms = term_ids[order]
+        self._gram_offsets = np.searchsorted(codes[order], np.arange(len(gram_names) + 1))
+        self._gram_ids = {gram: i for i, gram in enumerate(gram_names)}
+        self._match = functools.lru_cache(maxsize=RECENT_QUERIES)(self._match_query)
+
+    def __len__(self):
+        return len(self.probes)
+
+    # ----------------------------
+    # Matching
+    # ----------------------------
+
+    def fuzzy_terms(self, query):
+        """
+        Ids of the distinct key terms within a few edits of `query` (1 for short queries, up to 3),
+        closest first. Candidates are the terms sharing most trigrams with the query; only those
+        get an edit distance.
+        """
+        ids = [self._gram_ids[gram] for gram in _trigrams(query) if gram in self._gram_ids]
+        if not ids:
+            return np.empty(0, dtype=np.int64)
+        postings = [self._gram_terms[self._gram_offsets[i]:self._gram_offsets[i + 1]] for i in ids]
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.distinct_keys))
+        candidates = np.flatnonzero(shared)
+        if len(candidates) > FUZZY_CANDIDATES:
+            candidates = candidates[np.argpartition(-shared[candidates], FUZZY_CANDIDATES)[:FUZZY_CANDIDATES]]
+
+        max_edits = 1 if len(query) <= 4 else 2 if len(query) <= 8 else 3
+        distances = np.array([edit_distance(query, self.distinct_keys[term], max_edits) for term in candidates])
+        keep = distances <= max_edits
+        candidates, distances = candidates[keep], distances[keep]
+        return candidates[np.lexsort((-shared[candidates], distances))]
+
+    def _key_columns(self, term_ids):
+        if len(term_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.keys.columns[self._key_offsets[i]:self._key_offsets[i + 1]]
+                               for i in term_ids])
+
+    def match(self, query):
+        """(column positions, match kinds) for a query, best matches first, one entry per column"""
+        return self._match(str(query).strip().upper())
+
+    def _match_query(self, query):
+        if not query:
+            # Browse: annotated columns by symbol, then the rest by probe ID
+            symbols = pd.Series(self.symbols, dtype=object).str.upper()
+            columns = np.lexsort((self.probes.astype(str), symbols.fillna('').to_numpy().astype(str),
+                                  symbols.isna().to_numpy()))
+            return columns, np.full(len(columns), MATCH_ALL, dtype=object)
+
+        parts, kinds = [], []
+        start, stop = self.keys.prefix(query)
+        prefix_columns = self.keys.columns[start:stop]
+        exact = self.keys.terms[start:stop] == query
+        parts += [prefix_columns[exact], prefix_columns[~exact]]
+        kinds += [MATCH_EXACT, MATCH_PREFIX]
+
+        start, stop = self.name_terms.prefix(query)
+        parts.append(self.name_terms.columns[start:stop])
+        kinds.append(MATCH_NAME)
+
+        if len(prefix_columns) == 0 and len(query) >= FUZZY_MIN_QUERY:
+            parts.append(self._key_columns(self.fuzzy_terms(query)))
+            kinds.append(MATCH_FUZZY)
+
+        columns = np.concatenate(parts)
+        labels = np.concatenate([np.full(len(part), kind, dtype=object) for part, kind in zip(parts, kinds)])
+        # A column found several ways keeps its best (first) match
+        first = np.sort(np.unique(columns, return_index=True)[1])
+        return columns[first], labels[first]
+
+    def search(self, query, page=1, per_page=SEARCH_PAGE_SIZE):
+        """One page of matches: {'query', 'total', 'page', 'per_page', 'total_pages', 'results'}"""
+        per_page = max(1, min(int(per_page), MAX_PAGE_SIZE))
+        columns, kinds = self.match(query)
+        total = len(columns)
+        total_pages = max(1, (total + per_page - 1) // per_page)
+        page = max(1, min(int(page), total_pages))
+        start = (page - 1) * per_page
+        results = []
+        for column, kind in zip(columns[start:start + per_page], kinds[start:start + per_page]):
+            probe = self.probes[column]
+            symbol = self.symbols[column]
+            gene_name = symbol.upper() if symbol is not None else probe
+            results.append({
+                'gene_name': gene_name,
+                'probe_id': probe,
+                'display_name': f"{gene_name} ({probe})" if symbol is not None else probe,
+                'full_name': self.names[column] if isinstance(self.names[column], str) else None,
+                'match': kind,
+            })
+        return {'query': query, 'total': total, 'page': page, 'per_page': per_page,
+                'total_pages': total_pages, 'results': results}
+
+
+_cache = (None, None, None)
+_cache_lock = threading.Lock()
+
+
+def gene_search_index(expression, annotations=None):
+    """
+    GeneSearchIndex of the loaded expression data (ExpressionStore or DataFrame). Built on the
+    first search and kept until the probe axis or the annotation index changes.
+    """
+    global _cache
+    # The probe array of a store, or the column index of a DataFrame, identifies the data
+    key = expression.probes if isinstance(expression, ExpressionStore) else expression.columns
+    with _cache_lock:
+        cached_key, cached_annotations, index = _cache
+        if cached_key is key and cached_annotations is annotations:
+            return index
+        index = GeneSearchIndex(expression_probes(expression), annotations)
+        _cache = (key, annotations, index)
+        return index
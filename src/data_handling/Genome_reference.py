@@ -0,0 +1,311 @@
+'''Local genome annotation store: gene coordinates and cytoband tables, compiled once into a sorted binary index'''
+
+import os
+import json
+import time
+import threading
+import numpy as np
+import pandas as pd
+from src.data_handling.Annotation_client import annotation_client
+
+REFERENCE_DIR = 'reference'
+# UCSC cytoBand table (chrom, chromStart, chromEnd, name, gieStain; no header), plain or gzipped
+CYTOBAND_FILES = ('cytoBand.txt', 'cytoBand.txt.gz')
+# Gene coordinates with a header row, e.g. an Ensembl BioMart or GENCODE export (tab-separated)
+GENE_FILES = ('gene_coordinates.tsv', 'gene_coordinates.tsv.gz')
+# Written by refresh_from_ensembl; entries in these files win over the files above
+ENSEMBL_BANDS_FILE = 'cytoBand_ensembl.txt'
+ENSEMBL_GENES_FILE = 'gene_coordinates_ensembl.tsv'
+COMPILED_FILE = 'genome_reference.npz'
+# Seconds between checks of the source files for changes, so queries do not stat them every time
+SOURCE_CHECK_INTERVAL = 5.0
+# Seconds a failed (or empty) band fetch is remembered before lookups ask Ensembl for bands again
+BAND_RETRY_INTERVAL = 10 * 60
+
+# Header names accepted in gene coordinate files (lower-case) -> column
+GENE_COLUMN_ALIASES = {
+    'gene name': 'symbol', 'gene_name': 'symbol', 'symbol': 'symbol', 'gene_symbol': 'symbol',
+    'hgnc symbol': 'symbol', 'external_gene_name': 'symbol',
+    'chromosome/scaffold name': 'chromosome', 'chromosome': 'chromosome', 'chrom': 'chromosome',
+    'chromosome_name': 'chromosome', 'seqname': 'chromosome', 'seq_region_name': 'chromosome',
+    'gene start (bp)': 'start', 'start': 'start', 'start_position': 'start', 'chromstart': 'start',
+    'gene end (bp)': 'end', 'end': 'end', 'end_position': 'end', 'chromend': 'end',
+    'strand': 'strand',
+}
+
+
+def normalize_chromosome(name):
+    """'chr7' -> '7', 'chrM' -> 'MT'; Ensembl and UCSC names compare equal"""
+    name = str(name).strip()
+    if name.lower().startswith('chr'):
+        name = name[3:]
+    return 'MT' if name.upper() == 'M' else name.upper() if name.lower() in ('x', 'y', 'mt') else name
+
+
+def _is_primary(chromosomes):
+    """Assembled chromosomes only: no alt haplotypes, patches or unplaced scaffolds"""
+    return ~chromosomes.str.contains(r'[_.]|^CHR|^GL|^KI|^HG|^HS', case=False, regex=True)
+
+
+def _chromosome_order(name):
+    return (0, int(name), '') if name.isdigit() else (1, 0, name)
+
+
+def _read_cytobands(path):
+    bands = pd.read_csv(path, sep='\t', header=None, comment='#', usecols=range(5), dtype={0: str, 3: str, 4: str},
+                        names=['chromosome', 'start', 'end', 'name', 'stain'], keep_default_na=False)
+    bands['chromosome'] = bands['chromosome'].map(normalize_chromosome)
+    return bands[_is_primary(bands['chromosome'])]
+
+
+def _read_gene_coordinates(path):
+    genes = pd.read_csv(path, sep='\t', dtype=str, comment=None)
+    genes = genes.rename(columns=lambda col: GENE_COLUMN_ALIASES.get(col.strip().lower(), col))
+    missing = {'symbol', 'chromosome', 'start', 'end'} - set(genes.columns)
+    if missing:
+        raise ValueError(f"'{path}' has no {', '.join(sorted(missing))} column")
+    genes = genes.dropna(subset=['symbol', 'chromosome', 'start', 'end'])
+    genes['chromosome'] = genes['chromosome'].map(normalize_chromosome)
+    genes = genes[_is_primary(genes['chromosome'])]
+    return pd.DataFrame({
+        'symbol': genes['symbol'].str.strip(),
+        'chromosome': genes['chromosome'],
+        'start': pd.to_numeric(genes['start'], errors='coerce'),
+        'end': pd.to_numeric(genes['end'], errors='coerce'),
+        'strand': genes['strand'].fillna('') if 'strand' in genes.columns else '',
+    }).dropna(subset=['start', 'end'])
+
+
+class GenomeReference:
+    """
+    Gene coordinates and cytobands read from the files in `directory`.
+
+    The tables are compiled once into genome_reference.npz (genes sorted by upper-case symbol,
+    bands sorted by chromosome and start) and memory-loaded on the first query. A gene is one
+    binary search over the symbols, the bands of a chromosome one contiguous slice, and the band
+    at a position one binary search over that slice. The index is rebuilt when a source file changes.
+    """
+
+    def __init__(self, directory=REFERENCE_DIR):
+        self.directory = directory
+        self._tables = None
+        self._checked_at = 0.0
+        self._bands_failed_at = None
+        self._lock = threading.Lock()
+
+    # ----------------------------
+    # Sources / compiled index
+    # ----------------------------
+
+    def _sources(self):
+        """(kind, path) of the source files present, lowest precedence first"""
+        found = [('bands', name) for name in CYTOBAND_FILES] + [('genes', name) for name in GENE_FILES] + \
+                [('bands', ENSEMBL_BANDS_FILE), ('genes', ENSEMBL_GENES_FILE)]
+        return [(kind, os.path.join(self.directory, name)) for kind, name in found
+                if os.path.exists(os.path.join(self.directory, name))]
+
+    def _version(self, sources):
+        return json.dumps([[path, os.path.getsize(path), os.stat(path).st_mtime_ns] for _, path in sources])
+
+    def compile(self):
+        """Read the source tables and write the sorted index; returns the arrays"""
+        sources = self._sources()
+        bands = [_read_cytobands(path) for kind, path in sources if kind == 'bands']
+        genes = [_read_gene_coordinates(path) for kind, path in sources if kind == 'genes']
+
+        # Later sources win: per chromosome for bands, per symbol for genes
+        band_table = pd.concat(bands, ignore_index=True) if bands else \
+            pd.DataFrame(columns=['chromosome', 'start', 'end', 'name', 'stain'])
+        if bands:
+            source_of = np.repeat(np.arange(len(bands)), [len(table) for table in bands])
+            last = pd.Series(source_of).groupby(band_table['chromosome'].to_numpy()).transform('max').to_numpy()
+            band_table = band_table[source_of == last]
+        chromosomes = sorted(band_table['chromosome'].unique(), key=_chromosome_order)
+        band_table = band_table.assign(order=band_table['chromosome'].map({c: i for i, c in enumerate(chromosomes)}))
+        band_table = band_table.sort_values(['order', 'start'], kind='stable')
+        band_offsets = np.searchsorted(band_table['order'].to_numpy(), np.arange(len(chromosomes) + 1))
+
+        gene_table = pd.concat(genes, ignore_index=True) if genes else \
+            pd.DataFrame(columns=['symbol', 'chromosome', 'start', 'end', 'strand'])
+        gene_table = gene_table.assign(key=gene_table['symbol'].str.upper())
+        gene_table = gene_table.drop_duplicates('key', keep='last').sort_values('key', kind='stable')
+
+        tables = {
+            'version': np.array(self._version(sources)),
+            'chromosomes': np.asarray(chromosomes, dtype=str),
+            'band_offsets': band_offsets.astype(np.int64),
+            'band_starts': band_table['start'].to_numpy(dtype=np.int64),
+            'band_ends': band_table['end'].to_numpy(dtype=np.int64),
+            'band_names': band_table['name'].to_numpy(dtype=str),
+            'band_stains': band_table['stain'].to_numpy(dtype=str),
+            'gene_keys': gene_table['key'].to_numpy(dtype=str),
+            'gene_symbols': gene_table['symbol'].to_numpy(dtype=str),
+            'gene_chromosomes': gene_table['chromosome'].to_numpy(dtype=str),
+            'gene_starts': gene_table['start'].to_numpy(dtype=np.int64),
+            'gene_ends': gene_table['end'].to_numpy(dtype=np.int64),
+            'gene_strands': gene_table['strand'].astype(str).to_numpy(dtype=str),
+        }
+        if sources:
+            path = os.path.join(self.directory, COMPILED_FILE)
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, **tables)
+            os.replace(path + '.tmp', path)
+            print(f"[✓] Compiled genome reference: {len(gene_table):,} genes, "
+                  f"{len(band_table):,} bands on {len(chromosomes)} chromosomes")
+        return tables
+
+    @property
+    def tables(self):
+        with self._lock:
+            if self._tables is not None and time.monotonic() - self._checked_at < SOURCE_CHECK_INTERVAL:
+                return self._tables
+            self._checked_at = time.monotonic()
+            sources = self._sources()
+            version = self._version(sources)
+            if self._tables is not None and str(self._tables['version']) == version:
+                return self._tables
+            path = os.path.join(self.directory, COMPILED_FILE)
+            tables = None
+            if os.path.exists(path):
+                with np.load(path, allow_pickle=False) as data:
+                    if str(data['version']) == version:
+                        tables = {key: data[key] for key in data.files}
+            self._tables = tables if tables is not None else self.compile()
+            return self._tables
+
+    def invalidate(self):
+        with self._lock:
+            self._tables = None
+
+    # ----------------------------
+    # Queries
+    # ----------------------------
+
+    @property
+    def has_genes(self):
+        return len(self.tables['gene_keys']) > 0
+
+    @property
+    def has_bands(self):
+        return len(self.tables['chromosomes']) > 0
+
+    @property
+    def band_fetch_due(self):
+        """False for BAND_RETRY_INTERVAL seconds after a band fetch failed or found no bands"""
+        return self._bands_failed_at is None or time.monotonic() - self._bands_failed_at > BAND_RETRY_INTERVAL
+
+    def gene(self, symbol):
+        """{'symbol', 'chromosome', 'start', 'end', 'strand'} of a gene symbol (any case), or None"""
+        tables = self.tables
+        key = str(symbol).strip().upper()
+        i = np.searchsorted(tables['gene_keys'], key)
+        if i >= len(tables['gene_keys']) or tables['gene_keys'][i] != key:
+            return None
+        return {'symbol': str(tables['gene_symbols'][i]), 'chromosome': str(tables['gene_chromosomes'][i]),
+                'start': int(tables['gene_starts'][i]), 'end': int(tables['gene_ends'][i]),
+                'strand': str(tables['gene_strands'][i])}
+
+    def _band_slice(self, chromosome):
+        tables = self.tables
+        chromosome = normalize_chromosome(chromosome)
+        matches = np.flatnonzero(tables['chromosomes'] == chromosome)
+        if len(matches) == 0:
+            return None
+        i = matches[0]
+        return slice(tables['band_offsets'][i], tables['band_offsets'][i + 1])
+
+    def bands(self, chromosome):
+        """[{'name', 'start', 'end', 'stain'}] of a chromosome from pter to qter; [] if it has no band table"""
+        rows = self._band_slice(chromosome)
+        if rows is None:
+            return []
+        tables = self.tables
+        return [{'name': str(name), 'start': int(start), 'end': int(end), 'stain': str(stain)}
+                for name, start, end, stain in zip(tables['band_names'][rows], tables['band_starts'][rows],
+                                                   tables['band_ends'][rows], tables['band_stains'][rows])]
+
+    def band_at(self, chromosome, position):
+        """Name of the band containing `position` (e.g. 'p11.2'), or None"""
+        rows = self._band_slice(chromosome)
+        if rows is None:
+            return None
+        tables = self.tables
+        starts = tables['band_starts'][rows]
+        i = np.searchsorted(starts, position, side='right') - 1
+        if i < 0 or position > tables['band_ends'][rows][i]:
+            return None
+        return str(tables['band_names'][rows][i])
+
+    def chromosome_length(self, chromosome):
+        rows = self._band_slice(chromosome)
+        return int(self.tables['band_ends'][rows][-1]) if rows is not None and rows.stop > rows.start else None
+
+    def locate(self, symbol):
+        """Gene coordinates plus cytoband span ('17p13.1', or '7p11.2-p11.1' across bands), or None"""
+        location = self.gene(symbol)
+        if location is None:
+            return None
+        first = self.band_at(location['chromosome'], location['start'])
+        last = self.band_at(location['chromosome'], location['end'])
+        cytoband = None
+        if first:
+            cytoband = f"{location['chromosome']}{first}" + (f"-{last}" if last and last != first else '')
+        return {**location, 'cytoband': cytoband}
+
+    # ----------------------------
+    # Optional refresh
+    # ----------------------------
+
+    def refresh_from_ensembl(self, symbols=(), bands=True, client=None):
+        """
+        Fetch coordinates for `symbols` and, with bands=True, the karyotype bands of the current
+        assembly through the annotation client (pooled, cached, bulk lookups), and store them next
+        to the local tables. Never needed for queries; returns the number of genes written.
+        """
+        client = client or annotation_client()
+        os.makedirs(self.directory, exist_ok=True)
+
+        if bands:
+            self._bands_failed_at = time.monotonic()
+            rows = [(f"chr{normalize_chromosome(region['name'])}", band['start'] - 1, band['end'],
+                     band['id'], band.get('stain', ''))
+                    for region in client.assembly_bands()
+                    if region.get('coord_system') == 'chromosome' for band in region.get('bands', [])]
+            if rows:
+                self._bands_failed_at = None
+                _write_table(os.path.join(self.directory, ENSEMBL_BANDS_FILE),
+                             pd.DataFrame(rows), header=False)
+
+        found = [{'symbol': symbol, 'chromosome': gene['seq_region_name'], 'start': gene['start'],
+                  'end': gene['end'], 'strand': gene.get('strand', '')}
+                 for symbol, gene in client.lookup_symbols(symbols).items()
+                 if gene and gene.get('seq_region_name')]
+        if found:
+            path = os.path.join(self.directory, ENSEMBL_GENES_FILE)
+            table = pd.DataFrame(found)
+            if os.path.exists(path):
+                table = pd.concat([_read_gene_coordinates(path), table]).drop_duplicates('symbol', keep='last')
+            _write_table(path, table, header=True)
+
+        self.invalidate()
+        print(f"[✓] Refreshed genome reference from Ensembl: {len(found)} genes"
+              + (", cytobands" if bands else ""))
+        return len(found)
+
+
+def _write_table(path, df, header):
+    df.to_csv(path + '.tmp', sep='\t', index=False, header=header)
+    os.replace(path + '.tmp', path)
+
+
+_references = {}
+_references_lock = threading.Lock()
+
+
+def genome_reference(directory=REFERENCE_DIR):
+    """The shared GenomeReference of a directory (nothing is read until the first query)"""
+    key = os.path.abspath(directory)
+    with _references_lock:
+        if key not in _references:
+            _references[key] = GenomeReference(directory)
+        return _references[key]
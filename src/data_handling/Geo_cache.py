@@ -0,0 +1,219 @@
+'''Local GEO cache: parsed series are kept as binary snapshots so repeat loads skip GEOparse'''
+
+import os
+import re
+import json
+import time
+import shutil
+import numpy as np
+from src.data_handling.Workspace_cache import WORKSPACE_DIR, save_workspace, load_workspace
+from src.data_handling.Expression_store import ExpressionStore
+from src.data_handling.Dataset_registry import hash_file, dataset_key, _copy_path
+
+GEO_CACHE_DIR = os.path.join(WORKSPACE_DIR, 'geo_cache')
+GEO_DOWNLOAD_DIR = 'uploads'
+SNAPSHOT_INDEX = 'snapshot.json'
+CHECKSUM_INDEX = 'checksums.json'
+
+# Accessions become directory names
+_ACCESSION_PATTERN = re.compile(r'^G(SE|DS|SM|PL)\d+$', re.IGNORECASE)
+
+# Bump when the parsed tables change shape/content, so older snapshots are not reused
+SNAPSHOT_VERSION = 2
+
+
+def is_geo_accession(geo_id):
+    return bool(_ACCESSION_PATTERN.match(str(geo_id)))
+
+
+def soft_file_path(geo_id, destdir=GEO_DOWNLOAD_DIR):
+    """Where GEOparse downloads the SOFT file of an accession (series use the family file)"""
+    geo_id = geo_id.upper()
+    if geo_id.startswith('GSE'):
+        return os.path.join(destdir, f"{geo_id}_family.soft.gz")
+    if geo_id.startswith('GDS'):
+        return os.path.join(destdir, f"{geo_id}.soft.gz")
+    return os.path.join(destdir, f"{geo_id}.txt")
+
+
+class GeoCache:
+    """
+    Parsed GEO series stored under `<cache_dir>/<accession>/<key>/` as a metadata workspace
+    (`metadata.arrow`) and a memory-mapped expression store (`expression.store`).
+
+    The key combines the SHA-256 of the downloaded SOFT file with the parse options, so a
+    re-downloaded (changed) file or different options never reuse a stale snapshot. The
+    checksum is remembered per file size and mtime, so a repeat load does not re-hash the
+    file. Without the SOFT file (offline, or the download was removed) the newest snapshot
+    parsed with the same options is used.
+    """
+
+    def __init__(self, cache_dir=GEO_CACHE_DIR, download_dir=GEO_DOWNLOAD_DIR):
+        self.cache_dir = cache_dir
+        self.download_dir = download_dir
+
+    def _accession_dir(self, geo_id):
+        if not is_geo_accession(geo_id):
+            raise ValueError(f"Invalid GEO accession '{geo_id}'")
+        return os.path.join(self.cache_dir, geo_id.upper())
+
+    # ----------------------------
+    # Checksums
+    # ----------------------------
+
+    def _read_json(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def soft_checksum(self, geo_id):
+        """SHA-256 of the downloaded SOFT file (None if it is not on disk)"""
+        soft_path = soft_file_path(geo_id, self.download_dir)
+        if not os.path.exists(soft_path):
+            return None
+        stat = os.stat(soft_path)
+        index_path = os.path.join(self._accession_dir(geo_id), CHECKSUM_INDEX)
+        known = self._read_json(index_path) or {}
+        entry = known.get(os.path.basename(soft_path))
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            return entry['sha256']
+
+        checksum = hash_file(soft_path)
+        known[os.path.basename(soft_path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                              'sha256': checksum}
+        self._write_json(index_path, known)
+        return checksum
+
+    def snapshot_key(self, checksum, options):
+        return dataset_key(checksum, snapshot_version=SNAPSHOT_VERSION, **options)
+
+    # ----------------------------
+    # Lookup
+    # ----------------------------
+
+    def _snapshots(self, geo_id):
+        """(directory, index) of every complete snapshot of an accession, newest first"""
+        accession_dir = self._accession_dir(geo_id)
+        if not os.path.isdir(accession_dir):
+            return []
+        found = []
+        for name in os.listdir(accession_dir):
+            if name.endswith('.tmp'):
+                continue
+            index = self._read_json(os.path.join(accession_dir, name, SNAPSHOT_INDEX))
+            if index is not None:
+                found.append((os.path.join(accession_dir, name), index))
+        return sorted(found, key=lambda item: item[1].get('created', 0), reverse=True)
+
+    def find(self, geo_id, options):
+        """Snapshot directory for the accession as downloaded now (or offline fallback), or None"""
+        checksum = self.soft_checksum(geo_id)
+        if checksum is not None:
+            directory = os.path.join(self._accession_dir(geo_id), self.snapshot_key(checksum, options))
+            return directory if os.path.exists(os.path.join(directory, SNAPSHOT_INDEX)) else None
+
+        # No SOFT file: any snapshot parsed with the same options (the newest one)
+        for directory, index in self._snapshots(geo_id):
+            if index.get('options') == options and index.get('version') == SNAPSHOT_VERSION:
+                print(f"[!] {soft_file_path(geo_id, self.download_dir)} not found; "
+                      f"using the cached snapshot of {geo_id.upper()}")
+                return directory
+        return None
+
+    def load(self, geo_id, options, checkout=None):
+        """
+        (metadata DataFrame, ExpressionStore) from the cache, or None. The caller always gets its
+        own store, so appending samples to it never changes the snapshot: with `checkout` the
+        files are hard-linked to that directory and memory-mapped from there (appends detach
+        them), otherwise the matrix is read into memory.
+        """
+        directory = self.find(geo_id, options)
+        if directory is None:
+            return None
+        try:
+            metadata = load_workspace('metadata', workspace_dir=directory)
+            store_dir = os.path.join(directory, 'expression.store')
+            if checkout is not None:
+                shutil.rmtree(checkout, ignore_errors=True)
+                os.makedirs(os.path.dirname(checkout) or '.', exist_ok=True)
+                _copy_path(store_dir, checkout)
+                store_dir = checkout
+            store = ExpressionStore.open(store_dir)
+            if checkout is None:
+                store = ExpressionStore(np.array(store.values), store.samples, store.probes,
+                                        missing=None if store.missing is None else np.array(store.missing))
+        except Exception as e:
+            print(f"[!] Cached snapshot of {geo_id.upper()} is unreadable, parsing again: {e}")
+            return None
+        print(f"[✓] Loaded {geo_id.upper()} from the GEO cache ({store.n_samples} samples, "
+              f"{store.n_probes} probes)")
+        return metadata, store
+
+    # ----------------------------
+    # Saving / pruning
+    # ----------------------------
+
+    def save(self, geo_id, metadata, expression, options):
+        """
+        Snapshot a parsed series (expression: DataFrame or ExpressionStore). Older snapshots
+        with the same options are removed. Returns the snapshot directory, or None when the
+        SOFT file to key it on is missing.
+        """
+        checksum = self.soft_checksum(geo_id)
+        if checksum is None:
+            return None
+        directory = os.path.join(self._accession_dir(geo_id), self.snapshot_key(checksum, options))
+        tmp_dir = directory + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        save_workspace(metadata, 'metadata', kind='metadata', workspace_dir=tmp_dir)
+        if not isinstance(expression, ExpressionStore):
+            expression = ExpressionStore.from_dataframe(expression)
+        expression.save(os.path.join(tmp_dir, 'expression.store'))
+        # The index goes last: a directory without it is never read
+        self._write_json(os.path.join(tmp_dir, SNAPSHOT_INDEX), {
+            'geo_id': geo_id.upper(),
+            'version': SNAPSHOT_VERSION,
+            'checksum': checksum,
+            'options': options,
+            'samples': int(expression.n_samples),
+            'probes': int(expression.n_probes),
+            'created': time.time(),
+        })
+
+        for old_dir, index in self._snapshots(geo_id):
+            if old_dir != directory and index.get('options') == options:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(tmp_dir, directory)
+        return directory
+
+    def list(self):
+        """One entry per cached snapshot"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for geo_id in sorted(os.listdir(self.cache_dir)):
+            for directory, index in self._snapshots(geo_id):
+                entries.append(dict(index, key=os.path.basename(directory)))
+        return entries
+
+    def remove(self, geo_id):
+        accession_dir = self._accession_dir(geo_id)
+        if os.path.isdir(accession_dir):
+            shutil.rmtree(accession_dir)
+            return True
+        return False
+
+
+# Shared cache used by fetch_and_format_geo
+geo_cache = GeoCache()
@@ -0,0 +1,205 @@
+'''Missing-value stage for expression matrices: in-place imputation plus a bitmap of the originally missing cells'''
+
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+MISSING_METHODS = ('fill_zero', 'fill_mean', 'fill_median', 'knn', 'drop')
+
+# Probes (columns) imputed per step; a multiple of 8 so each block packs into whole bitmap bytes
+_IMPUTE_BLOCK = 2048
+
+# KNN imputation: neighbours per sample, PCA components they are searched in, genes per work item
+KNN_NEIGHBORS = 10
+KNN_COMPONENTS = 20
+_KNN_BLOCK = 512
+
+# Number of set bits in every possible byte
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def check_missing_method(method):
+    if method not in MISSING_METHODS:
+        raise ValueError("Invalid method. Choose 'fill_zero', 'drop', 'fill_mean', 'fill_median' or 'knn'")
+    return method
+
+
+def fill_block(block, nan_mask, method, sample_axis=0):
+    """
+    Impute one block in place. `sample_axis` is the axis that runs over samples, so column
+    statistics of the samples-as-rows table are taken along it (0 for a sample-major block,
+    1 for a gene-major one). Genes with no values at all stay NaN, as with DataFrame.fillna(mean).
+    'drop' leaves the block untouched (whole samples are removed by the caller); 'knn' fills the
+    means as a first estimate, which knn_impute then replaces once every block has been seen.
+    """
+    check_missing_method(method)
+    if method == 'drop' or not nan_mask.any():
+        return block
+    if method == 'fill_zero':
+        np.copyto(block, 0, where=nan_mask)
+        return block
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if method in ('fill_mean', 'knn'):
+            fill = np.nanmean(block, axis=sample_axis, keepdims=True)
+        else:
+            fill = np.nanmedian(block, axis=sample_axis, keepdims=True)
+    # Broadcasting copy: no index arrays or second block are built
+    np.copyto(block, fill.astype(block.dtype, copy=False), where=nan_mask)
+    return block
+
+
+def impute_columns(values, method='fill_zero', block=_IMPUTE_BLOCK):
+    """
+    Impute a (samples x probes) matrix in place, one block of probe columns per pass, and
+    return the packed bitmap of the cells that were missing (n_samples x ceil(n_probes / 8)
+    uint8, np.packbits bit order), or None if nothing was missing.
+
+    With method='drop' nothing is filled; rows of the bitmap with any bit set are the samples
+    to remove (see rows_with_missing). method='knn' mean-fills in this pass, then runs knn_impute.
+    """
+    check_missing_method(method)
+    n_samples, n_probes = values.shape
+    bitmap = None
+    for start in range(0, n_probes, block):
+        chunk = values[:, start:start + block]
+        nan_mask = np.isnan(chunk)
+        if not nan_mask.any():
+            continue
+        if bitmap is None:
+            bitmap = np.zeros((n_samples, packed_width(n_probes)), dtype=np.uint8)
+        packed = np.packbits(nan_mask, axis=1)
+        bitmap[:, start // 8:start // 8 + packed.shape[1]] = packed
+        fill_block(chunk, nan_mask, method, sample_axis=0)
+    if method == 'knn' and bitmap is not None:
+        knn_impute(values, bitmap)
+    return bitmap
+
+
+def knn_impute(values, bitmap, n_neighbors=KNN_NEIGHBORS, n_components=KNN_COMPONENTS,
+               block=_KNN_BLOCK, n_jobs=None):
+    """
+    Replace the first-pass (mean) estimates of the cells set in `bitmap` with the distance-weighted
+    mean of the same gene in the sample's nearest neighbours, in place.
+
+    Neighbours are searched in the space of the top `n_components` principal components (a
+    randomized PCA over blocks of genes), so the search costs O(n_samples x n_components) per
+    sample instead of a scan of every gene. Genes are then imputed in independent blocks on
+    `n_jobs` threads (default: all cores); only neighbours that measured a gene contribute to it,
+    and cells none of them measured keep the mean.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    n_samples, n_probes = values.shape
+    targets = np.flatnonzero(rows_with_missing(bitmap))
+    if len(targets) == 0 or n_samples < 2:
+        return values
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    scores = pca_scores(values, min(n_components, n_samples - 1, n_probes))
+    k = min(n_neighbors, n_samples - 1)
+    search = NearestNeighbors(n_neighbors=k + 1, n_jobs=n_jobs).fit(scores)
+    distances, neighbors = search.kneighbors(scores[targets])
+    # Drop each sample from its own neighbour list (it is not always first when rows are duplicated)
+    not_self = neighbors != targets[:, None]
+    order = np.argsort(~not_self, axis=1, kind='stable')[:, :k]
+    neighbors = np.take_along_axis(neighbors, order, axis=1)
+    weights = 1.0 / (np.take_along_axis(distances, order, axis=1) + 1e-6)
+
+    def impute_block(start):
+        stop = min(start + block, n_probes)
+        chunk = values[:, start:stop]
+        mask = unpack_bitmap(bitmap[:, start // 8:(stop + 7) // 8], stop - start)
+        rows = np.flatnonzero(mask[targets].any(axis=1))
+        if len(rows) == 0:
+            return
+        samples = targets[rows]
+        nb = neighbors[rows]
+        observed = ~mask[nb]
+        w = weights[rows][:, :, None] * observed
+        total = w.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            estimate = (w * chunk[nb]).sum(axis=1) / total
+        sub = chunk[samples]
+        np.copyto(sub, estimate.astype(sub.dtype, copy=False), where=mask[samples] & (total > 0))
+        chunk[samples] = sub
+
+    # Blocks cover disjoint columns, so threads write to the matrix without locking
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        list(pool.map(impute_block, range(0, n_probes, block)))
+    return values
+
+
+def pca_scores(values, n_components, n_iter=2, block=_IMPUTE_BLOCK, seed=0):
+    """
+    Sample scores on the top principal components of a (samples x probes) matrix by randomized
+    SVD. The matrix is read one block of genes per pass and centred on the fly, so no centred
+    copy is made (genes left NaN, i.e. never measured, count as their mean).
+    """
+    n_samples, n_probes = values.shape
+    width = min(n_components + 10, n_samples, n_probes)
+    starts = range(0, n_probes, block)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.concatenate([np.nanmean(values[:, start:start + block], axis=0, dtype=np.float64)
+                                for start in starts])
+
+    def centred(start):
+        chunk = np.asarray(values[:, start:start + block], dtype=np.float64) - means[start:start + block]
+        return np.nan_to_num(chunk, copy=False)
+
+    def times(right):
+        # centred matrix @ right (probes x width)
+        return sum(centred(start) @ right[start:start + block] for start in starts)
+
+    def times_transposed(left):
+        # centred matrix.T @ left (samples x width)
+        return np.concatenate([centred(start).T @ left for start in starts])
+
+    rng = np.random.default_rng(seed)
+    basis = np.linalg.qr(times(rng.standard_normal((n_probes, width))))[0]
+    for _ in range(n_iter):
+        basis = np.linalg.qr(times(np.linalg.qr(times_transposed(basis))[0]))[0]
+    u, singular, _ = np.linalg.svd(times_transposed(basis).T, full_matrices=False)
+    return (basis @ u[:, :n_components]) * singular[:n_components]
+
+
+def bitmap_from_positions(n_samples, n_probes, sample_positions, probe_positions):
+    """Packed bitmap with the given (sample, probe) cells set (e.g. NaNs collected from gene blocks)"""
+    bitmap = np.zeros((n_samples, packed_width(n_probes)), dtype=np.uint8)
+    probe_positions = np.asarray(probe_positions, dtype=np.int64)
+    bits = np.right_shift(128, probe_positions & 7).astype(np.uint8)
+    np.bitwise_or.at(bitmap, (np.asarray(sample_positions, dtype=np.int64), probe_positions >> 3), bits)
+    return bitmap
+
+
+def packed_width(n_probes):
+    return (n_probes + 7) // 8
+
+
+def unpack_bitmap(bitmap, n_probes):
+    """Boolean (rows x n_probes) mask from packed bitmap rows"""
+    return np.unpackbits(np.asarray(bitmap), axis=1, count=n_probes).view(bool)
+
+
+def rows_with_missing(bitmap):
+    """Boolean per sample: True where the sample had any missing value"""
+    return np.asarray(bitmap).any(axis=1)
+
+
+def count_bits(bitmap, block=4096):
+    """Total number of set bits, a block of rows at a time"""
+    total = 0
+    for start in range(0, bitmap.shape[0], block):
+        total += int(_POPCOUNT[np.asarray(bitmap[start:start + block])].sum())
+    return total
+
+
+def bits_per_column(bitmap, n_probes, block=4096):
+    """Number of set bits per probe (originally missing values per gene)"""
+    counts = np.zeros(n_probes, dtype=np.int64)
+    for start in range(0, bitmap.shape[0], block):
+        counts += unpack_bitmap(bitmap[start:start + block], n_probes).sum(axis=0)
+    return counts
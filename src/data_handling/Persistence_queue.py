@@ -0,0 +1,124 @@
+'''Write-behind persistence: dataset snapshots are written by a background thread, off the request path'''
+
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class PersistenceQueue:
+    """
+    Background writer for workspace files, stores and CSV exports.
+
+    Jobs are keyed by their target (a path or workspace name). Submitting a job for a target
+    that already has one waiting replaces it, so only the newest snapshot is written; a job
+    whose version was already written (or is already queued) is dropped. `wait(key)` and
+    `flush()` block until writes are on disk, e.g. before a download or when the CLI exits.
+    """
+
+    def __init__(self, name='gliomascope-writer'):
+        self.name = name
+        self._cond = threading.Condition()
+        # key -> (version, fn, args, kwargs), oldest first
+        self._pending = OrderedDict()
+        self._running = None
+        # key -> last version written successfully
+        self._written = {}
+        self.errors = {}
+        self._thread = None
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, key, fn, *args, version=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) to write `key`. Returns False if the same version is already
+        written or queued (nothing to do).
+        """
+        with self._cond:
+            if version is not None:
+                queued = self._pending.get(key)
+                if queued is not None and queued[0] == version:
+                    return False
+                if queued is None and self._running != key and self._written.get(key) == version:
+                    return False
+            self._pending[key] = (version, fn, args, kwargs)
+            self._pending.move_to_end(key)
+            self._ensure_worker()
+            self._cond.notify_all()
+        return True
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, (version, fn, args, kwargs) = self._pending.popitem(last=False)
+                self._running = key
+
+            error = None
+            start = time.perf_counter()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+                print(f"[!] Background write of '{key}' failed: {e}")
+
+            with self._cond:
+                self._running = None
+                if error is None:
+                    self._written[key] = version
+                    self.errors.pop(key, None)
+                    print(f"[✓] Wrote '{key}' in the background ({time.perf_counter() - start:.2f}s)")
+                else:
+                    self.errors[key] = error
+                self._cond.notify_all()
+
+    def is_pending(self, key):
+        with self._cond:
+            return key in self._pending or self._running == key
+
+    def pending(self):
+        with self._cond:
+            keys = list(self._pending)
+            return ([self._running] if self._running is not None else []) + keys
+
+    def wait(self, key, timeout=None):
+        """Block until `key` has no queued or running write; returns False on timeout or failure"""
+        with self._cond:
+            done = self._cond.wait_for(lambda: key not in self._pending and self._running != key,
+                                       timeout=timeout)
+            return done and key not in self.errors
+
+    def flush(self, timeout=None):
+        """Block until every queued write has finished; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and self._running is None,
+                                       timeout=timeout)
+
+    def cancel(self, key=None):
+        """Drop queued (not yet running) writes for one key, or all of them"""
+        with self._cond:
+            if key is None:
+                self._pending.clear()
+            else:
+                self._pending.pop(key, None)
+            self._cond.notify_all()
+
+
+# Shared queue used by the web app and the CLI
+persistence_queue = PersistenceQueue()
+
+
+def flush_pending_writes(timeout=None):
+    """Wait for all background writes (call before exiting)"""
+    pending = persistence_queue.pending()
+    if pending:
+        print(f"Finishing {len(pending)} pending write(s)...")
+    return persistence_queue.flush(timeout=timeout)
+
+
+# Interpreter shutdown kills daemon threads, so pending writes are finished first
+atexit.register(flush_pending_writes)
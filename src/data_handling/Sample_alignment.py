@@ -0,0 +1,120 @@
+'''Index-aligned join between metadata rows and expression rows (replaces the merged DataFrame)'''
+
+import sys
+import numpy as np
+import pandas as pd
+
+
+def normalize_sample_ids(values):
+    """
+    Canonical form of sample IDs used for matching: stripped, upper-case, interned strings
+    (equal IDs in metadata and expression then share one string object).
+    """
+    canonical = pd.Index(values).astype(str).str.strip().str.upper()
+    return np.fromiter((sys.intern(sample) for sample in canonical), dtype=object, count=len(canonical))
+
+
+class SampleAlignment:
+    """
+    Lazy inner join of metadata and expression on Sample.
+
+    Only two integer position arrays are stored: for every matched sample, its row in the
+    expression matrix and its (first) row in the metadata table. Aligned metadata columns
+    and expression rows are fetched through them, so the merged frame is never built.
+    """
+
+    def __init__(self, metadata_samples, expression_samples, canonical=False):
+        # canonical=True: both ID arrays already went through normalize_sample_ids
+        if canonical:
+            meta_keys = np.asarray(metadata_samples, dtype=object)
+            expr_keys = np.asarray(expression_samples, dtype=object)
+        else:
+            meta_keys = normalize_sample_ids(metadata_samples)
+            expr_keys = normalize_sample_ids(expression_samples)
+
+        # Duplicate metadata rows: the first one wins
+        first_rows = np.flatnonzero(~pd.Index(meta_keys).duplicated(keep='first'))
+        self._first_rows = first_rows
+        self._metadata_keys = pd.Index(meta_keys[first_rows])
+        lookup = self._metadata_keys.get_indexer(expr_keys)
+
+        # Metadata row for every expression row (-1 where the sample has no metadata)
+        self.expression_to_metadata = np.where(lookup >= 0, first_rows[np.maximum(lookup, 0)], -1)
+        self.expression_positions = np.flatnonzero(lookup >= 0)
+        self.metadata_positions = self.expression_to_metadata[self.expression_positions]
+        self.samples = expr_keys[self.expression_positions]
+        self.n_expression = len(expr_keys)
+        self.n_metadata = len(meta_keys)
+
+    def extend(self, expression_samples, canonical=False):
+        """Add expression rows appended after the existing ones (only the new IDs are looked up)"""
+        new_keys = (np.asarray(expression_samples, dtype=object) if canonical
+                    else normalize_sample_ids(expression_samples))
+        lookup = self._metadata_keys.get_indexer(new_keys)
+        new_rows = np.where(lookup >= 0, self._first_rows[np.maximum(lookup, 0)], -1)
+        matched = np.flatnonzero(lookup >= 0)
+
+        self.expression_to_metadata = np.concatenate([self.expression_to_metadata, new_rows])
+        self.expression_positions = np.concatenate([self.expression_positions, matched + self.n_expression])
+        self.metadata_positions = np.concatenate([self.metadata_positions, new_rows[matched]])
+        self.samples = np.concatenate([self.samples, new_keys[matched]])
+        self.n_expression += len(new_keys)
+        return self
+
+    def __len__(self):
+        return len(self.expression_positions)
+
+    @property
+    def n_matched(self):
+        return len(self.expression_positions)
+
+    @property
+    def covers_expression(self):
+        """True when every expression row has metadata (expression rows need no re-indexing)"""
+        return self.n_matched == self.n_expression
+
+    def __repr__(self):
+        return (f"SampleAlignment({self.n_matched} matched of {self.n_expression} expression / "
+                f"{self.n_metadata} metadata samples)")
+
+    # ----------------------------
+    # Aligned access
+    # ----------------------------
+
+    def metadata_column(self, metadata_df, column, how='inner'):
+        """
+        Values of one metadata column in expression-row order.
+        how='inner': matched samples only; how='left': every expression row (NaN if unmatched).
+        """
+        values = metadata_df[column].to_numpy()
+        if how == 'inner' or self.covers_expression:
+            # Plain integer take keeps the column dtype
+            return values[self.metadata_positions]
+        aligned = pd.Series(values).reindex(self.expression_to_metadata)
+        return aligned.to_numpy()
+
+    def aligned_metadata(self, metadata_df, columns=None, how='inner'):
+        """Metadata columns in expression-row order (a small frame, never the expression matrix)"""
+        columns = list(columns) if columns is not None else list(metadata_df.columns)
+        positions = self.metadata_positions if how == 'inner' else self.expression_to_metadata
+        subset = metadata_df[columns].reset_index(drop=True)
+        if how == 'inner':
+            return subset.take(positions).reset_index(drop=True)
+        return subset.reindex(positions).reset_index(drop=True)
+
+    def expression_rows(self, values):
+        """Rows of an expression matrix for the matched samples (a zero-copy view when all match)"""
+        if self.covers_expression:
+            return values
+        return values[self.expression_positions]
+
+
+def align_samples(metadata_df, expression_samples, alignment=None):
+    """
+    Alignment between a metadata table and the given expression rows. A precomputed alignment
+    (DataManager.alignment) is reused when it matches, so the join costs nothing per request.
+    """
+    if alignment is not None and alignment.n_expression == len(expression_samples) \
+            and alignment.n_metadata == len(metadata_df):
+        return alignment
+    return SampleAlignment(metadata_df['Sample'], expression_samples)
@@ -0,0 +1,96 @@
+'''Importer for GEO series-matrix files (GSEnnn_series_matrix.txt.gz): sample header block + expression table'''
+
+import csv
+import numpy as np
+import pandas as pd
+from src.utils.Ingest import open_input, read_header_sample, _dedupe_column_names
+
+TABLE_BEGIN = '!series_matrix_table_begin'
+TABLE_END = '!series_matrix_table_end'
+
+
+class SeriesMatrixHeader:
+    """
+    Everything above the expression table: `series` (key -> list of values), `sample_fields`
+    ((key, values per sample) in file order, repeated keys such as characteristics_ch1 kept
+    row by row), the table's `column_names` and `skip_rows`, the number of lines before them.
+    """
+
+    def __init__(self, series, sample_fields, column_names, skip_rows):
+        self.series = series
+        self.sample_fields = sample_fields
+        self.column_names = column_names
+        self.skip_rows = skip_rows
+
+    @property
+    def sample_ids(self):
+        return [str(name).strip() for name in self.column_names[1:]]
+
+    def metadata_frame(self):
+        """One row per sample; keys lose their '!Sample_' prefix, as in the SOFT parser"""
+        samples = self.sample_ids
+        n = len(samples)
+        data = {'Sample': samples}
+        # Repeated characteristics rows are all kept (characteristics_ch1.1 ...); other repeated
+        # rows keep the first one, as in the SOFT parser
+        fields, seen = [], set()
+        for key, values in self.sample_fields:
+            if key in seen and not key.startswith('characteristics_ch'):
+                continue
+            seen.add(key)
+            fields.append((key, values))
+        names = _dedupe_column_names([key for key, _ in fields])
+        for name, (_, values) in zip(names, fields):
+            values = [value if value != '' else None for value in values[:n]]
+            data[name] = values + [None] * (n - len(values))
+        return pd.DataFrame(data)
+
+
+def is_series_matrix(file_path):
+    """True for a series-matrix file (plain or compressed); it opens with '!Series_' lines"""
+    try:
+        return read_header_sample(file_path, 1024).lstrip('\ufeff').startswith('!Series_')
+    except (OSError, EOFError, ValueError):
+        return False
+
+
+def read_series_matrix_header(file_path):
+    """
+    Read the header block line by line up to the table's column row. Only this block is
+    held in memory (one entry per sample and field), never the expression table.
+    """
+    series, sample_fields = {}, []
+    with open_input(file_path) as f:
+        for n_lines, raw in enumerate(iter(f.readline, b'')):
+            line = raw.decode('utf-8', errors='replace').lstrip('\ufeff').rstrip('\r\n')
+            if line.lower().startswith(TABLE_BEGIN):
+                header = f.readline().decode('utf-8', errors='replace').rstrip('\r\n')
+                column_names = _dedupe_column_names(next(csv.reader([header], delimiter='\t'), []))
+                if len(column_names) < 2:
+                    raise ValueError(f"'{file_path}' has no sample columns in its expression table")
+                return SeriesMatrixHeader(series, sample_fields, column_names, n_lines + 1)
+            if not line.startswith('!'):
+                continue
+            # Values are tab-separated and quoted: csv strips the quotes
+            fields = next(csv.reader([line], delimiter='\t'))
+            key = fields[0].lstrip('!')
+            if key.startswith('Sample_'):
+                sample_fields.append((key[len('Sample_'):], fields[1:]))
+            elif key.startswith('Series_'):
+                series.setdefault(key[len('Series_'):], []).extend(fields[1:2])
+    raise ValueError(f"'{file_path}' has no '{TABLE_BEGIN}' line; is it a series-matrix file?")
+
+
+def parse_series_matrix(file_path, directory, missing_method='fill_zero', dtype=np.float32):
+    """
+    Returns (metadata DataFrame, ExpressionStore at `directory`). The header block becomes the
+    metadata table; the ID_REF table is streamed into the store in a single pass, so memory
+    does not grow with the size of the (compressed) file.
+    """
+    from src.data_handling.Streaming_transpose import transpose_to_store
+
+    header = read_series_matrix_header(file_path)
+    store = transpose_to_store(file_path, directory, delimiter='\t', missing_method=missing_method,
+                               dtype=dtype, column_names=header.column_names,
+                               skip_rows=header.skip_rows)
+    return header.metadata_frame(), store
@@ -0,0 +1,317 @@
+'''Streaming parser for GEO SOFT family files: GSM tables go straight into a float32 expression matrix'''
+
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from src.utils.Ingest import open_input
+from src.data_handling.Expression_store import (ExpressionStore, write_gene_major, write_store_index,
+                                                replace_store_dir, SAMPLE_MAJOR_FILE, GENE_MAJOR_FILE)
+
+# Bytes read from the (decompressed) file per step
+_READ_CHUNK = 4 * 1024 * 1024
+
+# Strings GEO uses for missing VALUEs
+SOFT_NULL_VALUES = ['', 'null', 'NULL', 'NA', 'N/A', 'NaN', 'nan', '-', '--']
+
+
+class _SoftReader:
+    """Line reader over a binary stream that can also return a whole data table in one read"""
+
+    def __init__(self, stream, chunk_size=_READ_CHUNK):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.pos = 0
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def readline(self):
+        """Next line without its line ending (None at end of file)"""
+        while True:
+            end = self.buffer.find(b'\n', self.pos)
+            if end >= 0:
+                line = self.buffer[self.pos:end]
+                self.pos = end + 1
+                return line.rstrip(b'\r')
+            if not self._fill():
+                if self.pos >= len(self.buffer):
+                    return None
+                line = self.buffer[self.pos:]
+                self.pos = len(self.buffer)
+                return line.rstrip(b'\r')
+
+    def read_table(self, end_marker):
+        """Bytes up to the `end_marker` line (which is consumed)"""
+        marker = b'\n' + end_marker
+        scan_from = self.pos
+        while True:
+            # The table may be empty, so the marker can also start right at the current position
+            if self.buffer.startswith(end_marker, self.pos):
+                self.readline()
+                return b''
+            end = self.buffer.find(marker, max(scan_from, self.pos))
+            if end >= 0:
+                table = self.buffer[self.pos:end + 1]
+                self.pos = end + 1
+                self.readline()
+                return table
+            scan_from = max(len(self.buffer) - len(marker), self.pos)
+            offset = self.pos
+            if not self._fill():
+                raise ValueError(f"SOFT file ends inside a data table (no {end_marker.decode()})")
+            scan_from -= offset
+
+
+def _split_entry(line):
+    """'!Sample_title = GBM 12' -> ('title', 'GBM 12') (the '!Sample_' prefix is dropped)"""
+    text = line.decode('utf-8', errors='replace')
+    key, _, value = text.partition(' = ')
+    key = key.strip().lstrip('!')
+    if '_' in key:
+        key = key.split('_', 1)[1]
+    return key, value.strip()
+
+
+def _first_column(table):
+    """First column of a tab-separated table (header skipped), as strings"""
+    lines = table.split(b'\n')[1:]
+    return [line.split(b'\t', 1)[0].rstrip(b'\r').decode('utf-8', errors='replace')
+            for line in lines if line.strip()]
+
+
+def _parse_sample_table(table, value_column):
+    """(probe IDs, float64 values) of one GSM data table"""
+    if not table.strip():
+        return np.asarray([], dtype=object), np.asarray([], dtype=np.float64)
+    header = table[:table.find(b'\n')].rstrip(b'\r').decode('utf-8', errors='replace').split('\t')
+    if value_column not in header:
+        raise ValueError(f"GSM table has no '{value_column}' column (columns: {', '.join(header)})")
+    id_col = header[0]
+    read_options = pacsv.ReadOptions(use_threads=False, block_size=max(len(table), 1 << 20))
+    parse_options = pacsv.ParseOptions(delimiter='\t', quote_char=False,
+                                       invalid_row_handler=lambda row: 'skip')
+
+    def read(value_type):
+        convert_options = pacsv.ConvertOptions(include_columns=[id_col, value_column],
+                                               column_types={id_col: pa.string(), value_column: value_type},
+                                               strings_can_be_null=True, null_values=SOFT_NULL_VALUES)
+        return pacsv.read_csv(pa.py_buffer(table), read_options=read_options,
+                              parse_options=parse_options, convert_options=convert_options)
+
+    try:
+        parsed = read(pa.float64())
+        values = parsed.column(value_column).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        # Non-numeric entries (e.g. 'ND'): parse as text and treat them as missing
+        parsed = read(pa.string())
+        values = pd.to_numeric(pd.Series(parsed.column(value_column).to_numpy(zero_copy_only=False)),
+                               errors='coerce').to_numpy(dtype=np.float64)
+    return parsed.column(id_col).to_numpy(zero_copy_only=False), values
+
+
+class SoftFamilyParser:
+    """
+    Reads a GSE family SOFT file (plain or compressed) in one sequential pass.
+
+    The series block lists the GSMs and the platform tables (which come before the samples)
+    fix the probe order, so the (samples x probes) float32 matrix is allocated up front and
+    each GSM's VALUE column is written straight into its row; no per-GSM DataFrame or pivot
+    is built. GSM header fields are collected column-wise. With `directory`, the matrix is a
+    memory-mapped values.bin and the result is a saved ExpressionStore.
+    """
+
+    def __init__(self, path, value_column='VALUE', dtype=np.float32):
+        self.path = path
+        self.value_column = value_column
+        self.dtype = np.dtype(dtype)
+        self.series = {}
+        self.platform_probes = {}
+        self.sample_ids = []
+        self.sample_platforms = []
+        self.columns = {}
+        self.n_unknown_probes = 0
+
+    # ----------------------------
+    # Metadata columns
+    # ----------------------------
+
+    def _add_field(self, row, key, value, seen):
+        # Repeated characteristics become characteristics_ch1.1, .2 ... (as in a series matrix);
+        # other repeated fields keep their first value
+        if key in seen:
+            if not key.startswith('characteristics_ch'):
+                return
+            seen[key] += 1
+            key = f"{key}.{seen[key]}"
+        else:
+            seen[key] = 0
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = [None] * row
+        column.extend([None] * (row - len(column)))
+        column.append(value)
+
+    def metadata_frame(self):
+        n = len(self.sample_ids)
+        data = {'Sample': self.sample_ids}
+        for key, column in self.columns.items():
+            data[key] = column + [None] * (n - len(column))
+        return pd.DataFrame(data)
+
+    # ----------------------------
+    # Parsing
+    # ----------------------------
+
+    def parse(self, directory=None):
+        """Returns (metadata DataFrame, ExpressionStore)"""
+        start_time = time.perf_counter()
+        tmp_dir = None
+        if directory is not None:
+            tmp_dir = directory.rstrip(os.sep) + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+        try:
+            with open_input(self.path) as stream:
+                values, row_of, probes = self._read(_SoftReader(stream), tmp_dir)
+            store = self._finish(values, row_of, probes, tmp_dir, directory)
+        except Exception:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        if self.n_unknown_probes:
+            print(f"[!] Ignored {self.n_unknown_probes} values of probes missing from the platform table")
+        print(f"[✓] Parsed {os.path.basename(self.path)}: {store.n_samples} samples x {store.n_probes} "
+              f"probes in {time.perf_counter() - start_time:.2f}s")
+        return self.metadata_frame(), store
+
+    def _allocate(self, probes, n_rows, tmp_dir):
+        shape = (n_rows, len(probes))
+        if tmp_dir is not None and shape[0] * shape[1]:
+            values = np.memmap(os.path.join(tmp_dir, SAMPLE_MAJOR_FILE), dtype=self.dtype, mode='w+', shape=shape)
+        else:
+            values = np.empty(shape, dtype=self.dtype)
+        values[:] = np.nan
+        return values
+
+    def _probe_universe(self):
+        """Probe IDs of every platform in file order (a probe shared by platforms appears once)"""
+        ids = [probe for probes in self.platform_probes.values() for probe in probes]
+        return pd.Index(ids).unique()
+
+    def _read(self, reader, tmp_dir):
+        section, entity = None, None
+        values, probe_index = None, None
+        row_of = {}
+        extra_rows = []
+        last_ids, last_positions = None, None
+        row, seen = -1, {}
+
+        while True:
+            line = reader.readline()
+            if line is None:
+                break
+            if not line:
+                continue
+            head = line[:1]
+            if head == b'^':
+                section, _, entity = line[1:].decode('utf-8', errors='replace').partition(' = ')
+                section, entity = section.strip().upper(), entity.strip()
+                if section == 'SAMPLE':
+                    if values is None:
+                        # First GSM: every platform table has been read, so the matrix can be allocated
+                        probe_index = self._probe_universe()
+                        series_ids = self.series.get('sample_id', [])
+                        values = self._allocate(probe_index, len(series_ids), tmp_dir)
+                        row_of = {gsm: i for i, gsm in enumerate(series_ids)}
+                    row, seen = len(self.sample_ids), {}
+                    self.sample_ids.append(entity)
+                    self.sample_platforms.append(None)
+                continue
+            if head == b'!':
+                lowered = line.lower()
+                if lowered.startswith(b'!platform_table_begin'):
+                    self.platform_probes[entity] = _first_column(reader.read_table(b'!platform_table_end'))
+                elif lowered.startswith(b'!sample_table_begin'):
+                    ids, sample_values = _parse_sample_table(reader.read_table(b'!sample_table_end'),
+                                                             self.value_column)
+                    if len(probe_index) == 0 and len(ids):
+                        # No platform table in the file: the first GSM fixes the probe order
+                        probe_index = pd.Index(ids).unique()
+                        values = self._allocate(probe_index, len(values), tmp_dir)
+                    if last_ids is not None and len(ids) == len(last_ids) and np.array_equal(ids, last_ids):
+                        # GSMs of one platform usually list the probes in the same order
+                        positions = last_positions
+                    else:
+                        positions = probe_index.get_indexer(ids) if len(probe_index) else \
+                            np.full(len(ids), -1)
+                        last_ids, last_positions = ids, positions
+                    known = positions >= 0
+                    self.n_unknown_probes += int((~known).sum())
+                    target = row_of.get(self.sample_ids[-1])
+                    if target is None:
+                        # GSM not listed in the series block: kept aside and added at the end
+                        extra = np.full(len(probe_index), np.nan, dtype=self.dtype)
+                        extra[positions[known]] = sample_values[known]
+                        extra_rows.append((self.sample_ids[-1], extra))
+                    else:
+                        values[target, positions[known]] = sample_values[known]
+                elif section == 'SERIES':
+                    key, value = _split_entry(line)
+                    self.series.setdefault(key, []).append(value)
+                elif section == 'SAMPLE':
+                    key, value = _split_entry(line)
+                    self._add_field(row, key, value, seen)
+                    if key == 'platform_id':
+                        self.sample_platforms[row] = value
+        if values is None:
+            probe_index = self._probe_universe()
+            values = self._allocate(probe_index, 0, None)
+        return values, (row_of, extra_rows), probe_index
+
+    def _finish(self, values, rows, probes, tmp_dir, directory):
+        row_of, extra_rows = rows
+        # Rows in GSM order of appearance; series entries without a GSM block are dropped
+        order = np.asarray([row_of.get(gsm, -1) for gsm in self.sample_ids], dtype=np.int64)
+        in_place = len(extra_rows) == 0 and np.array_equal(order, np.arange(len(values)))
+        if not in_place:
+            extra = iter(row for _, row in extra_rows)
+            matrix = np.empty((len(order), len(probes)), dtype=self.dtype)
+            for i, source in enumerate(order):
+                matrix[i] = values[source] if source >= 0 else next(extra)
+            values = matrix
+        samples = np.asarray(self.sample_ids, dtype=object)
+        probes = np.asarray(probes, dtype=object)
+
+        if tmp_dir is None:
+            return ExpressionStore(np.asarray(values), samples, probes)
+
+        if not in_place:
+            np.ascontiguousarray(values).tofile(os.path.join(tmp_dir, SAMPLE_MAJOR_FILE))
+        elif isinstance(values, np.memmap):
+            values.flush()
+        else:
+            open(os.path.join(tmp_dir, SAMPLE_MAJOR_FILE), 'wb').close()
+        write_gene_major(values, os.path.join(tmp_dir, GENE_MAJOR_FILE))
+        del values
+        write_store_index(tmp_dir, samples, probes, self.dtype)
+        replace_store_dir(tmp_dir, directory)
+        return ExpressionStore.open(directory)
+
+
+def parse_family_soft(path, directory=None, value_column='VALUE', dtype=np.float32):
+    """
+    Parse a GSE family SOFT file (e.g. uploads/GSE4290_family.soft.gz) into
+    (metadata DataFrame with a 'Sample' column, ExpressionStore). With `directory` the store
+    is written there and memory-mapped; otherwise it is held in memory.
+    """
+    return SoftFamilyParser(path, value_column=value_column, dtype=dtype).parse(directory)
@@ -0,0 +1,158 @@
+'''Streaming transpose of genes-as-rows expression files straight into a sample-major ExpressionStore'''
+
+import os
+import shutil
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from src.utils.Ingest import read_header_sample, sniff_delimiter, read_column_names, csv_source, BLOCK_SIZE
+from src.data_handling.Expression_store import (ExpressionStore, write_store_index, replace_store_dir,
+                                                write_gene_major, SAMPLE_MAJOR_FILE, GENE_MAJOR_FILE, MISSING_FILE)
+from src.data_handling.Missing_data import fill_block, check_missing_method, bitmap_from_positions, knn_impute
+from src.data_handling.Series_matrix import TABLE_END
+
+# Genes copied from the gene-major scratch file into the sample-major matrix per step
+_TILE_GENES = 4096
+
+
+def _skip_table_end(row):
+    """invalid_row_handler: only the series-matrix table end marker may be skipped"""
+    return 'skip' if row.text.strip().strip('"').lower() == TABLE_END else 'error'
+
+
+def _gene_blocks(file_path, delimiter, column_names, sample_columns, dtype, skip_rows=0):
+    """
+    Yield (probe_ids, values) per parsed block; values is (genes_in_block x samples).
+    With `skip_rows` (lines above the header, e.g. a series-matrix header block), the
+    '!series_matrix_table_end' marker row is skipped; any other row with the wrong number of
+    fields raises ArrowInvalid, so a malformed probe row is never dropped silently.
+    """
+    probe_col = column_names[0]
+    read_options = pacsv.ReadOptions(use_threads=True, block_size=BLOCK_SIZE,
+                                     column_names=column_names, skip_rows=skip_rows + 1)
+    if skip_rows:
+        parse_options = pacsv.ParseOptions(delimiter=delimiter, invalid_row_handler=_skip_table_end)
+    else:
+        parse_options = pacsv.ParseOptions(delimiter=delimiter)
+    value_type = pa.float32() if np.dtype(dtype) == np.float32 else pa.float64()
+    column_types = {col: value_type for col in sample_columns}
+    column_types[probe_col] = pa.string()
+    # Annotation columns (e.g. a trailing gene symbol column) are never parsed
+    convert_options = pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True,
+                                           include_columns=[probe_col] + list(sample_columns))
+
+    with csv_source(file_path) as source:
+        reader = pacsv.open_csv(source, read_options=read_options,
+                                parse_options=parse_options, convert_options=convert_options)
+        for batch in reader:
+            values = np.empty((batch.num_rows, len(sample_columns)), dtype=dtype)
+            for j in range(len(sample_columns)):
+                values[:, j] = batch.column(j + 1).to_numpy(zero_copy_only=False)
+            probes = batch.column(0).to_numpy(zero_copy_only=False)
+            yield probes, values
+
+
+def transpose_to_store(file_path, directory, delimiter=None, sample_columns=None,
+                       missing_method='fill_zero', dtype=np.float32, mmap_mode='r',
+                       column_names=None, skip_rows=0):
+    """
+    Stream a genes-as-rows file (probe IDs in the first column, one column per sample) into a
+    sample-major ExpressionStore at `directory` and return it memory-mapped.
+
+    Gene rows are parsed block by block and appended to a gene-major scratch file, which is
+    then copied into the sample-major matrix tile by tile and kept as the store's gene-major
+    copy. Neither the full table nor an object-dtype transpose is ever held in memory.
+
+    `sample_columns` limits the value columns (default: every column after the first).
+    Missing values are imputed block by block (Missing_data.fill_block) and their positions
+    are kept as the store's missing-value bitmap.
+
+    Files whose table does not start on the first line (series matrices) pass the table's
+    `column_names`, `delimiter` and the number of lines above it as `skip_rows`.
+    """
+    check_missing_method(missing_method)
+    if column_names is None:
+        sample_text = read_header_sample(file_path)
+        if delimiter is None:
+            delimiter = sniff_delimiter(sample_text, file_path)
+        column_names = read_column_names(sample_text, delimiter, file_path)
+    sample_columns = list(sample_columns) if sample_columns else column_names[1:]
+    samples = np.asarray([str(name).strip() for name in sample_columns], dtype=object)
+    if len(samples) == 0:
+        raise ValueError(f"'{file_path}' has no sample columns")
+
+    tmp_dir = directory.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    scratch_path = os.path.join(tmp_dir, GENE_MAJOR_FILE)
+
+    try:
+        # Pass 1: gene rows -> gene-major scratch file
+        probe_parts = []
+        samples_with_nan = np.zeros(len(samples), dtype=bool)
+        # (gene, sample) positions of missing values; usually a tiny fraction of the matrix
+        nan_genes, nan_samples = [], []
+        n_parsed = 0
+        with open(scratch_path, 'wb') as scratch:
+            blocks = _gene_blocks(file_path, delimiter, column_names, sample_columns, dtype, skip_rows)
+            for probes, block in blocks:
+                nan_mask = np.isnan(block)
+                if nan_mask.any():
+                    if missing_method == 'drop':
+                        samples_with_nan |= nan_mask.any(axis=0)
+                    else:
+                        genes, cols = np.nonzero(nan_mask)
+                        nan_genes.append(genes + n_parsed)
+                        nan_samples.append(cols)
+                        fill_block(block, nan_mask, missing_method, sample_axis=1)
+                block.tofile(scratch)
+                probe_parts.append(probes)
+                n_parsed += len(probes)
+        probes = np.concatenate(probe_parts).astype(str).astype(object) if probe_parts else \
+            np.asarray([], dtype=object)
+        n_genes = len(probes)
+
+        # 'drop' removes samples (rows of the final table) that have any missing value
+        keep = np.flatnonzero(~samples_with_nan)
+        kept_samples = samples[keep]
+
+        # 'drop' keeps only complete samples, so only filled values end up in the bitmap
+        bitmap = None
+        if nan_genes:
+            bitmap = bitmap_from_positions(len(samples), n_genes, np.concatenate(nan_samples),
+                                           np.concatenate(nan_genes))
+
+        # Pass 2: gene-major scratch -> sample-major values.bin, one tile of genes at a time
+        values_path = os.path.join(tmp_dir, SAMPLE_MAJOR_FILE)
+        if n_genes and len(kept_samples):
+            gene_major = np.memmap(scratch_path, dtype=dtype, mode='r', shape=(n_genes, len(samples)))
+            values = np.memmap(values_path, dtype=dtype, mode='w+', shape=(len(kept_samples), n_genes))
+            for start in range(0, n_genes, _TILE_GENES):
+                stop = min(start + _TILE_GENES, n_genes)
+                tile = np.asarray(gene_major[start:stop])
+                values[:, start:stop] = (tile if len(keep) == len(samples) else tile[:, keep]).T
+            del gene_major
+            if missing_method == 'knn' and bitmap is not None:
+                # Pass 1 filled gene means; neighbours need every sample's full profile
+                knn_impute(values, bitmap)
+            values.flush()
+            if len(keep) != len(samples) or missing_method == 'knn':
+                # Dropped samples or KNN estimates: rebuild the gene-major copy from values.bin
+                write_gene_major(values, scratch_path)
+            del values
+        else:
+            open(values_path, 'wb').close()
+
+        if bitmap is not None:
+            bitmap.tofile(os.path.join(tmp_dir, MISSING_FILE))
+        write_store_index(tmp_dir, kept_samples, probes, dtype, missing_mask=bitmap is not None)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    replace_store_dir(tmp_dir, directory)
+    dropped = len(samples) - len(kept_samples)
+    if dropped:
+        print(f"[!] Dropped {dropped} samples with missing values")
+    return ExpressionStore.open(directory, mmap_mode=mmap_mode)
@@ -0,0 +1,166 @@
+'''Columnar binary workspace cache for cleaned datasets (Arrow IPC / Feather v2)'''
+
+import os
+import json
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from src.data_handling.Expression_store import ExpressionStore, read_store_manifest
+
+# Default location of the on-disk workspace (same folder the CSVs used to live in)
+WORKSPACE_DIR = 'cleaned_data'
+WORKSPACE_EXT = '.arrow'
+STORE_EXT = '.store'
+
+# Schema/version header stored in the Arrow schema metadata of every workspace file
+WORKSPACE_FORMAT = 'gliomascope-workspace'
+WORKSPACE_VERSION = 1
+_HEADER_KEY = b'gliomascope'
+
+
+def workspace_path(name, workspace_dir=WORKSPACE_DIR):
+    """Return the on-disk path of a named workspace file"""
+    if name.endswith(WORKSPACE_EXT):
+        return os.path.join(workspace_dir, name)
+    return os.path.join(workspace_dir, f"{name}{WORKSPACE_EXT}")
+
+
+def workspace_exists(name, workspace_dir=WORKSPACE_DIR):
+    return os.path.exists(workspace_path(name, workspace_dir))
+
+
+def _make_arrow_safe(df):
+    """
+    Arrow needs one type per column. Object columns that mix strings with numbers
+    (e.g. after fill_zero on metadata) are converted to strings, keeping NaN as null.
+    """
+    fixed = None
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(df[col], skipna=True)
+        if kind in ('string', 'empty', 'bytes', 'boolean'):
+            continue
+        if fixed is None:
+            fixed = df.copy()
+        fixed[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df if fixed is None else fixed
+
+
+def save_workspace(df, name, kind=None, workspace_dir=WORKSPACE_DIR):
+    """
+    Save a DataFrame as a typed, columnar workspace file.
+
+    The file is written to a temporary path first and renamed into place so that
+    a crash mid-write never leaves a truncated workspace behind.
+    """
+    os.makedirs(workspace_dir, exist_ok=True)
+    path = workspace_path(name, workspace_dir)
+
+    # Column names must be strings in Arrow
+    if not all(isinstance(col, str) for col in df.columns):
+        df = df.rename(columns=str)
+
+    table = pa.Table.from_pandas(_make_arrow_safe(df), preserve_index=False)
+
+    header = {
+        'format': WORKSPACE_FORMAT,
+        'version': WORKSPACE_VERSION,
+        'kind': kind,
+        'rows': int(df.shape[0]),
+        'columns': int(df.shape[1]),
+    }
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[_HEADER_KEY] = json.dumps(header).encode('utf-8')
+    table = table.replace_schema_metadata(schema_metadata)
+
+    tmp_path = path + '.tmp'
+    feather.write_feather(table, tmp_path, compression='lz4')
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_workspace_header(path):
+    """Read only the schema/version header of a workspace file (no data is loaded)"""
+    schema = pa.ipc.open_file(pa.memory_map(path, 'r')).schema
+    raw = (schema.metadata or {}).get(_HEADER_KEY)
+    if raw is None:
+        return None
+    return json.loads(raw.decode('utf-8'))
+
+
+def load_workspace_file(path):
+    """Load a workspace file from an explicit path, validating its header"""
+    header = read_workspace_header(path)
+    if header is None or header.get('format') != WORKSPACE_FORMAT:
+        raise ValueError(f"'{path}' is not a GliomaScope workspace file")
+    if header.get('version', 0) > WORKSPACE_VERSION:
+        raise ValueError(
+            f"Workspace '{path}' was written by a newer version "
+            f"(v{header['version']}, this build reads up to v{WORKSPACE_VERSION})"
+        )
+
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas()
+
+
+def load_workspace(name, workspace_dir=WORKSPACE_DIR):
+    """Load a named workspace, returning None if it does not exist"""
+    path = workspace_path(name, workspace_dir)
+    if not os.path.exists(path):
+        return None
+    return load_workspace_file(path)
+
+
+def remove_workspace(name, workspace_dir=WORKSPACE_DIR):
+    path = workspace_path(name, workspace_dir)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
+
+
+# ----------------------------
+# Expression stores (memory-mapped float32 matrices)
+# ----------------------------
+
+def store_path(name, workspace_dir=WORKSPACE_DIR):
+    """Return the on-disk directory of a named expression store"""
+    if name.endswith(STORE_EXT):
+        return os.path.join(workspace_dir, name)
+    return os.path.join(workspace_dir, f"{name}{STORE_EXT}")
+
+
+def store_exists(name, workspace_dir=WORKSPACE_DIR):
+    return read_store_manifest(store_path(name, workspace_dir)) is not None
+
+
+def save_expression_store(expression, name, workspace_dir=WORKSPACE_DIR):
+    """Save an ExpressionStore (or a samples-as-rows DataFrame) as a named store"""
+    if not isinstance(expression, ExpressionStore):
+        expression = ExpressionStore.from_dataframe(expression)
+    os.makedirs(workspace_dir, exist_ok=True)
+    return expression.save(store_path(name, workspace_dir))
+
+
+def load_expression_store(name, workspace_dir=WORKSPACE_DIR, mmap_mode='r'):
+    """Memory-map a named expression store, returning None if it does not exist"""
+    if not store_exists(name, workspace_dir):
+        return None
+    return ExpressionStore.open(store_path(name, workspace_dir), mmap_mode=mmap_mode)
+
+
+def remove_expression_store(name, workspace_dir=WORKSPACE_DIR):
+    path = store_path(name, workspace_dir)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+        return True
+    return False
+
+
+def export_csv(df, csv_path):
+    """CSV is only an export format: write it on demand for downloads"""
+    os.makedirs(os.path.dirname(csv_path) or '.', exist_ok=True)
+    df.to_csv(csv_path, index=False)
+    return csv_path
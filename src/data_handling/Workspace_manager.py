@@ -0,0 +1,264 @@
+'''Several named datasets held under a memory budget; least recently used ones spill to disk'''
+
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.data_handling.Data_loader import DataManager
+from src.data_handling.Workspace_cache import (WORKSPACE_DIR, save_workspace, load_workspace,
+                                               save_expression_store, load_expression_store)
+
+WORKSPACES_DIR = os.path.join(WORKSPACE_DIR, 'workspaces')
+WORKSPACE_INDEX = 'dataset.json'
+
+# Resident datasets are spilled (least recently used first) once they use more than this
+DEFAULT_MEMORY_BUDGET = 1024 ** 3
+DEFAULT_MAX_RESIDENT = 4
+
+# Name of the dataset the app starts with (uploads go into whichever dataset is active)
+DEFAULT_DATASET = 'default'
+
+# Dataset names become directory names (GEO accessions, 'default', ...)
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+
+def _heap_nbytes(array):
+    """Bytes an array holds in process memory (memory-mapped arrays live in the page cache)"""
+    if array is None or isinstance(array, np.memmap):
+        return 0
+    if isinstance(array.base, np.memmap):
+        return 0
+    return array.nbytes
+
+
+def dataset_nbytes(manager):
+    """Approximate resident memory of one DataManager (metadata + in-memory expression)"""
+    total = 0
+    if manager.metadata is not None:
+        total += int(manager.metadata.memory_usage(deep=True).sum())
+    store = manager.expression_store
+    if store is not None:
+        # The expression DataFrame is a view over store.values, so it is not counted twice
+        total += _heap_nbytes(store.values) + _heap_nbytes(store.gene_values) + _heap_nbytes(store.missing)
+    elif manager.expression is not None:
+        total += int(manager.expression.memory_usage(deep=True).sum())
+    return total
+
+
+class WorkspaceManager:
+    """
+    Named datasets (one DataManager each), e.g. 'GSE16011' and 'GSE4290'.
+
+    Datasets stay in memory while they fit the memory budget. Beyond it, the least recently
+    used ones are written to `<workspace_dir>/<name>/` (metadata workspace + expression store)
+    and dropped; asking for them again memory-maps them back without re-parsing anything.
+    The active dataset is never spilled.
+    """
+
+    def __init__(self, workspace_dir=WORKSPACES_DIR, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 max_resident=DEFAULT_MAX_RESIDENT):
+        self.workspace_dir = workspace_dir
+        self.memory_budget = memory_budget
+        self.max_resident = max_resident
+        # name -> DataManager, least recently used first
+        self._resident = OrderedDict()
+        self.active_name = None
+        # persist() may run on the background writer while a request spills the same dataset
+        self._persist_lock = threading.RLock()
+
+    # ----------------------------
+    # Paths / on-disk index
+    # ----------------------------
+
+    def dataset_dir(self, name):
+        if not _NAME_PATTERN.match(str(name)):
+            raise ValueError(f"Invalid dataset name '{name}'")
+        return os.path.join(self.workspace_dir, name)
+
+    def _index_path(self, name):
+        return os.path.join(self.dataset_dir(name), WORKSPACE_INDEX)
+
+    def _read_index(self, name):
+        try:
+            with open(self._index_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def spilled_names(self):
+        """Datasets saved on disk (whether or not they are also resident)"""
+        if not os.path.isdir(self.workspace_dir):
+            return []
+        return sorted(name for name in os.listdir(self.workspace_dir)
+                      if _NAME_PATTERN.match(name) and os.path.exists(self._index_path(name)))
+
+    def names(self):
+        return sorted(set(self._resident) | set(self.spilled_names()))
+
+    def __contains__(self, name):
+        if name in self._resident:
+            return True
+        return bool(_NAME_PATTERN.match(str(name))) and os.path.exists(self._index_path(name))
+
+    # ----------------------------
+    # Access
+    # ----------------------------
+
+    def add(self, name, manager, activate=True):
+        """Register a loaded DataManager under `name` (replacing any dataset of that name)"""
+        self._resident[name] = manager
+        self._resident.move_to_end(name)
+        if activate:
+            self.active_name = name
+        self.enforce_budget()
+        return manager
+
+    def get(self, name):
+        """DataManager for a dataset, reloading it from disk if it was spilled"""
+        if name in self._resident:
+            self._resident.move_to_end(name)
+            return self._resident[name]
+        manager = self._reload(name)
+        if manager is None:
+            raise KeyError(f"No dataset named '{name}'")
+        self._resident[name] = manager
+        self.enforce_budget(keep=name)
+        return manager
+
+    def activate(self, name):
+        manager = self.get(name)
+        self.active_name = name
+        return manager
+
+    @property
+    def active(self):
+        return self._resident.get(self.active_name)
+
+    # ----------------------------
+    # Spill / reload
+    # ----------------------------
+
+    def persist(self, name):
+        """Write a resident dataset to its workspace directory and memory-map the expression back"""
+        manager = self._resident.get(name)
+        if manager is None:
+            # Already spilled (its files are on disk)
+            return self.dataset_dir(name)
+        with self._persist_lock:
+            return self._persist(name, manager)
+
+    def _persist(self, name, manager):
+        directory = self.dataset_dir(name)
+        os.makedirs(directory, exist_ok=True)
+
+        if manager.metadata is not None:
+            save_workspace(manager.metadata, 'metadata', kind='metadata', workspace_dir=directory)
+        store = manager.expression_store
+        if store is not None:
+            # A store already mapped from this directory is not rewritten, and one mapped from
+            # another saved store is hard-linked (ExpressionStore.save). Written from a snapshot,
+            # so samples appended meanwhile (under the manager's lock) are not half-written
+            save_expression_store(store.snapshot(), 'expression', workspace_dir=directory)
+            manager.adopt_saved_store(store, load_expression_store('expression', workspace_dir=directory))
+
+        index = {
+            'name': name,
+            'metadata': manager.metadata is not None,
+            'expression': manager.expression_store is not None,
+            'metadata_path': manager.metadata_path,
+            'expression_path': manager.expression_path,
+            'samples': int(manager.metadata.shape[0]) if manager.metadata is not None else 0,
+            'genes': int(manager.expression_store.n_probes) if manager.expression_store is not None else 0,
+            'saved': time.time(),
+        }
+        with open(self._index_path(name), 'w') as f:
+            json.dump(index, f, indent=2)
+        return directory
+
+    def spill(self, name):
+        """Persist a dataset and drop it from memory"""
+        if name not in self._resident:
+            return False
+        self.persist(name)
+        self._resident.pop(name)
+        print(f"[✓] Dataset '{name}' spilled to {self.dataset_dir(name)}")
+        return True
+
+    def _reload(self, name):
+        index = self._read_index(name)
+        if index is None:
+            return None
+        directory = self.dataset_dir(name)
+        manager = DataManager()
+        if index.get('metadata'):
+            manager.metadata = load_workspace('metadata', workspace_dir=directory)
+        if index.get('expression'):
+            manager.set_expression_store(load_expression_store('expression', workspace_dir=directory))
+        manager.metadata_path = index.get('metadata_path')
+        manager.expression_path = index.get('expression_path')
+        print(f"[✓] Dataset '{name}' reloaded from {directory}")
+        return manager
+
+    def enforce_budget(self, keep=None):
+        """Spill least recently used datasets until the resident ones fit the budget"""
+        spilled = []
+        protected = {self.active_name, keep}
+        for name in list(self._resident):
+            if self.resident_bytes() <= self.memory_budget and len(self._resident) <= self.max_resident:
+                break
+            if name in protected:
+                continue
+            self.spill(name)
+            spilled.append(name)
+        return spilled
+
+    def resident_bytes(self):
+        return sum(dataset_nbytes(manager) for manager in self._resident.values())
+
+    # ----------------------------
+    # Listing / removal
+    # ----------------------------
+
+    def list(self):
+        """One entry per dataset, most recently used first"""
+        entries = []
+        order = list(reversed(self._resident)) + [n for n in self.spilled_names() if n not in self._resident]
+        for name in order:
+            manager = self._resident.get(name)
+            if manager is not None:
+                entry = {
+                    'name': name,
+                    'resident': True,
+                    'memory_bytes': dataset_nbytes(manager),
+                    'samples': int(manager.metadata.shape[0]) if manager.metadata is not None else 0,
+                    'genes': int(manager.expression_store.n_probes) if manager.expression_store is not None else 0,
+                }
+            else:
+                index = self._read_index(name) or {}
+                entry = {'name': name, 'resident': False, 'memory_bytes': 0,
+                         'samples': index.get('samples', 0), 'genes': index.get('genes', 0)}
+            entry['active'] = name == self.active_name
+            entry['on_disk'] = os.path.exists(self._index_path(name))
+            entries.append(entry)
+        return entries
+
+    def remove(self, name):
+        """Forget a dataset (in memory and on disk); the active dataset cannot be removed"""
+        if name == self.active_name:
+            raise ValueError(f"Dataset '{name}' is active; switch to another dataset first")
+        found = self._resident.pop(name, None) is not None
+        directory = self.dataset_dir(name)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+            found = True
+        return found
+
+    def clear(self):
+        """Drop every dataset, including the on-disk copies"""
+        self._resident.clear()
+        self.active_name = None
+        shutil.rmtree(self.workspace_dir, ignore_errors=True)
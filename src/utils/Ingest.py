@@ -0,0 +1,385 @@
+'''Multithreaded Arrow-based CSV/TSV ingest engine used by Utils.load_data'''
+
+import csv
+import io
+import os
+import lzma
+import time
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# Only this much of the file is read to detect the delimiter and header
+SNIFF_BYTES = 64 * 1024
+# Rows (and at most this many bytes, never fewer than a couple of rows) used to classify a file
+SAMPLE_ROWS = 200
+PREVIEW_BYTES = 1024 * 1024
+# The file is cut into blocks of this size (on line breaks) that are parsed on several threads.
+# Column types are inferred from the first block, so the file is only parsed once. Parsing a
+# block takes a few times its size, and at most INGEST_THREADS blocks are in flight.
+BLOCK_SIZE = 16 * 1024 * 1024
+INGEST_THREADS = max(min(os.cpu_count() or 1, 8), 2)
+# The float32 result is allocated from the first block's bytes per row (compressed files are
+# assumed to expand this much) and grows by GROWTH when the estimate was short
+GROWTH = 1.5
+COMPRESSION_GUESS = 4
+# Cells per chunk when pandas has to parse the file instead (about 32 MB of float64)
+CHUNK_CELLS = 4 * 1024 * 1024
+
+CANDIDATE_DELIMITERS = [',', '\t', ';', '|']
+
+# Compressed inputs are decoded while they are parsed; the decompressed file never touches disk.
+# gzip/bz2/zstd use Arrow's codecs, xz uses the standard library.
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd', '.xz': 'xz'}
+
+# Thresholds used to decide that a file is an expression matrix (same as validate_file_type)
+MIN_GENE_COLUMNS = 30
+MIN_NUMERIC_FRACTION = 0.8
+
+
+def compression_of(file_path):
+    """Codec name for a compressed file ('gzip', 'bz2', 'zstd', 'xz'), or None for plain text"""
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(str(file_path))[1].lower())
+
+
+def data_extension(file_path):
+    """Extension of the text inside the file ('.txt' for 'GSE4290_series_matrix.txt.gz')"""
+    root, ext = os.path.splitext(str(file_path))
+    if ext.lower() in COMPRESSION_EXTENSIONS:
+        ext = os.path.splitext(root)[1]
+    return ext.lower()
+
+
+def _decompressing_stream(file_path, codec):
+    if codec == 'xz':
+        return lzma.open(file_path, 'rb')
+    if not pa.Codec.is_available(codec):
+        raise ValueError(f"This pyarrow build cannot read {codec}-compressed files ('{file_path}')")
+    return pa.input_stream(file_path, compression=codec)
+
+
+def open_input(file_path):
+    """Binary file object over a file (with readline), decompressing it on the fly if needed"""
+    codec = compression_of(file_path)
+    if codec is None:
+        return open(file_path, 'rb')
+    stream = _decompressing_stream(file_path, codec)
+    # Arrow streams have no readline(); buffering adds it
+    return stream if codec == 'xz' else io.BufferedReader(stream, buffer_size=SNIFF_BYTES)
+
+
+def csv_source(file_path):
+    """What to hand to the Arrow CSV reader: the path itself, or a decompressing stream"""
+    codec = compression_of(file_path)
+    if codec is None:
+        return contextlib.nullcontext(file_path)
+    return _decompressing_stream(file_path, codec)
+
+
+def read_header_sample(file_path, n_bytes=SNIFF_BYTES):
+    """Read the first few KB of a file as text (cut back to the last complete line)"""
+    with open_input(file_path) as f:
+        raw = f.read(n_bytes)
+        if len(raw) == n_bytes and b'\n' not in raw:
+            # Very wide header (tens of thousands of genes): always return it whole
+            raw += f.readline()
+    text = raw.decode('utf-8', errors='replace')
+    if len(raw) == n_bytes and '\n' in text:
+        text = text[:text.rfind('\n') + 1]
+    return text
+
+
+def read_head_rows(file_path, n_rows=SAMPLE_ROWS, max_bytes=PREVIEW_BYTES):
+    """Read the header plus the first `n_rows` data rows as text, without touching the rest of the file"""
+    lines = []
+    n_bytes = 0
+    with open_input(file_path) as f:
+        for line in iter(f.readline, b''):
+            lines.append(line)
+            n_bytes += len(line)
+            # Wide files (one row per sample with 50k+ genes) stop on the byte budget,
+            # but always keep a few data rows so the column types can be judged
+            if len(lines) > n_rows or (n_bytes >= max_bytes and len(lines) > 3):
+                break
+    return b''.join(lines).decode('utf-8', errors='replace')
+
+
+def sniff_delimiter(sample_text, file_path=None):
+    """Detect the delimiter from a small header sample"""
+    try:
+        return csv.Sniffer().sniff(sample_text, delimiters=''.join(CANDIDATE_DELIMITERS)).delimiter
+    except csv.Error:
+        pass
+
+    # Fallback: the candidate that splits the header line into the most fields
+    header = sample_text.splitlines()[0] if sample_text else ''
+    counts = {d: header.count(d) for d in CANDIDATE_DELIMITERS}
+    best = max(counts, key=counts.get)
+    if counts[best] > 0:
+        return best
+    if file_path and data_extension(file_path) in ('.tsv', '.txt'):
+        return '\t'
+    return ','
+
+
+def _dedupe_column_names(names):
+    """Rename duplicate headers the way pandas does (a, a.1, a.2 ...)"""
+    seen = {}
+    result = []
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            new_name = f"{name}.{seen[name]}"
+            while new_name in seen:
+                seen[name] += 1
+                new_name = f"{name}.{seen[name]}"
+            seen[new_name] = 0
+            result.append(new_name)
+        else:
+            seen[name] = 0
+            result.append(name)
+    return result
+
+
+def read_column_names(sample_text, delimiter, file_path=''):
+    """Column names from the header line (duplicates renamed the way pandas does)"""
+    header_line = sample_text.splitlines()[0] if sample_text else ''
+    column_names = _dedupe_column_names(next(csv.reader([header_line], delimiter=delimiter), []))
+    if not column_names:
+        raise ValueError(f"'{file_path}' is empty or has no header row")
+    return column_names
+
+
+def _is_sample_id_column(name):
+    lowered = str(name).lower()
+    return 'sample' in lowered or lowered in ('id', 'id_ref', 'gene_id', 'probe_id')
+
+
+class IngestStats:
+    """Throughput report for one parsed file"""
+
+    def __init__(self, file_path, rows, columns, n_bytes, seconds, delimiter, float32_columns):
+        self.file_path = file_path
+        self.rows = rows
+        self.columns = columns
+        self.bytes = n_bytes
+        self.seconds = seconds
+        self.delimiter = delimiter
+        self.float32_columns = float32_columns
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else float('inf')
+
+    @property
+    def mb_per_second(self):
+        return (self.bytes / 1e6) / self.seconds if self.seconds > 0 else float('inf')
+
+    def as_dict(self):
+        return {
+            'file': self.file_path,
+            'rows': self.rows,
+            'columns': self.columns,
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 4),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'mb_per_second': round(self.mb_per_second, 2),
+            'delimiter': self.delimiter,
+            'float32_columns': self.float32_columns,
+        }
+
+    def __str__(self):
+        return (f"Parsed {self.rows:,} rows x {self.columns:,} columns in {self.seconds:.2f}s "
+                f"({self.rows_per_second:,.0f} rows/s, {self.mb_per_second:,.1f} MB/s)")
+
+
+def _line_blocks(file_path, block_size=None):
+    """(decompressed) data rows in blocks of about `block_size` bytes that end on a line break"""
+    block_size = block_size or BLOCK_SIZE
+    with open_input(file_path) as f:
+        f.readline()
+        tail = b''
+        while True:
+            data = f.read(block_size)
+            if not data:
+                if tail.strip():
+                    yield tail
+                return
+            data = tail + data
+            cut = data.rfind(b'\n') + 1
+            tail = data[cut:]
+            if cut:
+                yield memoryview(data)[:cut]
+
+
+def _parse_block(block, delimiter, column_names, column_types=None):
+    read_options = pacsv.ReadOptions(use_threads=False, block_size=len(block) + 1, column_names=column_names)
+    convert_options = pacsv.ConvertOptions(strings_can_be_null=True, column_types=column_types or {})
+    return pacsv.read_csv(pa.py_buffer(block), read_options=read_options,
+                          parse_options=pacsv.ParseOptions(delimiter=delimiter), convert_options=convert_options)
+
+
+class _Float32Matrix:
+    """
+    Row-growable float32 matrix the parsed blocks are copied into (one contiguous block).
+    Rows that are allocated but never written are untouched pages and cost no memory; the
+    result is trimmed in place.
+    """
+
+    def __init__(self, n_columns, capacity):
+        self.data = np.empty((max(int(capacity), 1), n_columns), dtype=np.float32)
+        self.n_rows = 0
+
+    def rows(self, count):
+        """The next `count` rows to fill in"""
+        end = self.n_rows + count
+        if end > len(self.data):
+            self.data.resize((max(end, int(len(self.data) * GROWTH)), self.data.shape[1]), refcheck=False)
+        view = self.data[self.n_rows:end]
+        self.n_rows = end
+        return view
+
+    def result(self):
+        self.data.resize((self.n_rows, self.data.shape[1]), refcheck=False)
+        return self.data
+
+
+def _assemble(matrix, float32_columns, others, column_names):
+    """DataFrame over the float32 matrix (not copied) with the other columns put back in file order"""
+    frame = pd.DataFrame(matrix.result(), columns=pd.Index(float32_columns), copy=False)
+    for name in others.columns:
+        frame.insert(min(column_names.index(name), frame.shape[1]), name, others[name].to_numpy())
+    return frame
+
+
+def _parse_blocks(file_path, delimiter, column_names, float32):
+    """
+    Parse the file's line blocks on INGEST_THREADS threads (Arrow releases the GIL while parsing)
+    and move each parsed block into the result as soon as it is its turn, so only the result
+    and the blocks in flight are ever in memory. Column types come from the first block.
+    Returns (DataFrame, float32 column names).
+    """
+    blocks = _line_blocks(file_path)
+    first = next(blocks, None)
+    if first is None:
+        return pd.DataFrame(columns=column_names), []
+    table = _parse_block(first, delimiter, column_names)
+    numeric_columns = [field.name for field in table.schema
+                       if (pa.types.is_integer(field.type) or pa.types.is_floating(field.type))
+                       and not _is_sample_id_column(field.name)]
+    float32_columns = numeric_columns if _use_float32(float32, numeric_columns, column_names) else []
+    float_set = set(float32_columns)
+    other_columns = [name for name in column_names if name not in float_set]
+    # Later blocks are converted straight to these types (a mismatch raises ArrowInvalid)
+    column_types = {field.name: pa.float32() if field.name in float_set else
+                    (pa.string() if pa.types.is_null(field.type) else field.type) for field in table.schema}
+
+    matrix = None
+    if float32_columns:
+        # Rows estimated from the first block's bytes per row (compressed files: ratio guess)
+        total = os.path.getsize(file_path) * (1 if compression_of(file_path) is None else COMPRESSION_GUESS)
+        matrix = _Float32Matrix(len(float32_columns), table.num_rows * total / len(first) * 1.02 + 1)
+    others = []
+
+    def add(parsed):
+        if matrix is not None:
+            rows = matrix.rows(parsed.num_rows)
+            for j, name in enumerate(float32_columns):
+                rows[:, j] = parsed.column(name).to_numpy()
+        others.append(parsed.select(other_columns).cast(pa.schema([(name, column_types[name]) for name in other_columns])))
+
+    add(table)
+    del table, first
+    with ThreadPoolExecutor(max_workers=INGEST_THREADS) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(_parse_block, block, delimiter, column_names, column_types))
+            if len(pending) >= INGEST_THREADS:
+                add(pending.popleft().result())
+        while pending:
+            add(pending.popleft().result())
+
+    if matrix is None:
+        return pa.concat_tables(others).to_pandas(), []
+    return _assemble(matrix, float32_columns, pa.concat_tables(others).to_pandas(), column_names), float32_columns
+
+
+def _read_with_pandas(file_path, delimiter, column_names, float32):
+    """
+    Fallback for files Arrow rejects (e.g. text further down a column that looked numeric):
+    pandas in chunks of about CHUNK_CELLS cells, copied into the same float32 matrix as they
+    come, so neither the float64 parse nor a second copy of the result ever exists. The float32
+    columns are picked from the first chunk; one that turns out to hold text is taken out of
+    the matrix and kept as pandas parsed it. Returns (df, float32 columns).
+    """
+    float32_columns, matrix, others, text = None, None, [], {}
+    with open_input(file_path) as source:
+        for chunk in pd.read_csv(source, sep=delimiter, chunksize=max(CHUNK_CELLS // max(len(column_names), 1), 1)):
+            if float32_columns is None:
+                numeric_columns = [col for col, dtype in chunk.dtypes.items()
+                                   if pd.api.types.is_numeric_dtype(dtype) and not _is_sample_id_column(col)]
+                float32_columns = numeric_columns if _use_float32(float32, numeric_columns, column_names) else []
+                matrix = _Float32Matrix(len(float32_columns), len(chunk))
+            for name in float32_columns:
+                if name not in text and not pd.api.types.is_numeric_dtype(chunk[name].dtype):
+                    # Earlier rows of the column, as they were read
+                    text[name] = [pd.Series(matrix.data[:matrix.n_rows, float32_columns.index(name)], dtype=object)]
+            for name in text:
+                text[name].append(chunk[name].astype(object))
+            matrix.rows(len(chunk))[:] = chunk[float32_columns].assign(**{name: np.nan for name in text}).to_numpy(np.float32)
+            others.append(chunk.drop(columns=float32_columns))
+    if matrix is None:
+        return pd.DataFrame(columns=column_names), []
+    others = pd.concat(others, ignore_index=True)
+    if not float32_columns:
+        return others, []
+    df = _assemble(matrix, float32_columns, others, column_names)
+    for name, parts in text.items():
+        df[name] = pd.concat(parts, ignore_index=True).to_numpy()
+    return df, [name for name in float32_columns if name not in text]
+
+
+def _use_float32(float32, numeric_columns, column_names):
+    """float32='auto' casts only when the file looks like an expression matrix"""
+    if float32 != 'auto':
+        return bool(float32)
+    return (len(numeric_columns) >= MIN_GENE_COLUMNS and
+            len(numeric_columns) / max(len(column_names) - 1, 1) > MIN_NUMERIC_FRACTION)
+
+
+def read_table(file_path, delimiter=None, float32='auto'):
+    """
+    Parse a delimited text file with Arrow, blocks of lines parsed in parallel on INGEST_THREADS.
+
+    - the delimiter is detected from a small header sample
+    - numeric gene columns are parsed straight to float32
+      (float32='auto' does this only when the file looks like an expression matrix)
+    - each parsed block is copied into the float32 result and released, so peak memory is the
+      result plus the blocks in flight (the pandas fallback reads in chunks the same way)
+    - .gz/.bz2/.zst/.xz files are decompressed block by block on the way into the parser
+
+    Returns (DataFrame, IngestStats).
+    """
+    start = time.perf_counter()
+    sample_text = read_header_sample(file_path)
+    if delimiter is None:
+        delimiter = sniff_delimiter(sample_text, file_path)
+
+    column_names = read_column_names(sample_text, delimiter, file_path)
+
+    try:
+        df, float32_columns = _parse_blocks(file_path, delimiter, column_names, float32)
+    except pa.ArrowInvalid as e:
+        # A column that looked numeric in the first block holds text further down
+        print(f"[!] Arrow reader fell back to pandas for '{os.path.basename(file_path)}': {e}")
+        df, float32_columns = _read_with_pandas(file_path, delimiter, column_names, float32)
+
+    stats = IngestStats(file_path, rows=len(df), columns=df.shape[1],
+                        n_bytes=os.path.getsize(file_path),
+                        seconds=time.perf_counter() - start,
+                        delimiter=delimiter, float32_columns=len(float32_columns))
+    return df, stats
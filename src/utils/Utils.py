@@ -2,12 +2,24 @@
 # Central loader for all datasets (CSV/TSV); handles missing/incomplete data
 
 import os
+import shutil
 import json
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import umap
 import GEOparse  
+import io
+import re
+from src.utils.Ingest import read_table, read_head_rows, read_header_sample, sniff_delimiter, data_extension
+from src.data_handling.Workspace_cache import (save_workspace, save_expression_store, load_workspace_file, store_path,
+                                               WORKSPACE_EXT)
+from src.data_handling.Persistence_queue import persistence_queue
+from src.data_handling.Geo_cache import geo_cache, is_geo_accession, GEO_DOWNLOAD_DIR
+from src.data_handling.Expression_store import ExpressionStore
+from src.data_handling.Characteristics import expand_characteristics
+from src.data_handling.Gene_annotation import AnnotationIndex, annotation_index, expression_probes
+from src.data_handling.Gene_search import gene_search_index
 
 # Add this function after the existing imports and before other functions
 
@@ -87,24 +99,43 @@ def get_column_name_mapping():
 # Basic Loaders and Cleaners
 # ----------------------------
 
-def load_data(file_path):
-    ext = os.path.splitext(file_path)[1]
-    if ext == '.csv':
-        return pd.read_csv(file_path)
-    elif ext in ['.tsv', '.txt']:
-        return pd.read_csv(file_path, sep='\t')
+def load_data(file_path, float32='auto', report=True, delimiter=None):
+    # Delimited text goes through the multithreaded Arrow ingest engine; the delimiter
+    # is sniffed from the header and numeric gene columns are parsed straight to float32
+    # Compressed text (.csv.gz, .txt.zst, ...) is decompressed while it is parsed
+    ext = data_extension(file_path)
+    if ext == WORKSPACE_EXT:
+        return load_workspace_file(file_path)
+    elif ext in ['.csv', '.tsv', '.txt']:
+        df, stats = read_table(file_path, delimiter=delimiter, float32=float32)
+        if report:
+            print(f"[✓] {stats}")
+        return df
     else:
-        raise ValueError("Unsupported file format. Use .csv or .tsv")
+        raise ValueError("Unsupported file format. Use .csv, .tsv, .txt (optionally .gz/.bz2/.xz/.zst) "
+                         "or a .arrow workspace")
 
 def handle_missing_data(data, method='fill_zero'):
+    # DataFrame path (metadata); expression matrices are imputed in place inside the store (Missing_data)
     if method == 'fill_zero':
         return data.fillna(0)
     elif method == 'drop':
         return data.dropna()
     elif method == 'fill_mean':
         return data.fillna(data.mean(numeric_only=True))
+    elif method == 'fill_median':
+        return data.fillna(data.median(numeric_only=True))
+    elif method == 'knn':
+        # Numeric columns only (samples are rows); other columns are left as they are
+        from src.data_handling.Missing_data import impute_columns
+        numeric_cols = data.select_dtypes(include=[np.number]).columns
+        values = data[numeric_cols].to_numpy(dtype=np.float64)
+        impute_columns(values, 'knn')
+        data = data.copy()
+        data[numeric_cols] = values
+        return data
     else:
-        raise ValueError("Invalid method. Choose 'fill_zero', 'drop', or 'fill_mean'")
+        raise ValueError("Invalid method. Choose 'fill_zero', 'drop', 'fill_mean', 'fill_median' or 'knn'")
 
 import numpy as np  # Ensure this is imported at the top
 
@@ -140,6 +171,81 @@ def validate_file_type(df):
 
     return 'unknown'
 
+# Header names that mark the first column of a genes-as-rows matrix
+GENE_ID_COLUMNS = ['id_ref', 'id', 'gene', 'gene_id', 'gene_symbol', 'symbol', 'probe', 'probe_id', 'probeset_id']
+SAMPLE_ID_PATTERN = re.compile(r'^(GSM\d+|TCGA-|sample)', re.IGNORECASE)
+
+
+def find_sample_column(columns):
+    """Name of the column holding sample IDs ('Sample', or anything like sample_id), or None"""
+    if 'Sample' in columns:
+        return 'Sample'
+    return next((col for col in columns if 'sample' in str(col).lower() and 'id' in str(col).lower()), None)
+
+
+class FileProfile:
+    """Result of classifying a file from its header and first rows"""
+
+    def __init__(self, kind, orientation=None, delimiter=',', columns=None, sample_col=None,
+                 value_columns=None):
+        self.kind = kind                    # 'metadata', 'expression' or 'unknown'
+        self.orientation = orientation      # 'samples-as-rows' or 'genes-as-rows' for expression
+        self.delimiter = delimiter
+        self.columns = columns or []
+        self.sample_col = sample_col
+        # Numeric columns of the preview (the sample columns of a genes-as-rows file)
+        self.value_columns = value_columns or []
+
+    @property
+    def genes_as_rows(self):
+        return self.orientation == 'genes-as-rows'
+
+    def __repr__(self):
+        label = self.kind if self.kind != 'expression' else f"{self.kind} ({self.orientation})"
+        return f"FileProfile({label}, {len(self.columns)} columns)"
+
+
+def _looks_genes_as_rows(preview):
+    """First column holds probe/gene IDs and the remaining (sample) columns are numeric"""
+    if preview.shape[1] < 2:
+        return False
+    first = preview.columns[0]
+    rest = preview.columns[1:]
+    numeric = preview[rest].select_dtypes(include=[np.number]).shape[1]
+    if numeric / len(rest) <= 0.8 or pd.api.types.is_numeric_dtype(preview[first]):
+        return False
+    samples_in_header = sum(bool(SAMPLE_ID_PATTERN.match(str(col))) for col in rest)
+    return str(first).strip().lower() in GENE_ID_COLUMNS or samples_in_header / len(rest) > 0.5
+
+
+def classify_file(file_path, n_rows=200):
+    """
+    Decide metadata vs expression (and the orientation of an expression matrix) from the
+    header and the first few hundred rows only, so the full parse can run exactly once.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == WORKSPACE_EXT:
+        # Workspace files are already typed; the kind is in their header
+        from src.data_handling.Workspace_cache import read_workspace_header
+        header = read_workspace_header(file_path) or {}
+        kind = header.get('kind') or 'unknown'
+        return FileProfile(kind, 'samples-as-rows' if kind == 'expression' else None)
+
+    delimiter = sniff_delimiter(read_header_sample(file_path), file_path)
+    head = read_head_rows(file_path, n_rows=n_rows)
+    preview = pd.read_csv(io.StringIO(head), sep=delimiter, low_memory=False)
+    preview = auto_rename_metadata_columns(preview)
+    sample_col = find_sample_column(preview.columns)
+
+    if sample_col is None and _looks_genes_as_rows(preview):
+        value_columns = list(preview.columns[1:][preview.dtypes.iloc[1:].map(pd.api.types.is_numeric_dtype)])
+        return FileProfile('expression', 'genes-as-rows', delimiter, list(preview.columns),
+                           preview.columns[0], value_columns)
+
+    kind = validate_file_type(preview)
+    orientation = 'samples-as-rows' if kind == 'expression' else None
+    return FileProfile(kind, orientation, delimiter, list(preview.columns), sample_col)
+
 # ----------------------------
 # Summary + Logging
 # ----------------------------
@@ -215,7 +321,7 @@ def filter_metadata(metadata_df, grade=None, idh=None, age_range=None):
             break
     
     if idh and idh_col:
-        filtered = filtered[filtered[idh_col].astype(str).upper() == idh.upper()]
+        filtered = filtered[filtered[idh_col].astype(str).str.upper() == idh.upper()]
         print(f"Filtered by {idh_col}: {idh}")
     elif idh:
         print(f"Warning: IDH column not found. Available columns: {list(filtered.columns)}")
@@ -257,20 +363,19 @@ def process_upload(file_path, data_manager, is_metadata=True, missing_method='fi
     if is_metadata is None:
         is_metadata = 'meta' in file_path.lower()
 
-    df = handle_missing_data(df, method=missing_method)
-
     if is_metadata:
-        df = auto_rename_metadata_columns(df)
+        df = auto_rename_metadata_columns(handle_missing_data(df, method=missing_method))
+        df = expand_characteristics(df)
         data_manager.metadata = df
-        fname = "metadata_cleaned.csv"
+        if save_cleaned:
+            path = save_workspace(df, "metadata_cleaned", kind="metadata")
+            print(f"Saved cleaned file to {path}")
     else:
-        data_manager.expression = df
-        fname = "expression_cleaned.csv"
-
-    if save_cleaned:
-        os.makedirs("cleaned_data", exist_ok=True)
-        df.to_csv(os.path.join("cleaned_data", fname), index=False)
-        print(f"Saved cleaned file to cleaned_data/{fname}")
+        # Expression NaNs are imputed in the float32 store, which keeps their bitmap
+        data_manager.set_expression_frame(df, missing_method)
+        if save_cleaned:
+            path = data_manager.save_expression_workspace()
+            print(f"Saved cleaned file to {path}")
 
 
 # ----------------------------
@@ -278,65 +383,59 @@ def process_upload(file_path, data_manager, is_metadata=True, missing_method='fi
 # ----------------------------
 
 def load_gene_annotations(annotation_file="gene_annotation.csv"):
-    """Load gene annotations from CSV file"""
-    try:
-        annotations = pd.read_csv(annotation_file)
-        return annotations
-    except FileNotFoundError:
-        print(f"Gene annotation file '{annotation_file}' not found. Using probe IDs only.")
-        return None
-    except Exception as e:
-        print(f"Error loading gene annotation file '{annotation_file}': {e}")
-        print("Using probe IDs only.")
-        return None
+    """Shared probe/gene-symbol index of the annotation file (read once per process), or None"""
+    return annotation_index(annotation_file)
+
+def _as_annotation_index(annotations):
+    # Callers may still pass the annotation table itself
+    if annotations is None:
+        return load_gene_annotations()
+    if isinstance(annotations, pd.DataFrame):
+        return AnnotationIndex.from_frame(annotations)
+    return annotations
 
 def map_probe_to_gene(probe_id, annotations=None):
     """Map probe ID to gene symbol"""
-    if annotations is None:
-        annotations = load_gene_annotations()
-    
+    annotations = _as_annotation_index(annotations)
     if annotations is None:
         return probe_id
-    
-    match = annotations[annotations['Probe_ID'] == probe_id]
-    if not match.empty:
-        return match.iloc[0]['Gene_Symbol']
-    return probe_id
+    return annotations.symbol(probe_id, probe_id)
 
 def map_gene_to_probe(gene_symbol, annotations=None):
     """Map gene symbol to probe ID (case-insensitive)"""
-    if annotations is None:
-        annotations = load_gene_annotations()
-    
+    annotations = _as_annotation_index(annotations)
     if annotations is None:
         return gene_symbol
-    
-    # Case-insensitive matching
-    match = annotations[annotations['Gene_Symbol'].str.upper() == gene_symbol.upper()]
-    if not match.empty:
-        return match.iloc[0]['Probe_ID']
-    return gene_symbol
+    probes = annotations.probes_for(gene_symbol)
+    return probes[0] if probes else gene_symbol
 
 def get_all_available_genes(expression_df, annotations=None):
-    """Get all available genes with their mappings"""
+    """Get all available genes with their mappings (expression_df: DataFrame or ExpressionStore)"""
     if expression_df is None:
         return {}
-    
+    annotations = _as_annotation_index(annotations)
     if annotations is None:
-        annotations = load_gene_annotations()
-    
-    # Get all gene columns (exclude 'Sample')
-    gene_cols = [col for col in expression_df.columns if col != 'Sample']
-    
-    # Create mapping dictionary
-    gene_mapping = {}
-    for probe_id in gene_cols:
-        gene_name = map_probe_to_gene(probe_id, annotations)
-        if gene_name != probe_id:
-            gene_mapping[gene_name.upper()] = probe_id  # Store in uppercase for case-insensitive lookup
-            gene_mapping[probe_id] = probe_id  # Also store probe ID as-is
-    
-    return gene_mapping
+        return {}
+    return annotations.gene_mapping(expression_probes(expression_df))
+
+def named_genes(expression, annotations=None):
+    """(gene symbols, first probe of each) for the annotated genes of the data, sorted by symbol"""
+    annotations = _as_annotation_index(annotations)
+    if expression is None or annotations is None:
+        return [], []
+    pairs = annotations.named_genes(expression_probes(expression))
+    return [gene for gene, _ in pairs], [probe for _, probe in pairs]
+
+def search_named_genes(expression, query, annotations=None):
+    """(gene symbols or probe IDs, probes) of the columns matching `query` by prefix, gene name or typo, best first"""
+    if expression is None:
+        return [], []
+    index = gene_search_index(expression, _as_annotation_index(annotations))
+    columns, _ = index.match(query)
+    symbols = index.symbols[columns]
+    probes = index.probes[columns]
+    names = [symbol.upper() if symbol is not None else probe for symbol, probe in zip(symbols, probes)]
+    return names, list(probes)
 
 def list_all_available_genes(expression_df, show_gene_names=True, max_display=50):
     """List all available genes with their mappings"""
@@ -345,7 +444,8 @@ def list_all_available_genes(expression_df, show_gene_names=True, max_display=50
         return {}
     
     # Get gene columns (exclude 'Sample' column)
-    gene_cols = [col for col in expression_df.columns if col != 'Sample']
+    probes = expression_probes(expression_df)
+    gene_cols = list(probes)
     total_genes = len(gene_cols)
     
     if show_gene_names:
@@ -358,24 +458,16 @@ def list_all_available_genes(expression_df, show_gene_names=True, max_display=50
             print(f"Showing first {max_display} genes with names:")
             print("=" * 60)
             
-            # Create mapping for all genes
-            available_genes = []
-            gene_mapping = {}
-            named_genes_count = 0
-            
-            for probe_id in gene_cols:
-                gene_name = map_probe_to_gene(probe_id, annotations)
-                if gene_name != probe_id:
-                    available_genes.append(f"{gene_name} ({probe_id})")
-                    gene_mapping[gene_name.upper()] = probe_id
-                    gene_mapping[probe_id] = probe_id
-                    named_genes_count += 1
-                    
-                    # Only display up to max_display named genes
-                    if len(available_genes) <= max_display:
-                        print(f"{len(available_genes):3d}. {gene_name} ({probe_id})")
-                else:
-                    gene_mapping[probe_id] = probe_id
+            # Symbols of all gene columns in one vectorized lookup
+            symbols = annotations.column_symbols(probes)
+            gene_mapping = get_all_available_genes(expression_df, annotations)
+            gene_mapping.update((probe, probe) for probe in gene_cols)
+            named = [(symbol, probe) for symbol, probe in zip(symbols, gene_cols) if symbol is not None]
+            named_genes_count = len(named)
+
+            # Only display up to max_display named genes
+            for i, (gene_name, probe_id) in enumerate(named[:max_display], 1):
+                print(f"{i:3d}. {gene_name} ({probe_id})")
             
             if named_genes_count > max_display:
                 print(f"... and {named_genes_count - max_display} more genes with known names")
@@ -434,23 +526,86 @@ def auto_rename_metadata_columns(df):
     This makes the interface much more intuitive for users.
     """
     mapping = get_column_name_mapping()
-    
-    # Create a copy to avoid modifying the original
-    df_renamed = df.copy()
-    
-    # Track which columns were renamed for user feedback
-    renamed_columns = {}
-    
-    for old_name in df.columns:
-        if old_name in mapping:
-            new_name = mapping[old_name]
-            df_renamed.rename(columns={old_name: new_name}, inplace=True)
-            renamed_columns[old_name] = new_name
-    
+
+    # Only column labels change, so a shallow copy is enough (no data is duplicated)
+    df_renamed = df.copy(deep=False)
+    df_renamed.columns = [mapping.get(col, col) for col in df.columns]
+
     # Column names have been simplified silently for better user experience
-    
+
     return df_renamed
 
+# Text columns with at most this fraction of distinct values are stored as categoricals
+CATEGORY_MAX_UNIQUE_FRACTION = 0.5
+
+def categorize_metadata(df, max_unique_fraction=CATEGORY_MAX_UNIQUE_FRACTION, exclude=('Sample',)):
+    """
+    Dictionary-encode repetitive text columns of a metadata table as pandas categoricals.
+
+    GEO metadata repeats the same long strings (tissue, extraction protocol, institute address)
+    for every sample; as categoricals each distinct string is stored once and filters, value
+    counts and groupbys work on the integer codes. Columns that mix text with numbers (e.g.
+    after fill_zero) are stored as text, the same way the workspace file stores them.
+    """
+    if df is None:
+        return df
+
+    n_rows = len(df)
+    encoded = {}
+    for col in df.columns:
+        if col in exclude or df[col].dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(df[col], skipna=True)
+        if kind not in ('string', 'mixed', 'mixed-integer', 'mixed-integer-float'):
+            continue
+        values = df[col]
+        if kind != 'string':
+            values = values.where(values.isna(), values.astype(str))
+        if values.nunique() > max_unique_fraction * n_rows:
+            continue
+        encoded[col] = values.astype('category')
+
+    if not encoded:
+        return df
+    df = df.copy(deep=False)
+    for col, values in encoded.items():
+        df[col] = values
+    return df
+
+def category_value_counts(series):
+    """value_counts() that, for categoricals, counts the integer codes (unused categories dropped)"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.value_counts()
+    codes = series.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+    used = np.flatnonzero(counts)
+    order = used[np.argsort(-counts[used], kind='stable')]
+    return pd.Series(counts[order], index=series.cat.categories[order], name='count')
+
+def _category_mask(series, category_match, nan_match):
+    """Row mask from a per-category boolean array (missing values take `nan_match`)"""
+    codes = series.cat.codes.to_numpy()
+    lookup = np.append(np.asarray(category_match, dtype=bool), nan_match)
+    # code -1 (missing) picks the last entry of the lookup table
+    return pd.Series(lookup[codes], index=series.index)
+
+def isin_mask(series, values):
+    """Equivalent of series.astype(str).isin(values), evaluated once per category for categoricals"""
+    values = [str(v) for v in values]
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(str).isin(values)
+    categories = series.cat.categories.astype(str)
+    return _category_mask(series, categories.isin(values), 'nan' in values)
+
+def contains_mask(series, pattern, case=False):
+    """Equivalent of series.astype(str).str.contains(pattern), evaluated once per category for categoricals"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(str).str.contains(pattern, case=case, na=False)
+    categories = pd.Series(series.cat.categories.astype(str))
+    category_match = categories.str.contains(pattern, case=case, na=False).to_numpy()
+    nan_match = bool(pd.Series(['nan']).str.contains(pattern, case=case, na=False).iloc[0])
+    return _category_mask(series, category_match, nan_match)
+
 def get_relevant_columns_for_analysis(metadata_df, min_values=2, max_values=50):
     """
     Returns only columns that are relevant for analysis by filtering out:
@@ -481,8 +636,8 @@ def get_relevant_columns_for_analysis(metadata_df, min_values=2, max_values=50):
         if any(pattern in col.lower() for pattern in exclude_patterns):
             continue
             
-        unique_vals = metadata_df[col].dropna().unique()
-        num_unique = len(unique_vals)
+        # nunique() on a categorical only counts the used codes
+        num_unique = metadata_df[col].nunique()
         
         # Only include columns with reasonable number of unique values
         if min_values <= num_unique <= max_values:
@@ -507,29 +662,101 @@ def display_column_mapping_help():
     print(f"\nTotal: {len(mapping)} column name simplifications")
     print("These simplified names make filtering and analysis much easier!")
 
-def fetch_and_format_geo(geo_id):
+def _geo_options(annotate_gpl=True):
+    """Parse options a GEO cache snapshot is keyed on"""
+    return {'annotate_gpl': bool(annotate_gpl), 'value_column': 'VALUE'}
+
+def fetch_and_format_geo(geo_id, save=True, use_cache=True, annotate_gpl=True, expression_dir=None):
+    # save=False when the caller persists the dataset itself (the web app's workspace does)
+    # Returns (metadata, expression): expression is an ExpressionStore for series (streamed
+    # from the family SOFT file, or checked out of the GEO cache), else a DataFrame.
+    # expression_dir: where the caller keeps the series' store (default: cleaned_data/ when
+    # saving, else in memory); never the GEO cache snapshot itself
+    options = _geo_options(annotate_gpl)
+    use_cache = use_cache and is_geo_accession(geo_id)
+    expression_store_path = expression_dir or (store_path(f"{geo_id}_expression") if save else None)
+    if use_cache:
+        # Checked out (hard links) where the expression store is kept
+        cached = geo_cache.load(geo_id, options, checkout=expression_store_path)
+        if cached is not None:
+            return cached
+
     print(f"Fetching {geo_id} from GEO...")
 
     # Set download location
-    os.makedirs("uploads", exist_ok=True)
+    os.makedirs(GEO_DOWNLOAD_DIR, exist_ok=True)
 
     try:
-        gse = GEOparse.get_GEO(geo=geo_id, destdir="uploads", annotate_gpl=True)
+        # Download only (an existing file is reused); parsing happens below
+        soft_path, geo_type = GEOparse.get_GEO_file(geo_id, destdir=GEO_DOWNLOAD_DIR, annotate_gpl=annotate_gpl)
     except Exception as e:
         print(f"[!] Failed to fetch GEO dataset: {e}")
         return None, None
 
+    if geo_type == 'GSE':
+        # Streaming parse: GSM tables go straight into the float32 store (written to
+        # cleaned_data/ when saving, else kept in memory)
+        from src.data_handling.Soft_parser import parse_family_soft
+        try:
+            metadata, df_expr = parse_family_soft(soft_path, directory=expression_store_path,
+                                                  value_column=options['value_column'])
+        except Exception as e:
+            print(f"[!] Could not parse {soft_path}: {e}")
+            return None, None
+        metadata = expand_characteristics(auto_rename_metadata_columns(metadata))
+        if df_expr.n_probes == 0:
+            # e.g. series whose GSMs carry no data table (only supplementary files)
+            print(f"[!] {geo_id} has no expression table in its SOFT file ({df_expr.n_samples} samples, 0 probes)")
+            if df_expr.path:
+                shutil.rmtree(df_expr.path, ignore_errors=True)
+            return metadata, None
+    else:
+        metadata, df_expr = _format_geoparse_object(soft_path, geo_type)
+        if df_expr is None:
+            return metadata, None
+
+    # Parsed once: later loads of this SOFT file come from the cache snapshot
+    # The writer gets the data as parsed: samples appended to the returned store before the job
+    # runs must not reach the snapshot
+    if use_cache:
+        expression = df_expr.snapshot() if isinstance(df_expr, ExpressionStore) else df_expr.copy(deep=False)
+        persistence_queue.submit(f"geo_cache/{geo_id.upper()}", geo_cache.save, geo_id,
+                                 metadata.copy(deep=False), expression, options)
+
+    # Save both to the binary workspace, off the calling thread (flush_pending_writes waits for it)
+    if save:
+        persistence_queue.submit(f"{geo_id}_metadata", save_workspace, metadata.copy(deep=False), f"{geo_id}_metadata",
+                                 kind='metadata')
+        # A streamed series is already saved there
+        if not (isinstance(df_expr, ExpressionStore) and df_expr.path):
+            persistence_queue.submit(f"{geo_id}_expression", save_expression_store, df_expr, f"{geo_id}_expression")
+        print(f"[✓] Saving metadata and expression matrix to cleaned_data/ in the background")
+    return metadata, df_expr
+
+
+def _format_geoparse_object(soft_path, geo_type):
+    """(metadata, samples-as-rows expression DataFrame) of a non-series SOFT file via GEOparse"""
+    try:
+        gse = GEOparse.get_GEO(filepath=soft_path, geotype=geo_type)
+    except Exception as e:
+        print(f"[!] Failed to parse GEO dataset: {e}")
+        return None, None
+
     # Build metadata from GSM attributes
     metadata_rows = []
-    for gsm_name, gsm in gse.gsms.items():
+    for gsm_name, gsm in getattr(gse, 'gsms', {}).items():
         row = {"Sample": gsm_name}
         # Flatten metadata: get first element if it's a list
         row.update({k: v[0] if isinstance(v, list) else v for k, v in gsm.metadata.items()})
+        # Every characteristics entry is kept (characteristics_ch1.1, .2 ...) for expand_characteristics
+        for k, v in gsm.metadata.items():
+            if k.startswith('characteristics_ch') and isinstance(v, list):
+                row.update({f"{k}.{i}": entry for i, entry in enumerate(v[1:], 1)})
         metadata_rows.append(row)
     metadata = pd.DataFrame(metadata_rows)
     
-    # Apply column name simplifications to make it user-friendly
-    metadata = auto_rename_metadata_columns(metadata)
+    # Apply column name simplifications, then type the clinical characteristics
+    metadata = expand_characteristics(auto_rename_metadata_columns(metadata))
 
     # Build expression matrix
     try:
@@ -545,11 +772,4 @@ def fetch_and_format_geo(geo_id):
     except Exception as e:
         print(f"[!] Could not extract expression matrix: {e}")
         return metadata, None
-
-    # Save both
-    os.makedirs("cleaned_data", exist_ok=True)
-    metadata.to_csv(f"cleaned_data/{geo_id}_metadata.csv", index=False)
-    df_expr.to_csv(f"cleaned_data/{geo_id}_expression.csv", index=False)
-
-    print(f"[✓] Saved metadata and expression matrix to cleaned_data/")
     return metadata, df_expr
@@ -3,14 +3,30 @@ import pandas as pd
 import plotly.express as px
 from sklearn.decomposition import PCA
 import umap
+from src.data_handling.Expression_store import expression_matrix
+from src.data_handling.Sample_alignment import align_samples
 
-def plot_pca(expression_df, metadata_df=None, color_by=None):
+
+def _attach_metadata(result_df, metadata_df, samples, alignment=None):
+    #adds the metadata columns to the per-sample result via the sample position map (left join)
+    if metadata_df is None:
+        return result_df
+    alignment = align_samples(metadata_df, samples, alignment)
+    aligned = alignment.aligned_metadata(metadata_df, [col for col in metadata_df.columns if col != 'Sample'],
+                                         how='left')
+    return pd.concat([result_df, aligned], axis=1)
+
+def plot_pca(expression_df, metadata_df=None, color_by=None, alignment=None):
     
     #Plots PCA using top 2 components from expression data. 
     #Optionally merges metadata to colour by a label
 
-    #drop down columns
-    numeric_data = expression_df.select_dtypes(include='number')
+    #expression_df may be an ExpressionStore: use a zero-copy view of its matrix
+    try:
+        samples, probes, numeric_data = expression_matrix(expression_df)
+    except ValueError:
+        print("Error: 'Sample' column not found in expression_df.")
+        return
 
     #ensure rows are patients columns are genes
     pca =PCA(n_components=2)
@@ -20,17 +36,10 @@ def plot_pca(expression_df, metadata_df=None, color_by=None):
     pca_df = pd.DataFrame(pca_result, columns=['PC1', 'PC2'])
     
     # Attach Sample
-    if 'Sample' in expression_df.columns:
-        pca_df['Sample'] = expression_df['Sample'].values
-    else:
-        print("Error: 'Sample' column not found in expression_df.")
-        return
+    pca_df['Sample'] = samples
 
-    #merge with metadata if provided
-    if metadata_df is not None:
-        merged_df = pd.merge(pca_df, metadata_df, on='Sample', how='left')
-    else:
-        merged_df = pca_df
+    #attach metadata if provided (aligned by position, no merge)
+    merged_df = _attach_metadata(pca_df, metadata_df, samples, alignment)
 
     # Create a more selective hover template with only relevant information
     hover_template = '<b>Sample:</b> %{customdata[0]}<br>'
@@ -110,12 +119,11 @@ def plot_pca(expression_df, metadata_df=None, color_by=None):
         print(f"Could not open plot automatically. Please open '{plot_filename}' manually in your browser.")
 
 
-def plot_umap(expression_df, metadata_df=None, color_by=None):
-    #Drop non-numeric columns
-    numeric_data = expression_df.select_dtypes(include='number')
-
-    #  Check if 'Sample' is present
-    if 'Sample' not in expression_df.columns:
+def plot_umap(expression_df, metadata_df=None, color_by=None, alignment=None):
+    #expression_df may be an ExpressionStore: use a zero-copy view of its matrix
+    try:
+        samples, probes, numeric_data = expression_matrix(expression_df)
+    except ValueError:
         print("Error: 'Sample' column not found in expression_df.")
         return
 
@@ -125,13 +133,10 @@ def plot_umap(expression_df, metadata_df=None, color_by=None):
 
     #build umap result dataframe
     umap_df = pd.DataFrame(umap_result, columns=['UMAP1', 'UMAP2'])
-    umap_df['Sample'] = expression_df['Sample'].values
+    umap_df['Sample'] = samples
 
-    #merge metadata if provided
-    if metadata_df is not None:
-        merged_df = pd.merge(umap_df, metadata_df, on='Sample', how='left')
-    else:
-        merged_df = umap_df
+    #attach metadata if provided (aligned by position, no merge)
+    merged_df = _attach_metadata(umap_df, metadata_df, samples, alignment)
 
     # Note: Using simpler hover approach with hover_name and hover_data
     
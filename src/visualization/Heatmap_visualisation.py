@@ -3,8 +3,14 @@ import plotly.express as px
 import plotly.graph_objects as go
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import AgglomerativeClustering
+from src.data_handling.Expression_store import ExpressionStore, expression_frame
+from src.data_handling.Sample_alignment import align_samples
+
+def plot_expression_heatmap(expression_df, metadata_df=None, genes=None, group_col=None, alignment=None):
+    # expression_df may be an ExpressionStore; keep it for zero-copy slicing
+    store = expression_df if isinstance(expression_df, ExpressionStore) else None
+    expression_df = expression_frame(expression_df)
 
-def plot_expression_heatmap(expression_df, metadata_df=None, genes=None, group_col=None):
     # Check for Sample
     if 'Sample' not in expression_df.columns:
         print("Error: 'Sample' column not found.")
@@ -15,24 +21,28 @@ def plot_expression_heatmap(expression_df, metadata_df=None, genes=None, group_c
         return
 
     # Import gene mapping functions
-    from src.utils.Utils import get_all_available_genes, map_probe_to_gene, load_gene_annotations
+    from src.utils.Utils import map_probe_to_gene, load_gene_annotations
     
-    # Load gene annotations and get all available genes
+    # Shared annotation index: each requested symbol is one hash lookup
     annotations = load_gene_annotations()
-    all_genes_mapping = get_all_available_genes(expression_df, annotations)
+    available = store if store is not None else set(expression_df.columns)
     
     # Convert gene names to probe IDs if needed (case-insensitive)
     converted_genes = []
     for gene in genes:
-        gene_upper = gene.upper()  # Convert to uppercase for case-insensitive matching
+        probe_id = annotations.resolve(gene, available) if annotations is not None else None
+        # Gene-level data has one column per symbol, spelled as in the annotation file
+        symbol = annotations.display_symbols.get(str(gene).strip().upper()) if annotations is not None else None
         
         if gene in expression_df.columns:
             # Already a probe ID
             converted_genes.append(gene)
             print(f"SUCCESS: Using probe ID: '{gene}'")
-        elif gene_upper in all_genes_mapping:
-            # Found gene name in mapping
-            probe_id = all_genes_mapping[gene_upper]
+        elif symbol is not None and symbol in expression_df.columns:
+            converted_genes.append(symbol)
+            print(f"SUCCESS: Using gene column: '{symbol}'")
+        elif probe_id is not None:
+            # Found gene name in the annotation index
             converted_genes.append(probe_id)
             print(f"SUCCESS: Mapped '{gene}' to probe ID '{probe_id}'")
         else:
@@ -49,9 +59,14 @@ def plot_expression_heatmap(expression_df, metadata_df=None, genes=None, group_c
         print(f"The following genes are missing in expression data: {', '.join(missing_genes)}")
         return
 
-    # Subset data
-    heatmap_data = expression_df[['Sample'] + converted_genes].copy()
-    heatmap_data.set_index('Sample', inplace=True)
+    # Subset data (only the requested probe columns are copied out of the store)
+    if store is not None:
+        heatmap_data = pd.DataFrame(store.matrix(converted_genes),
+                                    index=pd.Index(store.samples, name='Sample'),
+                                    columns=converted_genes)
+    else:
+        heatmap_data = expression_df[['Sample'] + converted_genes].copy()
+        heatmap_data.set_index('Sample', inplace=True)
     
     # Create gene name mapping for display
     gene_display_names = {}
@@ -69,7 +84,9 @@ def plot_expression_heatmap(expression_df, metadata_df=None, genes=None, group_c
     # Optional grouping
     group_series = None
     if metadata_df is not None and group_col and group_col in metadata_df.columns:
-        group_series = metadata_df.set_index('Sample')[group_col].reindex(scaled_df.index)
+        alignment = align_samples(metadata_df, scaled_df.index, alignment)
+        group_series = pd.Series(alignment.metadata_column(metadata_df, group_col, how='left'),
+                                 index=scaled_df.index)
 
     # Create sample numbers for Y-axis (instead of sample IDs)
     sample_numbers = [f"Sample {i+1}" for i in range(len(scaled_df))]
@@ -7,6 +7,7 @@ import webbrowser
 import os
 import ssl
 import certifi
+from src.utils.Utils import category_value_counts
 
 # Explicitly create SSL context using certifi bundle
 ctx = ssl.create_default_context(cafile=certifi.where())
@@ -31,6 +32,17 @@ def geocode_country(country):
         print(f"Failed to geocode {country}: {e}")
     return (None, None)
 
+def geocode_series(locations):
+    """
+    Latitude/Longitude columns for a Series of place names. Each distinct place is geocoded
+    once and the coordinates are spread to the rows by their (categorical) codes.
+    """
+    codes, places = pd.factorize(locations)
+    coords = [geocode_country(place) for place in places]
+    table = pd.DataFrame(coords + [(None, None)], columns=['Latitude', 'Longitude'], dtype=float)
+    # code -1 (missing place) picks the trailing (None, None) row
+    return table.take(codes).set_axis(locations.index)
+
 def plot_patient_geomap(metadata_df, filter_applied=None, color_by='country', zoom_to_region=False):
     df = metadata_df.copy()
 
@@ -63,7 +75,7 @@ def plot_patient_geomap(metadata_df, filter_applied=None, color_by='country', zo
 
     if 'Latitude' not in df.columns or 'Longitude' not in df.columns:
         print("Geocoding countries to get Latitude and Longitude...")
-        df[['Latitude', 'Longitude']] = df['country'].apply(lambda x: pd.Series(geocode_country(x)))
+        df[['Latitude', 'Longitude']] = geocode_series(df['country'])
         print("Geocoded locations:")
         print(df[['Sample', 'country', 'Latitude', 'Longitude']])
 
@@ -162,7 +174,7 @@ def create_patient_geomap_html(metadata_df, filter_applied=None, color_by='count
 
     if not has_geographic_data:
         print("Geocoding countries to get Latitude and Longitude...")
-        df[['Latitude', 'Longitude']] = df['country'].apply(lambda x: pd.Series(geocode_country(x)))
+        df[['Latitude', 'Longitude']] = geocode_series(df['country'])
         print("Geocoded locations:")
         print(df[['Sample', 'country', 'Latitude', 'Longitude']])
 
@@ -234,9 +246,9 @@ def plot_study_summary(metadata_df, group_by='country'):
     
     if 'Latitude' not in metadata_df.columns or 'Longitude' not in metadata_df.columns:
         print("Geocoding countries for study-level summary...")
-        metadata_df[['Latitude', 'Longitude']] = metadata_df['country'].apply(lambda x: pd.Series(geocode_country(x)))
+        metadata_df[['Latitude', 'Longitude']] = geocode_series(metadata_df['country'])
 
-    df_grouped = metadata_df.groupby(group_by).agg({
+    df_grouped = metadata_df.groupby(group_by, observed=True).agg({
         'Latitude': 'first',
         'Longitude': 'first',
         'Sample': 'count',
@@ -249,10 +261,10 @@ def plot_study_summary(metadata_df, group_by='country'):
     }, inplace=True)
 
     def summarize_column(col_data):
-        return ', '.join([f"{k}: {v}" for k, v in col_data.value_counts().to_dict().items()])
+        return ', '.join([f"{k}: {v}" for k, v in category_value_counts(col_data).to_dict().items()])
     
-    sex_summary = metadata_df.groupby(group_by)['sex'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
-    idh_summary = metadata_df.groupby(group_by)['idh'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
+    sex_summary = metadata_df.groupby(group_by, observed=True)['sex'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
+    idh_summary = metadata_df.groupby(group_by, observed=True)['idh'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
 
     df_grouped['Sex_Summary'] = df_grouped[group_by].map(sex_summary)
     df_grouped['IDH_Summary'] = df_grouped[group_by].map(idh_summary)
@@ -415,7 +427,7 @@ def create_institution_map(metadata_df):
         return
     
     # Group by institution and count samples
-    institution_counts = metadata_df.groupby('institute').size().reset_index(name='sample_count')
+    institution_counts = metadata_df.groupby('institute', observed=True).size().reset_index(name='sample_count')
     
     # Get unique institutions with their locations
     institutions = {}
@@ -499,7 +511,7 @@ def create_timeline_map(metadata_df):
         metadata_df['year'] = pd.to_datetime(metadata_df['submission_date'], errors='coerce').dt.year
         
         # Group by year and institution
-        timeline_data = metadata_df.groupby(['year', 'contact_institute']).size().reset_index(name='count')
+        timeline_data = metadata_df.groupby(['year', 'contact_institute'], observed=True).size().reset_index(name='count')
         
         # Create timeline chart
         fig = px.scatter(
@@ -537,7 +549,7 @@ def create_network_map(metadata_df):
     
     if 'contact_institute' in metadata_df.columns and 'series_id' in metadata_df.columns:
         # Count studies per institution
-        institution_studies = metadata_df.groupby('contact_institute')['series_id'].nunique()
+        institution_studies = metadata_df.groupby('contact_institute', observed=True)['series_id'].nunique()
         
         print("ANALYSIS: Research Network Summary:")
         print("=" * 50)
@@ -677,9 +689,9 @@ def create_study_summary_html(metadata_df, group_by='country'):
         if country_col is None:
             return f"<div class='alert alert-warning'>No country column found for geocoding. Available columns: {', '.join(metadata_df.columns)}</div>"
         
-        metadata_df[['Latitude', 'Longitude']] = metadata_df[country_col].apply(lambda x: pd.Series(geocode_country(x)))
+        metadata_df[['Latitude', 'Longitude']] = geocode_series(metadata_df[country_col])
 
-    df_grouped = metadata_df.groupby(group_by).agg({
+    df_grouped = metadata_df.groupby(group_by, observed=True).agg({
         'Latitude': 'first',
         'Longitude': 'first',
         'Sample': 'count',
@@ -692,10 +704,10 @@ def create_study_summary_html(metadata_df, group_by='country'):
     }, inplace=True)
 
     def summarize_column(col_data):
-        return ', '.join([f"{k}: {v}" for k, v in col_data.value_counts().to_dict().items()])
+        return ', '.join([f"{k}: {v}" for k, v in category_value_counts(col_data).to_dict().items()])
     
-    sex_summary = metadata_df.groupby(group_by)['sex'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
-    idh_summary = metadata_df.groupby(group_by)['idh'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
+    sex_summary = metadata_df.groupby(group_by, observed=True)['sex'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
+    idh_summary = metadata_df.groupby(group_by, observed=True)['idh'].apply(lambda x: summarize_column(x) if x.notna().any() else 'N/A')
 
     df_grouped['Sex_Summary'] = df_grouped[group_by].map(sex_summary)
     df_grouped['IDH_Summary'] = df_grouped[group_by].map(idh_summary)
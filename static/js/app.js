@@ -530,7 +530,9 @@ class GliomaScopeApp {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
-                    gene_name: geneName
+                    gene_name: geneName,
+                    online: document.getElementById('chromosomeOnline').checked,
+                    refresh: document.getElementById('chromosomeRefresh').checked
                 })
             });
             
@@ -1746,7 +1748,8 @@ class GliomaScopeApp {
         const data = {
             group_col: groupCol,
             group_1: group1,
-            group_2: group2
+            group_2: group2,
+            ...this.getExpressionLevel('diffExpLevel')
         };
 
         this.showLoading();
@@ -1943,35 +1946,72 @@ class GliomaScopeApp {
         }
     }
 
+    // Fill a gene <select> with one page of /genes/search results, keeping selected options
+    async loadGeneOptions(selectId, query, placeholder, valueField, perPage) {
+        const geneSelect = document.getElementById(selectId);
+        if (!geneSelect) return;
+        
+        const params = new URLSearchParams({ q: query || '', per_page: perPage });
+        const response = await fetch(`/genes/search?${params}`);
+        const result = await response.json();
+        if (!result.success) return;
+        
+        const selected = Array.from(geneSelect.selectedOptions).filter(option => option.value);
+        const selectedValues = new Set(selected.map(option => option.value));
+        geneSelect.innerHTML = `<option value="">${placeholder}</option>`;
+        selected.forEach(option => geneSelect.appendChild(option));
+        
+        result.results.forEach(geneObj => {
+            const value = geneObj[valueField] || geneObj.probe_id;
+            if (selectedValues.has(value)) return;
+            const option = document.createElement('option');
+            option.value = value;
+            option.textContent = geneObj.display_name;
+            if (geneObj.full_name) option.title = geneObj.full_name;
+            geneSelect.appendChild(option);
+        });
+        
+        if (result.total > result.results.length) {
+            const option = document.createElement('option');
+            option.value = "";
+            option.textContent = `... and ${result.total - result.results.length} more genes (type to search)`;
+            option.disabled = true;
+            geneSelect.appendChild(option);
+        }
+    }
+
+    // Add a search box above a gene <select>; matches come from the server page by page
+    async setupGeneSearch(selectId, placeholder, valueField, perPage) {
+        const geneSelect = document.getElementById(selectId);
+        if (!geneSelect) return;
+        
+        let searchInput = document.getElementById(`${selectId}Search`);
+        if (!searchInput) {
+            searchInput = document.createElement('input');
+            searchInput.type = 'search';
+            searchInput.id = `${selectId}Search`;
+            searchInput.className = 'form-control mb-2';
+            searchInput.placeholder = 'Search by gene symbol, name or probe ID...';
+            searchInput.autocomplete = 'off';
+            geneSelect.parentNode.insertBefore(searchInput, geneSelect);
+            
+            let timer = null;
+            searchInput.addEventListener('input', () => {
+                clearTimeout(timer);
+                timer = setTimeout(() => {
+                    this.loadGeneOptions(selectId, searchInput.value.trim(), placeholder, valueField, perPage)
+                        .catch(error => console.error('Error searching genes:', error));
+                }, 250);
+            });
+        }
+        
+        await this.loadGeneOptions(selectId, searchInput.value.trim(), placeholder, valueField, perPage);
+    }
+
     async populateGeneExplorationDropdowns() {
         try {
-            // Populate genes dropdown
-            const genesResponse = await fetch('/available_genes');
-            const genesResult = await genesResponse.json();
-            
-            const geneSelect = document.getElementById('geneNameExplore');
-            if (geneSelect && genesResult.success) {
-                geneSelect.innerHTML = '<option value="">Select a gene to explore...</option>';
-                
-                // Handle new gene data structure (objects with gene_name, probe_id, display_name)
-                const genesToShow = genesResult.genes.slice(0, 1000);
-                genesToShow.forEach(geneObj => {
-                    const option = document.createElement('option');
-                    // Use probe_id as value (for backend processing)
-                    option.value = geneObj.probe_id || geneObj.gene_name || geneObj;
-                    // Use display_name for user-friendly display
-                    option.textContent = geneObj.display_name || geneObj.gene_name || geneObj;
-                    geneSelect.appendChild(option);
-                });
-                
-                if (genesResult.genes.length > 1000) {
-                    const option = document.createElement('option');
-                    option.value = "";
-                    option.textContent = `... and ${genesResult.genes.length - 1000} more genes`;
-                    option.disabled = true;
-                    geneSelect.appendChild(option);
-                }
-            }
+            // Populate genes dropdown (first page; the search box fetches matches as the user types)
+            await this.setupGeneSearch('geneNameExplore', 'Select a gene to explore...', 'probe_id', 100);
             
             // Populate group columns dropdown
             const columnsResponse = await fetch('/available_columns');
@@ -1995,33 +2035,8 @@ class GliomaScopeApp {
 
     async populateChromosomeMappingDropdowns() {
         try {
-            // Populate genes dropdown for chromosome mapping
-            const genesResponse = await fetch('/available_genes');
-            const genesResult = await genesResponse.json();
-            
-            const geneSelect = document.getElementById('chromosomeGene');
-            if (geneSelect && genesResult.success) {
-                geneSelect.innerHTML = '<option value="">Select a gene to map...</option>';
-                
-                // Handle new gene data structure (objects with gene_name, probe_id, display_name)
-                const genesToShow = genesResult.genes.slice(0, 1000); // Limit to first 1000 genes
-                genesToShow.forEach(geneObj => {
-                    const option = document.createElement('option');
-                    // Use gene_name as value (for chromosome mapping, we want the actual gene name)
-                    option.value = geneObj.gene_name || geneObj.probe_id || geneObj;
-                    // Use display_name for user-friendly display
-                    option.textContent = geneObj.display_name || geneObj.gene_name || geneObj;
-                    geneSelect.appendChild(option);
-                });
-                
-                if (genesResult.genes.length > 1000) {
-                    const option = document.createElement('option');
-                    option.value = "";
-                    option.textContent = `... and ${genesResult.genes.length - 1000} more genes`;
-                    option.disabled = true;
-                    geneSelect.appendChild(option);
-                }
-            }
+            // Populate genes dropdown for chromosome mapping (gene_name as value: we want the actual gene name)
+            await this.setupGeneSearch('chromosomeGene', 'Select a gene to map...', 'gene_name', 100);
         } catch (error) {
             console.error('Error populating chromosome mapping dropdowns:', error);
         }
@@ -2029,33 +2044,8 @@ class GliomaScopeApp {
 
     async populateHeatmapDropdowns() {
         try {
-            // Populate genes dropdown for heatmap
-            const genesResponse = await fetch('/available_genes');
-            const genesResult = await genesResponse.json();
-            
-            const geneSelect = document.getElementById('heatmapGenesViz');
-            if (geneSelect && genesResult.success) {
-                geneSelect.innerHTML = '<option value="">Select genes for heatmap...</option>';
-                
-                // Handle new gene data structure (objects with gene_name, probe_id, display_name)
-                const genesToShow = genesResult.genes.slice(0, 500); // Limit to first 500 genes for heatmap
-                genesToShow.forEach(geneObj => {
-                    const option = document.createElement('option');
-                    // Use gene_name as value (for heatmap, we want the actual gene name)
-                    option.value = geneObj.gene_name || geneObj.probe_id || geneObj;
-                    // Use display_name for user-friendly display
-                    option.textContent = geneObj.display_name || geneObj.gene_name || geneObj;
-                    geneSelect.appendChild(option);
-                });
-                
-                if (genesResult.genes.length > 500) {
-                    const option = document.createElement('option');
-                    option.value = "";
-                    option.textContent = `... and ${genesResult.genes.length - 500} more genes`;
-                    option.disabled = true;
-                    geneSelect.appendChild(option);
-                }
-            }
+            // Populate genes dropdown for heatmap (gene_name as value: we want the actual gene name)
+            await this.setupGeneSearch('heatmapGenesViz', 'Select genes for heatmap...', 'gene_name', 100);
             
             // Populate group columns dropdown
             const columnsResponse = await fetch('/available_columns');
@@ -2077,12 +2067,20 @@ class GliomaScopeApp {
         }
     }
 
+    // Expression level of an analysis form: {level: 'probe'} or {level: 'gene', collapse_method}
+    getExpressionLevel(selectId) {
+        const select = document.getElementById(selectId);
+        const [level, method] = (select ? select.value : 'probe').split(':');
+        return method ? { level, collapse_method: method } : { level };
+    }
+
     async handlePCA(event) {
         event.preventDefault();
         
         const colorBy = document.getElementById('pcaColorBy').value;
         const data = {
-            color_by: colorBy || null
+            color_by: colorBy || null,
+            ...this.getExpressionLevel('pcaLevel')
         };
 
         this.showLoading();
@@ -2120,7 +2118,8 @@ class GliomaScopeApp {
         
         const colorBy = document.getElementById('umapColorBy').value;
         const data = {
-            color_by: colorBy || null
+            color_by: colorBy || null,
+            ...this.getExpressionLevel('umapLevel')
         };
 
         this.showLoading();
@@ -2305,7 +2304,8 @@ class GliomaScopeApp {
 
         const data = {
             genes: selectedGenes,
-            group_col: groupCol || null
+            group_col: groupCol || null,
+            ...this.getExpressionLevel('heatmapLevel')
         };
 
         this.showLoading();
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the app's modules as `src.…`, like Main.py and app.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
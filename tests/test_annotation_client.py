@@ -0,0 +1,163 @@
+'''AnnotationClient against a local http.server stub of the Ensembl REST API'''
+
+import json
+import time
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+import src.data_handling.Annotation_client as annotation
+from src.data_handling.Annotation_client import AnnotationClient
+from src.data_handling.Genome_reference import GenomeReference
+
+BANDS = {'top_level_region': [{'name': '17', 'coord_system': 'chromosome',
+                               'bands': [{'id': 'p13.1', 'start': 1, 'end': 10000000, 'stain': 'gneg'}]}]}
+
+
+class StubEnsembl(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None, headers=()):
+        data = json.dumps(body if body is not None else {'error': 'busy'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        stub = self.server
+        stub.requests.append(('GET', self.path))
+        if stub.busy > 0:
+            stub.busy -= 1
+            return self._reply(503, headers=[('Retry-After', str(stub.retry_after))])
+        self._reply(200, BANDS)
+
+    def do_POST(self):
+        stub = self.server
+        symbols = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['symbols']
+        stub.requests.append(('POST', symbols))
+        with stub.lock:
+            stub.in_flight += 1
+            stub.peak = max(stub.peak, stub.in_flight)
+        time.sleep(0.05)
+        with stub.lock:
+            stub.in_flight -= 1
+        # Unknown symbols are left out of the answer, as Ensembl does
+        self._reply(200, {symbol: {'seq_region_name': '17', 'start': 100, 'end': 200, 'strand': 1}
+                          for symbol in symbols if not symbol.startswith('BAD')})
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubEnsembl)
+    server.requests, server.busy, server.retry_after = [], 0, 0
+    server.lock, server.in_flight, server.peak = threading.Lock(), 0, 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub, tmp_path):
+    client = AnnotationClient(f"http://127.0.0.1:{stub.server_address[1]}", cache_dir=str(tmp_path),
+                              backoff=0.01, max_concurrent=2)
+    yield client
+    client.close()
+
+
+def test_503_is_retried_after_retry_after(stub, client):
+    stub.busy, stub.retry_after = 1, 0.2
+    start = time.perf_counter()
+    assert client.assembly_bands() == BANDS['top_level_region']
+    assert time.perf_counter() - start >= 0.2
+    assert len(stub.requests) == 2
+
+    # Served from the disk cache afterwards
+    assert client.assembly_bands() == BANDS['top_level_region']
+    assert len(stub.requests) == 2
+
+
+def test_gives_up_after_max_retries(stub, client):
+    stub.busy = client.max_retries + 1
+    with pytest.raises(requests.HTTPError):
+        client.get('info/assembly/homo_sapiens')
+    assert len(stub.requests) == client.max_retries + 1
+
+
+def test_connection_errors_raise_after_retries(tmp_path):
+    with ThreadingHTTPServer(('127.0.0.1', 0), StubEnsembl) as closed:
+        port = closed.server_address[1]
+    client = AnnotationClient(f"http://127.0.0.1:{port}", cache_dir=str(tmp_path), backoff=0.01, max_retries=1)
+    with pytest.raises(requests.ConnectionError):
+        client.get('info/assembly/homo_sapiens')
+
+
+def test_unreachable_server_is_not_asked_again_during_the_cooldown(tmp_path, monkeypatch):
+    with ThreadingHTTPServer(('127.0.0.1', 0), StubEnsembl) as closed:
+        port = closed.server_address[1]
+    client = AnnotationClient(f"http://127.0.0.1:{port}", cache_dir=str(tmp_path), backoff=0.01, max_retries=1)
+    with pytest.raises(requests.ConnectionError):
+        client.get('info/assembly/homo_sapiens')
+
+    attempts = []
+    answer = SimpleNamespace(status_code=200, raise_for_status=lambda: None, json=lambda: BANDS)
+    monkeypatch.setattr(client.session, 'request', lambda *args, **kwargs: attempts.append(args) or answer)
+    with pytest.raises(requests.ConnectionError, match='not retried'):
+        client.lookup_symbols(['TP53'])
+    assert attempts == []
+
+    # Asked again once the cooldown is over
+    client._unreachable_until = 0.0
+    assert client.assembly_bands() == BANDS['top_level_region']
+    assert len(attempts) == 1
+
+
+def test_symbols_are_cached_per_symbol(stub, client):
+    first = client.lookup_symbols(['TP53', 'EGFR', 'BAD1'])
+    assert first['TP53']['seq_region_name'] == '17'
+    assert first['BAD1'] is None
+    assert stub.requests == [('POST', ['TP53', 'EGFR', 'BAD1'])]
+
+    # Only the new symbol is asked for; known misses are not asked again
+    second = client.lookup_symbols(['egfr', 'BAD1', 'IDH1'])
+    assert stub.requests[1:] == [('POST', ['IDH1'])]
+    assert second['egfr'] == first['EGFR'] and second['BAD1'] is None and second['IDH1'] is not None
+
+
+def test_cache_entries_expire(stub, client):
+    client.lookup_symbols(['TP53'])
+    client.ttl = 1e-9
+    client.lookup_symbols(['TP53'])
+    assert [symbols for _, symbols in stub.requests] == [['TP53'], ['TP53']]
+
+
+def test_bulk_posts_are_batched_and_bounded(stub, client, monkeypatch):
+    monkeypatch.setattr(annotation, 'SYMBOL_BATCH', 10)
+    symbols = [f"GENE{i}" for i in range(45)]
+    found = client.lookup_symbols(symbols)
+
+    posts = [batch for method, batch in stub.requests if method == 'POST']
+    assert sorted(len(batch) for batch in posts) == [5, 10, 10, 10, 10]
+    assert sorted(symbol for batch in posts for symbol in batch) == sorted(symbols)
+    assert stub.peak <= client.max_concurrent
+    assert all(found[symbol] is not None for symbol in symbols)
+
+
+def test_failed_band_fetch_is_remembered(stub, client, tmp_path):
+    reference = GenomeReference(str(tmp_path / 'reference'))
+    stub.busy = client.max_retries + 1
+    with pytest.raises(requests.HTTPError):
+        reference.refresh_from_ensembl(bands=True, client=client)
+    assert not reference.has_bands and not reference.band_fetch_due
+
+    reference.refresh_from_ensembl(bands=True, client=client)
+    assert reference.has_bands and reference.band_fetch_due
@@ -0,0 +1,35 @@
+'''Appending samples while the store is written in the background'''
+
+import numpy as np
+import pandas as pd
+from src.data_handling.Data_loader import DataManager
+from src.data_handling.Expression_store import ExpressionStore
+
+
+def _manager():
+    manager = DataManager()
+    manager.load_metadata_df(pd.DataFrame({'Sample': ['S1', 'S2', 'S3']}))
+    manager.load_expression_df(ExpressionStore(np.arange(6, dtype=np.float32).reshape(3, 2),
+                                               ['S1', 'S2', 'S3'], ['P1', 'P2']))
+    return manager
+
+
+def test_saved_copy_is_not_adopted_after_an_append(tmp_path):
+    manager = _manager()
+    store = manager.expression_store
+    saved = ExpressionStore.open(store.snapshot().save(str(tmp_path / 'expression.store')))
+
+    manager.append_samples(pd.DataFrame({'Sample': ['S4'], 'P1': [6.0], 'P2': [7.0]}))
+    assert not manager.adopt_saved_store(store, saved)
+    assert manager.expression_store is store
+    assert list(manager.expression_store.samples) == ['S1', 'S2', 'S3', 'S4']
+
+
+def test_saved_copy_is_adopted_without_an_append(tmp_path):
+    manager = _manager()
+    store = manager.expression_store
+    saved = ExpressionStore.open(store.snapshot().save(str(tmp_path / 'expression.store')))
+
+    assert manager.adopt_saved_store(store, saved)
+    assert manager.expression_store is saved and saved.is_memory_mapped
+    assert manager.alignment.n_matched == 3
@@ -0,0 +1,46 @@
+'''Normalized clinical labels from GEO characteristics fields'''
+
+import pandas as pd
+import pytest
+from src.data_handling.Characteristics import expand_characteristics, _grade, _idh, _mgmt
+
+
+@pytest.mark.parametrize('value, label', [
+    ('methylated', 'methylated'), ('M', 'methylated'), ('hypermethylated', 'methylated'),
+    ('unmethylated', 'unmethylated'), ('Un-methylated', 'unmethylated'), ('U', 'unmethylated'),
+    ('non-methylated', 'unmethylated'), ('not methylated', 'unmethylated'),
+    ('methylation not detected', 'unmethylated'), ('negative', 'unmethylated'),
+])
+def test_mgmt(value, label):
+    assert _mgmt(value) == label
+
+
+@pytest.mark.parametrize('value, label', [
+    ('mutant', 'mutant'), ('IDH-mutant', 'mutant'), ('Mutated', 'mutant'), ('IDH1 R132H', 'mutant'),
+    ('wildtype', 'wildtype'), ('WT', 'wildtype'), ('non-mutant', 'wildtype'),
+    ('not mutated', 'wildtype'), ('no mutation', 'wildtype'), ('R132H not detected', 'wildtype'),
+])
+def test_idh(value, label):
+    assert _idh(value) == label
+
+
+@pytest.mark.parametrize('value, label', [
+    ('WHO grade IV', 'IV'), ('4', 'IV'), ('g3', 'III'), ('Grade II (2016)', 'II'),
+    ('II-III', 'II-III'), ('Grade I/II', 'I-II'), ('grade 2-3', 'II-III'),
+    ('primary GBM', 'primary GBM'),
+])
+def test_grade(value, label):
+    assert _grade(value) == label
+
+
+def test_expand_characteristics():
+    metadata = pd.DataFrame({
+        'Sample': ['GSM1', 'GSM2', 'GSM3'],
+        'characteristics_ch1': ['mgmt status: not methylated', 'mgmt status: methylated', 'mgmt status: NA'],
+        'characteristics_ch1.1': ['idh1 status: no mutation', 'idh1 status: R132H', 'idh1 status: wt'],
+        'characteristics_ch1.2': ['grade: II-III', 'grade: IV', 'grade: Grade I/II'],
+    })
+    expanded = expand_characteristics(metadata)
+    assert expanded['mgmt'].tolist()[:2] == ['unmethylated', 'methylated'] and pd.isna(expanded['mgmt'][2])
+    assert expanded['idh'].tolist() == ['wildtype', 'mutant', 'wildtype']
+    assert expanded['grade'].tolist() == ['II-III', 'IV', 'I-II']
@@ -0,0 +1,76 @@
+'''Block-parallel CSV ingest: float32 matrix, column order, compressed input and the pandas fallback'''
+
+import gzip
+import numpy as np
+import pandas as pd
+import pytest
+from src.utils import Ingest
+from src.utils.Ingest import read_table
+
+
+def _expression_frame(n_samples=120, n_genes=40):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(np.round(rng.random((n_samples, n_genes)) * 10, 3),
+                      columns=[f"G{j}" for j in range(n_genes)])
+    df.insert(0, 'Sample', [f"S{i}" for i in range(n_samples)])
+    df.insert(1, 'batch', ['a' if i % 2 else 'b' for i in range(n_samples)])
+    return df
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # Many blocks and pandas chunks even for a small file
+    monkeypatch.setattr(Ingest, 'BLOCK_SIZE', 2000)
+    monkeypatch.setattr(Ingest, 'CHUNK_CELLS', 1000)
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_blocks_fill_one_float32_matrix_in_file_order(tmp_path, small_blocks, compressed):
+    expected = _expression_frame()
+    path = tmp_path / ('expression.csv.gz' if compressed else 'expression.csv')
+    with (gzip.open(path, 'wt') if compressed else open(path, 'w')) as f:
+        expected.to_csv(f, index=False)
+
+    df, stats = read_table(str(path))
+
+    assert list(df.columns) == list(expected.columns)
+    assert stats.float32_columns == 40 and (df.dtypes.iloc[2:] == np.float32).all()
+    assert df['Sample'].tolist() == expected['Sample'].tolist()
+    assert df['batch'].tolist() == expected['batch'].tolist()
+    np.testing.assert_allclose(df.iloc[:, 2:].to_numpy(np.float64), expected.iloc[:, 2:].to_numpy(), rtol=1e-6)
+
+
+def test_text_further_down_falls_back_to_chunked_pandas(tmp_path, small_blocks):
+    expected = _expression_frame()
+    expected['G3'] = expected['G3'].astype(object)
+    expected.loc[100, 'G3'] = 'oops'
+    path = tmp_path / 'expression.csv'
+    expected.to_csv(path, index=False)
+
+    df, stats = read_table(str(path))
+
+    assert list(df.columns) == list(expected.columns)
+    assert stats.float32_columns == 39 and df['G3'].dtype == object
+    assert df.loc[100, 'G3'] == 'oops' and float(df.loc[0, 'G3']) == pytest.approx(expected.loc[0, 'G3'], rel=1e-6)
+    genes = [col for col in expected.columns[2:] if col != 'G3']
+    np.testing.assert_allclose(df[genes].to_numpy(np.float64), expected[genes].to_numpy(np.float64), rtol=1e-6)
+
+
+def test_metadata_keeps_its_types(tmp_path, small_blocks):
+    path = tmp_path / 'metadata.tsv'
+    path.write_text('Sample\tage\tgrade\tnote\nS1\t54\tIV\t\nS2\t\tII\t\nS3\t61\t\t\n')
+
+    df, stats = read_table(str(path))
+
+    assert stats.float32_columns == 0
+    assert df['age'].tolist()[::2] == [54, 61] and np.isnan(df['age'][1])
+    assert df['grade'].tolist() == ['IV', 'II', None]
+    assert df['note'].isna().all()
+
+
+def test_header_only_file(tmp_path):
+    path = tmp_path / 'empty.csv'
+    path.write_text('Sample,G1,G2\n')
+
+    df, _ = read_table(str(path))
+    assert df.empty and list(df.columns) == ['Sample', 'G1', 'G2']
@@ -0,0 +1,39 @@
+'''Series-matrix import: the expression table is streamed up to its end marker, malformed rows are errors'''
+
+import gzip
+import os
+import numpy as np
+import pyarrow as pa
+import pytest
+from src.data_handling.Series_matrix import parse_series_matrix
+
+HEADER = ('!Series_title\t"Glioma test series"\n'
+          '!Sample_geo_accession\t"GSM1"\t"GSM2"\t"GSM3"\n'
+          '!Sample_characteristics_ch1\t"grade: IV"\t"grade: II"\t"grade: III"\n'
+          '!series_matrix_table_begin\n'
+          '"ID_REF"\t"GSM1"\t"GSM2"\t"GSM3"\n')
+ROWS = ['"P1"\t1.5\t2.5\t3.5', '"P2"\t4\t5\t6', '"P3"\t7\t8\t9', '"P4"\t10\t11\t12']
+
+
+def _write(path, rows):
+    with gzip.open(path, 'wt') as f:
+        f.write(HEADER + '\n'.join(rows) + '\n!series_matrix_table_end\n')
+    return str(path)
+
+
+def test_table_end_marker_is_skipped(tmp_path):
+    path = _write(tmp_path / 'GSE1_series_matrix.txt.gz', ROWS)
+    metadata, store = parse_series_matrix(path, str(tmp_path / 'expression'))
+
+    assert list(store.probes) == ['P1', 'P2', 'P3', 'P4']
+    assert list(store.samples) == ['GSM1', 'GSM2', 'GSM3']
+    np.testing.assert_array_equal(np.asarray(store.values)[:, 0], [1.5, 2.5, 3.5])
+    assert len(metadata) == 3
+
+
+@pytest.mark.parametrize('bad_row', ['"P3"\t7\t8', '"P3"\t7\t8\t9\t10'])
+def test_short_or_long_rows_are_errors(tmp_path, bad_row):
+    path = _write(tmp_path / 'GSE1_series_matrix.txt.gz', ROWS[:2] + [bad_row] + ROWS[3:])
+    with pytest.raises(pa.ArrowInvalid, match='P3'):
+        parse_series_matrix(path, str(tmp_path / 'expression'))
+    assert not os.path.exists(tmp_path / 'expression') and not os.path.exists(tmp_path / 'expression.tmp')
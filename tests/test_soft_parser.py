@@ -0,0 +1,133 @@
+'''Streaming SOFT family parser against GEOparse, and fetch_and_format_geo on parsed series'''
+
+import os
+import gzip
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+import GEOparse
+from conftest import FIXTURES
+from src.data_handling.Soft_parser import parse_family_soft
+from src.data_handling.Data_loader import DataManager
+from src.data_handling.Persistence_queue import persistence_queue
+from src.data_handling.Geo_cache import geo_cache
+import src.utils.Utils as Utils
+
+SOFT_FILE = os.path.join(FIXTURES, 'GSE99001_family.soft.gz')
+
+
+@pytest.fixture(scope='module')
+def geoparse_series():
+    return GEOparse.get_GEO(filepath=SOFT_FILE, geotype='GSE', silent=True)
+
+
+def _as_frame(store):
+    return pd.DataFrame(np.asarray(store.values, dtype=np.float64), index=store.samples, columns=store.probes)
+
+
+@pytest.mark.parametrize('saved', [False, True])
+def test_values_match_geoparse_pivot(geoparse_series, tmp_path, saved):
+    directory = str(tmp_path / 'expression.store') if saved else None
+    metadata, store = parse_family_soft(SOFT_FILE, directory=directory)
+
+    expected = geoparse_series.pivot_samples('VALUE').T
+    assert store.dtype == np.float32
+    assert list(store.samples) == list(expected.index)
+    assert set(store.probes) == set(expected.columns)
+    # GSM9002 lists its probes in another order and has a 'null' VALUE; GSM9003 lacks P4
+    pd.testing.assert_frame_equal(_as_frame(store)[expected.columns], expected, check_names=False)
+    assert store.is_memory_mapped == saved
+
+
+def test_metadata_matches_geoparse(geoparse_series):
+    metadata, _ = parse_family_soft(SOFT_FILE)
+
+    assert list(metadata['Sample']) == list(geoparse_series.gsms)
+    for _, row in metadata.iterrows():
+        gsm = geoparse_series.gsms[row['Sample']]
+        assert row['title'] == gsm.metadata['title'][0]
+        assert row['platform_id'] == gsm.metadata['platform_id'][0]
+        characteristics = gsm.metadata['characteristics_ch1']
+        assert [row['characteristics_ch1'], row['characteristics_ch1.1']] == characteristics
+
+
+@pytest.fixture
+def geo_workdir(tmp_path, monkeypatch):
+    """Empty working directory with the fixture as the 'downloaded' SOFT file (no network)"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('uploads')
+
+    def get_geo_file(geo_id, destdir, annotate_gpl):
+        return os.path.join(destdir, f"{geo_id}_family.soft.gz"), 'GSE'
+
+    monkeypatch.setattr(Utils.GEOparse, 'get_GEO_file', get_geo_file)
+    yield tmp_path
+    persistence_queue.flush()
+
+
+NEW_SAMPLE = pd.DataFrame({'Sample': ['GSM_NEW'], 'P1': [1.0], 'P2': [2.0], 'P3': [3.0], 'P4': [4.0]})
+
+
+def _manager(metadata, store):
+    manager = DataManager()
+    manager.load_metadata_df(metadata)
+    manager.load_expression_df(store)
+    return manager
+
+
+def test_cached_loads_are_the_callers_own_copy(geo_workdir):
+    shutil.copy(SOFT_FILE, os.path.join('uploads', 'GSE99001_family.soft.gz'))
+    metadata, store = Utils.fetch_and_format_geo('GSE99001', save=False)
+    assert store.shape == (3, 4)
+    assert persistence_queue.wait('geo_cache/GSE99001')
+
+    # Checked out into the caller's directory (hard links), or read into memory without one
+    workspace_store = os.path.join('workspace', 'expression.store')
+    cached_metadata, cached = Utils.fetch_and_format_geo('GSE99001', save=False, expression_dir=workspace_store)
+    assert cached.path == workspace_store
+    assert not os.path.exists(os.path.join('cleaned_data', 'GSE99001_expression.store'))
+    np.testing.assert_array_equal(np.asarray(cached.values), np.asarray(store.values))
+    assert list(cached_metadata['Sample']) == list(metadata['Sample'])
+    _, in_memory = Utils.fetch_and_format_geo('GSE99001', save=False)
+    assert in_memory.path is None
+
+    for loaded in (cached, in_memory):
+        _manager(cached_metadata, loaded).append_samples(NEW_SAMPLE)
+        assert loaded.n_samples == 4
+        _, again = Utils.fetch_and_format_geo('GSE99001', save=False)
+        assert list(again.samples) == ['GSM9001', 'GSM9002', 'GSM9003']
+
+
+@pytest.mark.parametrize('saved', [False, True])
+def test_append_before_the_cache_write_does_not_reach_the_snapshot(geo_workdir, saved):
+    shutil.copy(SOFT_FILE, os.path.join('uploads', 'GSE99001_family.soft.gz'))
+    # Hold the writer so the append certainly happens before the snapshot is written
+    release = threading.Event()
+    persistence_queue.submit('test/hold', release.wait)
+    expression_dir = os.path.join('workspace', 'expression.store') if saved else None
+    metadata, store = Utils.fetch_and_format_geo('GSE99001', save=False, expression_dir=expression_dir)
+    _manager(metadata, store).append_samples(NEW_SAMPLE)
+    release.set()
+    assert persistence_queue.wait('geo_cache/GSE99001')
+
+    _, cached = Utils.fetch_and_format_geo('GSE99001', save=False)
+    assert list(cached.samples) == ['GSM9001', 'GSM9002', 'GSM9003']
+    assert list(store.samples) == ['GSM9001', 'GSM9002', 'GSM9003', 'GSM_NEW']
+
+
+def test_fetch_series_without_data_tables(geo_workdir):
+    # GSMs without data tables (e.g. data only in supplementary files) parse to 0 probes
+    soft = '\n'.join(['^SERIES = GSE99002', '!Series_sample_id = GSM9101', '!Series_sample_id = GSM9102',
+                      '^SAMPLE = GSM9101', '!Sample_title = Tumour', '^SAMPLE = GSM9102', '!Sample_title = Normal'])
+    with gzip.open(os.path.join('uploads', 'GSE99002_family.soft.gz'), 'wt') as f:
+        f.write(soft + '\n')
+
+    for save in (False, True):
+        metadata, expression = Utils.fetch_and_format_geo('GSE99002', save=save)
+        assert expression is None
+        assert list(metadata['Sample']) == ['GSM9101', 'GSM9102']
+    persistence_queue.flush()
+    assert geo_cache.list() == []
+    assert not os.path.exists(os.path.join('cleaned_data', 'GSE99002_expression.store'))